@@ -0,0 +1,175 @@
+import asyncio
+import os
+import threading
+from saveddit.http_client import HttpClient, IncompleteDownload, PartialDownload, get_http_client
+from saveddit.rate_limiter import RateLimiter, Throttled, get_rate_limiter, parse_retry_after
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncDownloadEngine:
+    '''
+    asyncio-based engine for the byte transfers of a submission
+
+    A single event loop runs on a background thread for the whole process.
+    Callers on any thread hand it a batch of (url, save_path) jobs and block
+    until the batch is done, while a process-wide semaphore caps how many
+    transfers are in flight at once. Thousands of small image downloads can
+    therefore share one thread and one connection pool.
+
+    Requires the optional `aiohttp` dependency (pip install saveddit[async]).
+    '''
+    DEFAULT_MAX_CONCURRENCY = 64
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=HttpClient.DEFAULT_TIMEOUT):
+        if aiohttp == None:
+            raise ImportError("The async download engine requires aiohttp (pip install aiohttp)")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self.loop).result()
+
+    async def _setup(self):
+        # Created on the loop thread so that they are bound to self.loop
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout),
+            headers={"User-Agent": HttpClient.USER_AGENT})
+
+    async def _fetch(self, url, save_path, timeout=None, retries=HttpClient.DEFAULT_RETRIES):
+        # Same .part/Range resume and rate limiting logic as HttpClient.download
+        async with self.semaphore:
+            limiter = get_rate_limiter().for_url(url)
+            partial = PartialDownload(save_path)
+            request_options = {}
+            if timeout != None:
+                request_options["timeout"] = aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+            attempt = 0
+            while True:
+                await limiter.acquire_async()
+                status_code = None
+                retry_after = None
+                try:
+                    async with self.session.get(url, headers=partial.request_headers(), **request_options) as response:
+                        status_code = response.status
+                        retry_after = response.headers.get("Retry-After")
+                        if status_code in RateLimiter.THROTTLE_STATUSES:
+                            raise Throttled(url, parse_retry_after(retry_after))
+                        if partial.already_complete(response.status, response.headers.get("Content-Range")):
+                            return partial.finish()
+                        response.raise_for_status()
+                        partial.begin(response.status, response.headers.get("Content-Length"))
+                        try:
+                            async for chunk in response.content.iter_chunked(HttpClient.DEFAULT_CHUNK_SIZE):
+                                partial.write(chunk)
+                        finally:
+                            partial.close()
+                        return partial.finish()
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                        asyncio.TimeoutError, IncompleteDownload, Throttled):
+                    attempt += 1
+                    if attempt > retries:
+                        raise
+                finally:
+                    limiter.release(status_code, retry_after)
+
+    async def _fetch_batch(self, jobs, on_done, max_concurrency, options):
+        # Optional cap for this batch only, on top of the engine's own
+        batch_limit = asyncio.Semaphore(max_concurrency or len(jobs))
+
+        async def fetch_one(url, save_path):
+            try:
+                async with batch_limit:
+                    return await self._fetch(url, save_path, **options)
+            except Exception as e:
+                return e
+            finally:
+                if on_done:
+                    on_done()
+        return await asyncio.gather(*[fetch_one(url, save_path) for url, save_path in jobs])
+
+    def fetch_many(self, jobs, on_done=None, max_concurrency=None, **kwargs):
+        '''
+        Downloads all (url, save_path) pairs in `jobs` concurrently, at most
+        `max_concurrency` of them at a time if given
+
+        Same contract as HttpClient.fetch_many: returns a list aligned with
+        `jobs` holding a DownloadResult or the exception raised. `timeout`
+        and `retries` can be given as keyword arguments.
+        '''
+        if not jobs:
+            return []
+        future = asyncio.run_coroutine_threadsafe(
+            self._fetch_batch(jobs, on_done, max_concurrency, kwargs), self.loop)
+        return future.result()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+_download_engine = None
+_download_engine_lock = threading.Lock()
+# AsyncDownloadEngine arguments, None for the sync engine
+_download_engine_options = None
+
+
+def configure_download_engine(config):
+    '''
+    Selects the engine used for media transfers from the optional
+    `download_engine` ("sync" or "async") and `async_max_concurrency` keys in
+    user_config.yaml. Falls back to the pooled synchronous client when
+    aiohttp is not installed. The async engine is started on first use.
+    '''
+    global _download_engine, _download_engine_options
+    config = config or {}
+    options = None
+    if config.get("download_engine", "sync") == "async":
+        if aiohttp == None:
+            print("download_engine is set to `async` but aiohttp is not installed, using the sync engine")
+        else:
+            options = {
+                "max_concurrency": config.get("async_max_concurrency") or AsyncDownloadEngine.DEFAULT_MAX_CONCURRENCY,
+                "timeout": config.get("http_timeout") or HttpClient.DEFAULT_TIMEOUT,
+            }
+    with _download_engine_lock:
+        engine, _download_engine = _download_engine, None
+        _download_engine_options = options
+    if engine != None:
+        engine.close()
+
+
+def get_download_engine():
+    '''
+    Returns the object used for batched media transfers, i.e., the async
+    engine when one is configured and the shared HttpClient otherwise
+    '''
+    global _download_engine
+    with _download_engine_lock:
+        if _download_engine_options == None:
+            engine = None
+        else:
+            if _download_engine == None:
+                _download_engine = AsyncDownloadEngine(**_download_engine_options)
+            engine = _download_engine
+    if engine == None:
+        return get_http_client()
+    return engine
+
+
+def _reset_after_fork():
+    # The event loop thread of the parent does not exist in a forked child,
+    # which starts its own engine on first use
+    global _download_engine, _download_engine_lock
+    _download_engine = None
+    _download_engine_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+import collections
+from praw.const import API_PATH
+from praw.models import MoreComments
+import prawcore
+from saveddit.rate_limiter import get_rate_limiter
+
+
+class CommentExpander:
+    '''
+    Concurrent replacement for CommentForest.replace_more
+
+    replace_more resolves one MoreComments at a time, i.e., one
+    /api/morechildren request after another. CommentExpander works in
+    rounds instead: every MoreComments of the current tree is collected, their
+    children ids are packed into requests of up to MAX_CHILDREN_PER_REQUEST
+    ids, and those requests are sent by `workers` threads at once, paced by
+    the shared rate limiter for the reddit API host. The MoreComments found
+    among the comments returned make up the next round.
+
+    Only the public interface of PRAW's comment forest is used, so the
+    submission's CommentForest is left as PRAW built it: the comments
+    returned are kept by parent, and `comments` walks the forest with them
+    in place of the MoreComments.
+    '''
+    MAX_CHILDREN_PER_REQUEST = 100
+    DEFAULT_WORKERS = 4
+    DEFAULT_RETRIES = 3
+    API_HOST = "oauth.reddit.com"
+
+    def __init__(self, submission, workers=DEFAULT_WORKERS):
+        self.submission = submission
+        self.reddit = submission._reddit
+        self.workers = workers
+        self.limiter = get_rate_limiter().for_host(CommentExpander.API_HOST)
+        # parent fullname => comments fetched for it, in the order returned
+        self.fetched = {}
+
+    def expand(self, limit=None):
+        '''
+        Replaces up to `limit` MoreComments (all of them with None, none with
+        0, like replace_more) and returns the ones that were not replaced
+        '''
+        pending = CommentExpander.gather(self.submission.comments)
+        remaining = limit
+        unresolved = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending:
+                items = sorted(pending)  # most children first
+                if remaining != None:
+                    unresolved.extend(items[remaining:])
+                    items = items[:remaining]
+                    remaining -= len(items)
+                if not items:
+                    break
+
+                new_comments = []
+                for comments in executor.map(self.fetch, self.batches(items)):
+                    new_comments.extend(comments)
+                for comment in new_comments:
+                    comment.submission = self.submission
+                    self.fetched.setdefault(comment.parent_id, []).append(comment)
+                pending = CommentExpander.gather(new_comments)
+                for more in pending:
+                    more.submission = self.submission
+        return unresolved
+
+    @staticmethod
+    def gather(comments):
+        '''
+        Returns the MoreComments among `comments` and their replies
+        '''
+        more = []
+        queue = collections.deque(comments)
+        while queue:
+            comment = queue.popleft()
+            if isinstance(comment, MoreComments):
+                more.append(comment)
+            else:
+                queue.extend(comment.replies)
+        return more
+
+    def comments(self):
+        '''
+        Yields the comments of the submission in the order of
+        CommentForest.list() after replace_more: breadth first, the comments
+        fetched by `expand` in place of their MoreComments, and none of the
+        MoreComments left
+        '''
+        seen = set()
+        queue = collections.deque(self.children(self.submission.fullname, self.submission.comments))
+        while queue:
+            comment = queue.popleft()
+            if isinstance(comment, MoreComments) or comment.fullname in seen:
+                continue
+            seen.add(comment.fullname)
+            yield comment
+            queue.extend(self.children(comment.fullname, comment.replies))
+
+    def children(self, fullname, replies):
+        # The fetched comments come after the replies they were missing from
+        return list(replies) + self.fetched.get(fullname, [])
+
+    def batches(self, items):
+        '''
+        "Continue this thread" links need a request of their own, the others
+        are packed together by children ids
+        '''
+        batches = []
+        children = []
+        for item in items:
+            if item.count == 0:
+                batches.append(item)
+                continue
+            for child in item.children:
+                children.append(child)
+                if len(children) == CommentExpander.MAX_CHILDREN_PER_REQUEST:
+                    batches.append(children)
+                    children = []
+        if children:
+            batches.append(children)
+        return batches
+
+    def fetch(self, batch):
+        for attempt in range(CommentExpander.DEFAULT_RETRIES + 1):
+            self.limiter.acquire()
+            status_code = None
+            retry_after = None
+            try:
+                if isinstance(batch, MoreComments):
+                    comments = list(batch.comments(update=False))
+                else:
+                    comments = self.reddit.post(API_PATH["morechildren"], data={
+                        "children": ",".join(batch),
+                        "link_id": self.submission.fullname,
+                        "sort": getattr(self.submission, "comment_sort", "confidence"),
+                    })
+                status_code = 200
+                return comments
+            except prawcore.exceptions.ResponseException as e:
+                status_code = e.response.status_code
+                retry_after = e.response.headers.get("retry-after")
+                if status_code != 429 and status_code < 500:
+                    raise
+                if attempt == CommentExpander.DEFAULT_RETRIES:
+                    raise
+            finally:
+                self.limiter.release(status_code, retry_after)
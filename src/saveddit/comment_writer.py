@@ -0,0 +1,97 @@
+import gzip
+import io
+import json
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CommentWriter:
+    '''
+    Writes the comments of a submission to disk
+
+    `json` (the default) writes comments.json as one indented JSON array.
+    `ndjson` writes comments.ndjson with one JSON object per line as soon as
+    each comment is handed over, so memory use does not grow with the size
+    of the thread and the file can be read as a stream. NDJSON output can
+    be compressed with gzip (.ndjson.gz) or zstd (.ndjson.zst, needs the
+    optional zstandard package).
+
+    Given a MetadataArchive, no file is written and comments are added to
+    the archive in batches of BATCH_SIZE instead.
+    '''
+    JSON = "json"
+    NDJSON = "ndjson"
+
+    GZIP = "gzip"
+    ZSTD = "zstd"
+    EXTENSIONS = {None: "", GZIP: ".gz", ZSTD: ".zst"}
+
+    BATCH_SIZE = 500
+
+    format = JSON
+    compression = None
+
+    def __init__(self, output_dir, archive=None):
+        self.path = os.path.join(output_dir, CommentWriter.file_name())
+        self.archive = archive
+        self.file = None
+        self.records = []
+
+    @staticmethod
+    def file_name():
+        if CommentWriter.format == CommentWriter.NDJSON:
+            return "comments.ndjson" + CommentWriter.EXTENSIONS[CommentWriter.compression]
+        return "comments.json"
+
+    def __enter__(self):
+        if self.archive != None:
+            return self
+        if CommentWriter.format == CommentWriter.NDJSON and CommentWriter.compression == CommentWriter.GZIP:
+            self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        elif CommentWriter.format == CommentWriter.NDJSON and CommentWriter.compression == CommentWriter.ZSTD:
+            writer = zstandard.ZstdCompressor().stream_writer(open(self.path, 'wb'))
+            self.file = io.TextIOWrapper(writer, encoding='utf-8')
+        else:
+            self.file = open(self.path, 'w')
+        return self
+
+    def write(self, record):
+        if self.archive != None:
+            self.records.append(record)
+            if len(self.records) >= CommentWriter.BATCH_SIZE:
+                self.archive.add_comments(self.records)
+                self.records = []
+        elif CommentWriter.format == CommentWriter.NDJSON:
+            self.file.write(json.dumps(record) + "\n")
+        else:
+            self.records.append(record)
+
+    def __exit__(self, *args):
+        if self.archive != None:
+            if self.records:
+                self.archive.add_comments(self.records)
+            return
+        try:
+            if CommentWriter.format != CommentWriter.NDJSON and self.records:
+                self.file.write(json.dumps(self.records, indent=2))
+        finally:
+            self.file.close()
+
+
+def configure_comment_writer(config):
+    '''
+    Reads the optional `comments_format` (json or ndjson) and
+    `comments_compression` (gzip or zstd, ndjson only) keys in
+    user_config.yaml
+    '''
+    config = config or {}
+    CommentWriter.format = config.get("comments_format") or CommentWriter.JSON
+    compression = config.get("comments_compression") or None
+    if compression == CommentWriter.ZSTD and zstandard == None:
+        print("comments_compression is set to `zstd` but zstandard is not installed, using gzip")
+        compression = CommentWriter.GZIP
+    CommentWriter.compression = compression
@@ -0,0 +1,183 @@
+from collections import namedtuple
+import re
+from urllib.parse import urljoin
+import xml.etree.ElementTree as ElementTree
+
+
+# One encoding of a stream in a DASH manifest. `urls` is the list of URLs
+# whose bodies, concatenated in order, make up the stream: a single file
+# for on-demand profiles, or an initialization segment followed by the
+# media segments for segmented ones.
+Representation = namedtuple("Representation", ["kind", "bandwidth", "height", "urls"])
+
+
+class DashManifest:
+    '''
+    Parser for the DASH manifests (DASHPlaylist.mpd) of reddit videos
+
+    Supports representations addressed by a BaseURL, a SegmentList, or a
+    SegmentTemplate with `$Number$` (optionally with a SegmentTimeline),
+    which covers what v.redd.it serves. `select` picks one video and one
+    audio representation by quality policy, see configure_video_quality.
+    '''
+    max_height = None     # e.g., 480 to archive at most 480p
+    max_bandwidth = None  # bits per second
+
+    NAMESPACE_REGEX = re.compile(r'^\{[^}]*\}')
+    DURATION_REGEX = re.compile(r'^PT(?:(\d+(?:\.\d+)?)H)?(?:(\d+(?:\.\d+)?)M)?(?:(\d+(?:\.\d+)?)S)?$')
+
+    def __init__(self, representations):
+        self.representations = representations
+
+    @staticmethod
+    def parse(text, manifest_url):
+        root = ElementTree.fromstring(text)
+        DashManifest.strip_namespaces(root)
+        duration = DashManifest.parse_duration(root.get("mediaPresentationDuration"))
+        base_url = DashManifest.base_url(root, manifest_url)
+        representations = []
+        for period in root.findall("Period"):
+            period_url = DashManifest.base_url(period, base_url)
+            period_duration = DashManifest.parse_duration(period.get("duration")) or duration
+            for adaptation_set in period.findall("AdaptationSet"):
+                set_url = DashManifest.base_url(adaptation_set, period_url)
+                for representation in adaptation_set.findall("Representation"):
+                    kind = DashManifest.kind(adaptation_set, representation)
+                    if kind == None:
+                        continue
+                    urls = DashManifest.urls(adaptation_set, representation, set_url, period_duration)
+                    if not urls:
+                        continue
+                    representations.append(Representation(
+                        kind,
+                        int(representation.get("bandwidth") or 0),
+                        int(representation.get("height") or adaptation_set.get("height") or 0),
+                        urls))
+        return DashManifest(representations)
+
+    def select(self, kind, max_height=None, max_bandwidth=None):
+        '''
+        Returns the best representation of `kind` ("video" or "audio") that
+        fits `max_height` and `max_bandwidth` (bits per second), the
+        smallest one if none fits, or None if the manifest has none
+        '''
+        if max_height == None:
+            max_height = DashManifest.max_height
+        if max_bandwidth == None:
+            max_bandwidth = DashManifest.max_bandwidth
+        candidates = [r for r in self.representations if r.kind == kind]
+        if not candidates:
+            return None
+        fitting = [r for r in candidates
+                   if (max_height == None or kind != "video" or r.height <= max_height)
+                   and (max_bandwidth == None or r.bandwidth <= max_bandwidth)]
+        if fitting:
+            return max(fitting, key=lambda r: (r.height, r.bandwidth))
+        return min(candidates, key=lambda r: (r.height, r.bandwidth))
+
+    @staticmethod
+    def strip_namespaces(root):
+        for element in root.iter():
+            element.tag = DashManifest.NAMESPACE_REGEX.sub("", element.tag)
+
+    @staticmethod
+    def parse_duration(value):
+        '''
+        PT1M3.5S -> 63.5
+        '''
+        match = DashManifest.DURATION_REGEX.match(value or "")
+        if match == None:
+            return None
+        hours, minutes, seconds = [float(group or 0) for group in match.groups()]
+        return hours * 3600 + minutes * 60 + seconds
+
+    @staticmethod
+    def base_url(element, parent_url):
+        base = element.find("BaseURL")
+        if base == None or not (base.text or "").strip():
+            return parent_url
+        return urljoin(parent_url, base.text.strip())
+
+    @staticmethod
+    def kind(adaptation_set, representation):
+        content = (adaptation_set.get("contentType")
+                   or representation.get("mimeType")
+                   or adaptation_set.get("mimeType") or "")
+        if content.startswith("video"):
+            return "video"
+        if content.startswith("audio"):
+            return "audio"
+        return None
+
+    @staticmethod
+    def urls(adaptation_set, representation, base_url, duration):
+        representation_url = DashManifest.base_url(representation, base_url)
+
+        segment_list = representation.find("SegmentList")
+        if segment_list == None:
+            segment_list = adaptation_set.find("SegmentList")
+        if segment_list != None:
+            urls = []
+            initialization = segment_list.find("Initialization")
+            if initialization != None and initialization.get("sourceURL"):
+                urls.append(urljoin(representation_url, initialization.get("sourceURL")))
+            for segment in segment_list.findall("SegmentURL"):
+                urls.append(urljoin(representation_url, segment.get("media")))
+            return urls
+
+        template = representation.find("SegmentTemplate")
+        if template == None:
+            template = adaptation_set.find("SegmentTemplate")
+        if template != None:
+            return DashManifest.template_urls(template, representation, representation_url, duration)
+
+        if representation.find("BaseURL") != None:
+            return [representation_url]
+        return []
+
+    @staticmethod
+    def template_urls(template, representation, base_url, duration):
+        def expand(pattern, number=None, time=None):
+            value = pattern.replace("$RepresentationID$", representation.get("id") or "")
+            value = value.replace("$Bandwidth$", representation.get("bandwidth") or "")
+            if number != None:
+                value = re.sub(r'\$Number(%0(\d+)d)?\$',
+                               lambda m: str(number).zfill(int(m.group(2) or 0)), value)
+            if time != None:
+                value = value.replace("$Time$", str(time))
+            return urljoin(base_url, value.replace("$$", "$"))
+
+        urls = []
+        if template.get("initialization"):
+            urls.append(expand(template.get("initialization")))
+        media = template.get("media")
+        if not media:
+            return urls
+        number = int(template.get("startNumber") or 1)
+        timeline = template.find("SegmentTimeline")
+        if timeline != None:
+            time = 0
+            for s in timeline.findall("S"):
+                time = int(s.get("t") or time)
+                for _ in range(int(s.get("r") or 0) + 1):
+                    urls.append(expand(media, number, time))
+                    time += int(s.get("d"))
+                    number += 1
+        elif template.get("duration") and duration:
+            timescale = float(template.get("timescale") or 1)
+            count = int(-(-duration * timescale // float(template.get("duration"))))
+            for i in range(count):
+                urls.append(expand(media, number + i))
+        else:
+            return []
+        return urls
+
+
+def configure_video_quality(config):
+    '''
+    Reads the optional `video_max_height` and `video_max_bandwidth` keys in
+    user_config.yaml
+    '''
+    config = config or {}
+    DashManifest.max_height = config.get("video_max_height")
+    DashManifest.max_bandwidth = config.get("video_max_bandwidth")
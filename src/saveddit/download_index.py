@@ -0,0 +1,322 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class DownloadIndex:
+    '''
+    Local SQLite index of everything downloaded under one output root
+
+    Submissions are keyed by their reddit id, so a post is recognised no
+    matter which listing position (and therefore which `NNN_title`
+    directory) it shows up at. The database lives in
+    <output_path>/.saveddit/index.db and one instance is shared by every
+    downloader and worker thread writing to the same output root. Several
+    processes (see JobRunner) can use the same database, which is in WAL
+    mode and takes its write lock up front in multi-statement transactions.
+    '''
+    DIRECTORY_NAME = ".saveddit"
+    FILE_NAME = "index.db"
+
+    STATUS_IN_PROGRESS = "in_progress"
+    STATUS_COMPLETE = "complete"
+    STATUS_FAILED = "failed"
+    STATUS_THROTTLED = "throttled"
+
+    # Stages of a submission, see SubmissionDownloader
+    STAGE_MEDIA = "media"
+    STAGE_META = "meta"
+    STAGE_COMMENTS = "comments"
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+    # Instances of the parent in a forked child, kept so that their
+    # connections are neither used nor closed there
+    _inherited = []
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS submissions (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            url TEXT,
+            path TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS files (
+            submission_id TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER,
+            sha256 TEXT,
+            written_at REAL NOT NULL,
+            PRIMARY KEY (submission_id, path)
+        )''',
+        '''CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)''',
+        '''CREATE TABLE IF NOT EXISTS listing_marks (
+            source TEXT PRIMARY KEY,
+            fullname TEXT NOT NULL,
+            created_utc REAL,
+            updated_at REAL NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS url_verdicts (
+            url TEXT PRIMARY KEY,
+            verdict TEXT NOT NULL,
+            checked_at REAL NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS api_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS submission_stages (
+            submission_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            done_at REAL NOT NULL,
+            PRIMARY KEY (submission_id, stage)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS listing_cursors (
+            source TEXT PRIMARY KEY,
+            after TEXT,
+            position INTEGER,
+            finished INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS pending_retries (
+            source TEXT NOT NULL,
+            submission_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            added_at REAL NOT NULL,
+            PRIMARY KEY (source, submission_id)
+        )''',
+    ]
+
+    @staticmethod
+    def open(output_path):
+        '''
+        Returns the index for `output_path`, creating it on first use
+        '''
+        output_path = os.path.abspath(output_path)
+        with DownloadIndex._instances_lock:
+            index = DownloadIndex._instances.get(output_path)
+            if index == None:
+                index = DownloadIndex(output_path)
+                DownloadIndex._instances[output_path] = index
+            return index
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        index_dir = os.path.join(output_path, DownloadIndex.DIRECTORY_NAME)
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        self.path = os.path.join(index_dir, DownloadIndex.FILE_NAME)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            self.path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in DownloadIndex.SCHEMA:
+                self.connection.execute(statement)
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def get(self, submission_id):
+        rows = self.execute(
+            "SELECT * FROM submissions WHERE id = ?", (submission_id,))
+        if rows:
+            return dict(rows[0])
+        return None
+
+    def is_complete(self, submission_id):
+        record = self.get(submission_id)
+        return record != None and record["status"] == DownloadIndex.STATUS_COMPLETE
+
+    def start(self, submission_id, url, path):
+        now = time.time()
+        self.execute('''INSERT INTO submissions (id, status, url, path, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(id) DO UPDATE SET status = excluded.status,
+                            url = excluded.url, path = excluded.path,
+                            updated_at = excluded.updated_at''',
+                     (submission_id, DownloadIndex.STATUS_IN_PROGRESS, url, path, now, now))
+
+    def add_file(self, submission_id, path, size, sha256):
+        self.execute('''INSERT OR REPLACE INTO files (submission_id, path, size, sha256, written_at)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     (submission_id, path, size, sha256, time.time()))
+
+    def files(self, submission_id):
+        return [dict(row) for row in self.execute(
+            "SELECT * FROM files WHERE submission_id = ? ORDER BY path", (submission_id,))]
+
+    def finish(self, submission_id, status, submission_dir=None, results=()):
+        '''
+        Marks a submission as finished and records the files it produced
+
+        `results` are the DownloadResults of the media fetched for it. Any
+        other file found in `submission_dir` (youtube-dl and ffmpeg output,
+        submission.json, comments.json) is hashed and recorded as well.
+        '''
+        files = []
+        known = set()
+        for result in results:
+            files.append((result.path, result.size, result.sha256))
+            known.add(os.path.abspath(result.path))
+        if submission_dir != None:
+            for root, _, filenames in os.walk(submission_dir):
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    if os.path.abspath(path) not in known:
+                        files.append((path, os.path.getsize(path), DownloadIndex.hash_file(path)))
+
+        with self.lock:
+            self.execute("BEGIN IMMEDIATE")
+            try:
+                for path, size, sha256 in files:
+                    self.add_file(submission_id, path, size, sha256)
+                self.execute("UPDATE submissions SET status = ?, updated_at = ? WHERE id = ?",
+                             (status, time.time(), submission_id))
+                if status == DownloadIndex.STATUS_COMPLETE:
+                    self.execute("DELETE FROM submission_stages WHERE submission_id = ?", (submission_id,))
+                self.execute("COMMIT")
+            except Exception:
+                self.execute("ROLLBACK")
+                raise
+
+    def status_counts(self, since=0):
+        '''
+        Returns the number of submissions per status among those updated
+        since `since` (a time.time() timestamp)
+        '''
+        rows = self.execute(
+            "SELECT status, COUNT(*) AS count FROM submissions WHERE updated_at >= ? GROUP BY status",
+            (since,))
+        return {row["status"]: row["count"] for row in rows}
+
+    def get_stages(self, submission_id):
+        '''
+        Returns the stages (STAGE_*) an unfinished submission has completed
+        '''
+        return set(row["stage"] for row in self.execute(
+            "SELECT stage FROM submission_stages WHERE submission_id = ?", (submission_id,)))
+
+    def add_stage(self, submission_id, stage):
+        self.execute("INSERT OR REPLACE INTO submission_stages (submission_id, stage, done_at) VALUES (?, ?, ?)",
+                     (submission_id, stage, time.time()))
+
+    def get_cursor(self, source):
+        '''
+        Returns the journaled progress of a listing (see JournaledListing) as
+        a dict with `after`, `position` and `finished`
+        '''
+        rows = self.execute(
+            "SELECT * FROM listing_cursors WHERE source = ?", (source,))
+        if rows:
+            return dict(rows[0])
+        return None
+
+    def set_cursor(self, source, after, position):
+        self.execute('''INSERT INTO listing_cursors (source, after, position, finished, updated_at)
+                        VALUES (?, ?, ?, 0, ?)
+                        ON CONFLICT(source) DO UPDATE SET after = excluded.after,
+                            position = excluded.position, updated_at = excluded.updated_at''',
+                     (source, after, position, time.time()))
+
+    def finish_cursor(self, source):
+        self.execute('''INSERT INTO listing_cursors (source, finished, updated_at) VALUES (?, 1, ?)
+                        ON CONFLICT(source) DO UPDATE SET finished = 1, updated_at = excluded.updated_at''',
+                     (source, time.time()))
+
+    def clear_cursor(self, source):
+        self.execute("DELETE FROM listing_cursors WHERE source = ?", (source,))
+
+    def get_retries(self, source):
+        '''
+        Returns the (submission_id, position) pairs of the throttled or
+        failed submissions of a listing, oldest first
+        '''
+        return [(row["submission_id"], row["position"]) for row in self.execute(
+            "SELECT * FROM pending_retries WHERE source = ? ORDER BY added_at", (source,))]
+
+    def add_retry(self, source, submission_id, position):
+        self.execute('''INSERT OR REPLACE INTO pending_retries (source, submission_id, position, added_at)
+                        VALUES (?, ?, ?, ?)''',
+                     (source, submission_id, position, time.time()))
+
+    def remove_retry(self, source, submission_id):
+        self.execute("DELETE FROM pending_retries WHERE source = ? AND submission_id = ?",
+                     (source, submission_id))
+
+    def get_mark(self, source):
+        '''
+        Returns the high-water mark of a listing, i.e., the newest item seen
+        by the previous run, as a dict with `fullname` and `created_utc`
+        '''
+        rows = self.execute(
+            "SELECT * FROM listing_marks WHERE source = ?", (source,))
+        if rows:
+            return dict(rows[0])
+        return None
+
+    def set_mark(self, source, fullname, created_utc):
+        self.execute('''INSERT OR REPLACE INTO listing_marks (source, fullname, created_utc, updated_at)
+                        VALUES (?, ?, ?, ?)''',
+                     (source, fullname, created_utc, time.time()))
+
+    def get_url_verdict(self, url, ttl):
+        '''
+        Returns the cached classification of `url` and when it was made, as
+        a (verdict, checked_at) pair, if it is younger than `ttl` seconds
+        '''
+        rows = self.execute(
+            "SELECT verdict, checked_at FROM url_verdicts WHERE url = ? AND checked_at >= ?",
+            (url, time.time() - ttl))
+        if rows:
+            return rows[0]["verdict"], rows[0]["checked_at"]
+        return None
+
+    def set_url_verdict(self, url, verdict):
+        self.execute("INSERT OR REPLACE INTO url_verdicts (url, verdict, checked_at) VALUES (?, ?, ?)",
+                     (url, verdict, time.time()))
+
+    def get_api_response(self, key, ttl):
+        '''
+        Returns the cached (JSON) API response stored under `key` and when
+        it was fetched, as a (response, fetched_at) pair, if it is younger
+        than `ttl` seconds
+        '''
+        rows = self.execute(
+            "SELECT response, fetched_at FROM api_cache WHERE key = ? AND fetched_at >= ?",
+            (key, time.time() - ttl))
+        if rows:
+            return json.loads(rows[0]["response"]), rows[0]["fetched_at"]
+        return None
+
+    def set_api_response(self, key, response):
+        self.execute("INSERT OR REPLACE INTO api_cache (key, response, fetched_at) VALUES (?, ?, ?)",
+                     (key, json.dumps(response), time.time()))
+
+    @staticmethod
+    def hash_file(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+def _reset_after_fork():
+    # SQLite connections must not be carried across a fork, a forked child
+    # opens its own
+    DownloadIndex._inherited.extend(DownloadIndex._instances.values())
+    DownloadIndex._instances = {}
+    DownloadIndex._instances_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,4 @@
+class ExportConfig:
+    DEFAULT_FORMAT = "parquet"
+    DEFAULT_FORMAT_OPTIONS = ["parquet"]
+    DEFAULT_WORKERS = None  # number of CPUs
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+
+class FfmpegPool:
+    '''
+    Background pool for ffmpeg post-processing (muxing, transcoding)
+
+    Jobs are queued and run by `max_workers` threads (one per CPU by
+    default), each of which drives one ffmpeg child process at a time. The
+    submitting network worker does not wait for ffmpeg and moves on to its
+    next download; `on_done` is called with the job's future once it has
+    finished, e.g., to update the download record.
+    '''
+    def __init__(self, max_workers=None):
+        if not max_workers:
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="ffmpeg")
+
+    def submit(self, fn, *args, on_done=None, **kwargs):
+        future = self.executor.submit(fn, *args, **kwargs)
+        if on_done != None:
+            future.add_done_callback(on_done)
+        return future
+
+    def shutdown(self, wait=True):
+        '''
+        Stops accepting jobs and, with `wait`, blocks until every queued
+        job and its callback has run
+        '''
+        self.executor.shutdown(wait=wait)
+
+
+_ffmpeg_pool = None
+_ffmpeg_pool_lock = threading.Lock()
+_ffmpeg_workers = None
+
+
+def configure_ffmpeg_pool(config):
+    '''
+    Reads the optional `ffmpeg_workers` key in user_config.yaml (default:
+    number of CPUs)
+    '''
+    global _ffmpeg_workers
+    _ffmpeg_workers = (config or {}).get("ffmpeg_workers")
+
+
+def get_ffmpeg_pool():
+    global _ffmpeg_pool
+    with _ffmpeg_pool_lock:
+        if _ffmpeg_pool == None:
+            _ffmpeg_pool = FfmpegPool(_ffmpeg_workers)
+        return _ffmpeg_pool
+
+
+def shutdown_ffmpeg_pool():
+    '''
+    Waits for the outstanding ffmpeg jobs, if the pool was ever used
+    '''
+    global _ffmpeg_pool
+    with _ffmpeg_pool_lock:
+        pool, _ffmpeg_pool = _ffmpeg_pool, None
+    if pool != None:
+        pool.shutdown(wait=True)
+
+
+def _reset_after_fork():
+    # The pool threads of the parent do not exist in a forked child
+    global _ffmpeg_pool, _ffmpeg_pool_lock
+    _ffmpeg_pool = None
+    _ffmpeg_pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,66 @@
+import json
+import os
+
+
+class GalleryManifest:
+    '''
+    Per-gallery record of which items have been downloaded
+
+    Kept as <files_dir>/.gallery.json while a gallery is incomplete, so that
+    a gallery interrupted by a crash, a throttled host or a bad item is
+    resumed item by item on the next run instead of being restarted. It is
+    removed once every item is downloaded.
+    '''
+    FILE_NAME = ".gallery.json"
+
+    STATUS_COMPLETE = "complete"
+    STATUS_FAILED = "failed"
+
+    def __init__(self, path, items):
+        self.path = path
+        self.items = items
+
+    @staticmethod
+    def load(output_path):
+        path = os.path.join(output_path, GalleryManifest.FILE_NAME)
+        items = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    items = json.load(f).get("items", {})
+            except (OSError, ValueError):
+                items = {}
+        return GalleryManifest(path, items)
+
+    def completed(self, save_path):
+        '''
+        Returns the recorded (size, sha256) of a downloaded item, or None if
+        it still has to be downloaded
+        '''
+        item = self.items.get(os.path.basename(save_path))
+        if item == None or item["status"] != GalleryManifest.STATUS_COMPLETE:
+            return None
+        if not os.path.exists(save_path) or os.path.getsize(save_path) != item["size"]:
+            return None
+        return item["size"], item["sha256"]
+
+    def set_complete(self, url, result):
+        self.items[os.path.basename(result.path)] = {
+            "url": url, "status": GalleryManifest.STATUS_COMPLETE,
+            "size": result.size, "sha256": result.sha256}
+
+    def set_failed(self, url, save_path, error):
+        self.items[os.path.basename(save_path)] = {
+            "url": url, "status": GalleryManifest.STATUS_FAILED, "error": str(error)}
+
+    def is_complete(self):
+        return all(item["status"] == GalleryManifest.STATUS_COMPLETE for item in self.items.values())
+
+    def save(self):
+        if self.is_complete():
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        with open(self.path + ".tmp", 'w') as f:
+            json.dump({"items": self.items}, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
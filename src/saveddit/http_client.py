@@ -0,0 +1,314 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from saveddit.rate_limiter import RateLimiter, Throttled, get_rate_limiter, parse_retry_after
+import threading
+
+
+# What a finished download produced: where it went, how many bytes were
+# written and the SHA-256 of those bytes (computed while streaming)
+DownloadResult = namedtuple("DownloadResult", ["path", "size", "sha256"])
+
+
+# What probing a URL learned without downloading its body: the final URL
+# after redirects, the status code, the bare Content-Type and the size in
+# bytes (None when the server did not say)
+ProbeResult = namedtuple("ProbeResult", ["url", "status_code", "content_type", "size"])
+
+
+class IncompleteDownload(IOError):
+    pass
+
+
+class PartialDownload:
+    '''
+    A download streamed in chunks into `<save_path>.part`
+
+    Bytes left in the .part file by an interrupted attempt (or an earlier
+    run) are hashed once up front, so that a resumed download only asks the
+    server for the remaining range with a `Range` header while the digest
+    still covers the whole file. The .part file is renamed to `save_path`
+    only once it is complete.
+    '''
+    SUFFIX = ".part"
+
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self.part_path = save_path + PartialDownload.SUFFIX
+        self.file = None
+        self.expected_size = None
+        self.restart()
+        if os.path.exists(self.part_path):
+            with open(self.part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    self.digest.update(chunk)
+                    self.size += len(chunk)
+
+    def restart(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def request_headers(self):
+        # Ranges are only meaningful on the raw bytes, so ask for no encoding
+        headers = {"Accept-Encoding": "identity"}
+        if self.size:
+            headers["Range"] = "bytes=" + str(self.size) + "-"
+        return headers
+
+    def already_complete(self, status_code, content_range):
+        '''
+        Handles a `416 Range Not Satisfiable` answer to a resumed request.
+        Returns True when the .part file already holds the whole body,
+        otherwise discards it and raises IncompleteDownload to start over.
+        '''
+        if not self.size or status_code != 416:
+            return False
+        if content_range and content_range.split("/")[-1] == str(self.size):
+            return True
+        self.restart()
+        raise IncompleteDownload("Server rejected the resume range for " + self.save_path)
+
+    def begin(self, status_code, content_length):
+        if self.size and status_code != 206:
+            # The server ignored the Range header and sent the whole body
+            self.restart()
+        self.expected_size = None
+        if content_length != None:
+            self.expected_size = self.size + int(content_length)
+        self.file = open(self.part_path, 'ab' if self.size else 'wb')
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+    def finish(self):
+        self.close()
+        if self.expected_size != None and self.size < self.expected_size:
+            raise IncompleteDownload("Connection closed after " + str(self.size) +
+                                     " of " + str(self.expected_size) + " bytes")
+        os.replace(self.part_path, self.save_path)
+        return DownloadResult(self.save_path, self.size, self.digest.hexdigest())
+
+
+class HttpClient:
+    '''
+    Process-wide HTTP client used for every media fetch
+
+    Wraps a single requests.Session whose adapters keep a pool of keep-alive
+    connections per host, so that consecutive downloads from i.redd.it or
+    i.imgur.com reuse warm connections instead of paying for a new TCP+TLS
+    handshake every time. Every request goes through the shared per-host
+    RateLimiter.
+    '''
+    DEFAULT_POOL_CONNECTIONS = 16  # number of hosts with a connection pool
+    DEFAULT_POOL_MAXSIZE = 16      # connections kept alive per host
+    DEFAULT_TIMEOUT = 30           # seconds, for connect and for each read
+    DEFAULT_CHUNK_SIZE = 64 * 1024
+    DEFAULT_RETRIES = 3            # resumed attempts after a network error
+    USER_AGENT = "saveddit (by /u/p_ranav)"
+    PROBE_CACHE_SIZE = 4096        # probed URLs remembered per process
+    DEFAULT_FETCH_WORKERS = 4      # concurrent transfers in fetch_many
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": HttpClient.USER_AGENT})
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.probes = OrderedDict()
+        self.probes_lock = threading.Lock()
+
+    @property
+    def rate_limiter(self):
+        # Looked up on every use, it is swapped for a shared one under --jobs
+        return get_rate_limiter()
+
+    def request(self, method, url, **kwargs):
+        '''
+        Sends a request through the rate limiter of the url's host. 429/503
+        answers are retried once the host lets us (see Retry-After), and
+        Throttled is raised if they persist.
+        '''
+        kwargs.setdefault("timeout", self.timeout)
+        limiter = self.rate_limiter.for_url(url)
+        for _ in range(HttpClient.DEFAULT_RETRIES + 1):
+            limiter.acquire()
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            finally:
+                if response != None:
+                    limiter.release(response.status_code, response.headers.get("Retry-After"))
+                else:
+                    limiter.release()
+            if response.status_code not in RateLimiter.THROTTLE_STATUSES:
+                return response
+            response.close()
+        raise Throttled(url, parse_retry_after(response.headers.get("Retry-After")))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("HEAD", url, **kwargs)
+
+    def probe(self, url, **kwargs):
+        '''
+        Returns a ProbeResult for `url` without transferring its body
+
+        A HEAD request is tried first. Servers that reject HEAD get a
+        streamed GET instead, which is closed as soon as the headers are
+        in. Successful probes are memoized per URL.
+        '''
+        with self.probes_lock:
+            result = self.probes.get(url)
+            if result != None:
+                self.probes.move_to_end(url)
+                return result
+
+        response = self.head(url, **kwargs)
+        response.close()
+        if response.status_code >= 400:
+            with self.get(url, stream=True, **kwargs) as response:
+                pass
+        size = response.headers.get("Content-Length")
+        content_type = response.headers.get("Content-Type")
+        if content_type != None:
+            content_type = content_type.split(";")[0].strip()
+        result = ProbeResult(response.url, response.status_code, content_type,
+                             int(size) if size and size.isdigit() else None)
+
+        if response.ok:
+            with self.probes_lock:
+                self.probes[url] = result
+                while len(self.probes) > HttpClient.PROBE_CACHE_SIZE:
+                    self.probes.popitem(last=False)
+        return result
+
+    def download(self, url, save_path, retries=DEFAULT_RETRIES, **kwargs):
+        '''
+        Streams `url` to `save_path` and returns a DownloadResult
+
+        Data is written in fixed-size chunks to `<save_path>.part`. When the
+        connection drops, the download is resumed from the current offset
+        with a `Range` request (up to `retries` times), and the .part file is
+        atomically renamed to `save_path` once complete.
+
+        The host's rate limiter slot is held for the whole transfer. 429/503
+        answers count as a retry and raise Throttled once retries run out.
+
+        Raises requests.HTTPError on 4xx/5xx responses, like urlretrieve did
+        '''
+        kwargs.setdefault("timeout", self.timeout)
+        limiter = self.rate_limiter.for_url(url)
+        partial = PartialDownload(save_path)
+        extra_headers = kwargs.pop("headers", None) or {}
+        attempt = 0
+        while True:
+            headers = dict(extra_headers)
+            headers.update(partial.request_headers())
+            limiter.acquire()
+            status_code = None
+            retry_after = None
+            try:
+                with self.session.get(url, stream=True, headers=headers, **kwargs) as response:
+                    status_code = response.status_code
+                    retry_after = response.headers.get("Retry-After")
+                    if status_code in RateLimiter.THROTTLE_STATUSES:
+                        raise Throttled(url, parse_retry_after(retry_after))
+                    if partial.already_complete(response.status_code, response.headers.get("Content-Range")):
+                        return partial.finish()
+                    response.raise_for_status()
+                    partial.begin(response.status_code, response.headers.get("Content-Length"))
+                    try:
+                        for chunk in response.iter_content(chunk_size=HttpClient.DEFAULT_CHUNK_SIZE):
+                            if chunk:
+                                partial.write(chunk)
+                    finally:
+                        partial.close()
+                    return partial.finish()
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, IncompleteDownload, Throttled):
+                attempt += 1
+                if attempt > retries:
+                    raise
+            finally:
+                limiter.release(status_code, retry_after)
+
+    def fetch_many(self, jobs, on_done=None, max_concurrency=None, **kwargs):
+        '''
+        Downloads the (url, save_path) pairs in `jobs`, up to
+        `max_concurrency` (default: DEFAULT_FETCH_WORKERS) at a time; the
+        host's rate limiter still applies
+
+        Returns a list aligned with `jobs` holding either a DownloadResult or
+        the exception raised for that item. `on_done` is called
+        once per finished item. Other keyword arguments (e.g., `timeout`,
+        `retries`) are passed on to `download`.
+        '''
+        def fetch(job):
+            try:
+                return self.download(job[0], job[1], **kwargs)
+            except Exception as e:
+                return e
+            finally:
+                if on_done:
+                    on_done()
+
+        if len(jobs) <= 1:
+            return [fetch(job) for job in jobs]
+        workers = min(len(jobs), max_concurrency or HttpClient.DEFAULT_FETCH_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(fetch, jobs))
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+_http_client_options = {}
+
+
+def configure_http_client(config):
+    '''
+    Creates the process-wide client from the optional `http_pool_connections`,
+    `http_pool_maxsize` and `http_timeout` keys in user_config.yaml
+    '''
+    global _http_client, _http_client_options
+    config = config or {}
+    with _http_client_lock:
+        _http_client_options = {
+            "pool_connections": config.get("http_pool_connections") or HttpClient.DEFAULT_POOL_CONNECTIONS,
+            "pool_maxsize": config.get("http_pool_maxsize") or HttpClient.DEFAULT_POOL_MAXSIZE,
+            "timeout": config.get("http_timeout") or HttpClient.DEFAULT_TIMEOUT,
+        }
+        _http_client = None
+    return get_http_client()
+
+
+def get_http_client():
+    global _http_client
+    with _http_client_lock:
+        if _http_client == None:
+            _http_client = HttpClient(**_http_client_options)
+        return _http_client
+
+
+def _reset_after_fork():
+    # A forked child must not share the parent's pooled connections
+    global _http_client, _http_client_lock
+    _http_client = None
+    _http_client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
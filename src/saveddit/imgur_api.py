@@ -0,0 +1,116 @@
+from collections import OrderedDict
+import threading
+import time
+from saveddit.http_client import get_http_client
+
+
+class ImgurApi:
+    '''
+    Minimal client for the imgur API with a response cache
+
+    The imgur API quota is the tightest limit saveddit runs into, so every
+    successful response is cached for `cache_ttl` seconds, in memory (for the
+    MEMORY_CACHE_SIZE most recently used ids) and in the local download
+    index, keyed by album or image id. An album
+    is resolved with a single `/3/album/<id>` request and its images are
+    cached as well, so reruns and crossposts of the same album or image do
+    not use any quota.
+    '''
+    API_URL = "https://api.imgur.com/3/"
+
+    DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+    MEMORY_CACHE_SIZE = 4096               # responses remembered per process
+
+    cache_ttl = DEFAULT_CACHE_TTL
+
+    # key => (data, fetched_at), least recently used first
+    _memory = OrderedDict()
+    _memory_lock = threading.Lock()
+
+    def __init__(self, client_id, index=None):
+        self.client_id = client_id
+        self.index = index
+        self.http = get_http_client()
+
+    def album(self, album_id, timeout=None):
+        '''
+        Returns the `data` of the album, including its `images`, or None if
+        imgur does not know the album
+
+        Other error responses raise a requests.HTTPError, and Throttled is
+        raised if imgur keeps answering 429 (see HttpClient.request).
+        '''
+        return self.get("album", album_id, timeout)
+
+    def image(self, image_id, timeout=None):
+        '''
+        Returns the `data` of the image, or None if imgur does not know it
+        '''
+        return self.get("image", image_id, timeout)
+
+    def get(self, kind, item_id, timeout=None):
+        key = "imgur/" + kind + "/" + item_id
+        data = ImgurApi.remembered(key)
+        if data == None and self.index != None:
+            cached = self.index.get_api_response(key, ImgurApi.cache_ttl)
+            if cached != None:
+                data, fetched_at = cached
+                ImgurApi.remember(key, data, fetched_at)
+        if data != None:
+            return data
+
+        options = {}
+        if timeout != None:
+            options["timeout"] = timeout
+        res = self.http.get(ImgurApi.API_URL + kind + "/" + item_id,
+            headers={"Authorization": "Client-ID " + self.client_id}, **options)
+        if res.status_code == 404:
+            return None
+        # e.g., 403 once the client id is over its quota, or a 5xx
+        res.raise_for_status()
+        data = res.json()["data"]
+        self.put(kind, item_id, data)
+        if kind == "album":
+            # Later links to single images of the album need no request
+            for image in data.get("images") or []:
+                if image.get("id"):
+                    self.put("image", image["id"], image)
+        return data
+
+    def put(self, kind, item_id, data):
+        key = "imgur/" + kind + "/" + item_id
+        ImgurApi.remember(key, data, time.time())
+        if self.index != None:
+            self.index.set_api_response(key, data)
+
+    @staticmethod
+    def remembered(key):
+        '''
+        Returns the response kept in memory under `key`, if it is younger
+        than `cache_ttl`
+        '''
+        with ImgurApi._memory_lock:
+            entry = ImgurApi._memory.get(key)
+            if entry == None:
+                return None
+            data, fetched_at = entry
+            if fetched_at < time.time() - ImgurApi.cache_ttl:
+                del ImgurApi._memory[key]
+                return None
+            ImgurApi._memory.move_to_end(key)
+            return data
+
+    @staticmethod
+    def remember(key, data, fetched_at):
+        with ImgurApi._memory_lock:
+            ImgurApi._memory[key] = (data, fetched_at)
+            ImgurApi._memory.move_to_end(key)
+            while len(ImgurApi._memory) > ImgurApi.MEMORY_CACHE_SIZE:
+                ImgurApi._memory.popitem(last=False)
+
+
+def configure_imgur_api(config):
+    '''
+    Reads the optional `imgur_cache_ttl` key (seconds) in user_config.yaml
+    '''
+    ImgurApi.cache_ttl = (config or {}).get("imgur_cache_ttl") or ImgurApi.DEFAULT_CACHE_TTL
@@ -0,0 +1,47 @@
+class IncrementalListing:
+    '''
+    Wraps a PRAW listing and stops iterating as soon as it reaches the newest
+    item seen by the previous run (the listing's high-water mark)
+
+    Because PRAW fetches listing pages lazily, stopping early also stops the
+    pagination, so a listing with nothing new costs a single API call.
+    `chronological` listings (e.g., `new`) also stop at the first item older
+    than the mark, in case the marked item itself has been deleted. Listings
+    ordered by something else (e.g., `saved`, `upvoted`) only stop at the
+    marked item.
+
+    The mark moves past items that failed or were throttled, they are not
+    listed again: the JournaledListing around the listing keeps them as
+    pending retries, which the next run downloads first.
+    '''
+    def __init__(self, index, source, listing, chronological=True):
+        self.index = index
+        self.source = source
+        self.listing = listing
+        self.chronological = chronological
+        self.newest = None
+
+    def __iter__(self):
+        mark = self.index.get_mark(self.source)
+        for item in self.listing:
+            if self.newest == None:
+                self.newest = item
+            if mark != None and self.reached_mark(item, mark):
+                break
+            yield item
+
+    def reached_mark(self, item, mark):
+        if item.fullname == mark["fullname"]:
+            return True
+        created_utc = getattr(item, "created_utc", None)
+        return self.chronological and created_utc != None and \
+            mark["created_utc"] != None and created_utc < mark["created_utc"]
+
+    def commit(self):
+        '''
+        Moves the high-water mark up to the newest item of this run. Call it
+        once the items yielded by the listing have been processed.
+        '''
+        if self.newest != None:
+            self.index.set_mark(self.source, self.newest.fullname,
+                                getattr(self.newest, "created_utc", None))
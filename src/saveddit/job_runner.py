@@ -0,0 +1,166 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import coloredlogs
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import multiprocessing
+import time
+import verboselogs
+from saveddit.download_index import DownloadIndex
+from saveddit.ffmpeg_pool import shutdown_ffmpeg_pool
+from saveddit.rate_limiter import RateLimiterManager, RemoteRateLimiter, set_rate_limiter
+
+
+class JobRunner:
+    '''
+    Runs independent download jobs, e.g., one per subreddit or per user, in
+    a pool of `processes` processes
+
+    A job is a (name, function, args) tuple; `function` must be importable
+    from the worker processes. The processes share:
+
+      - the index (and metadata archive) of the output root, SQLite
+        databases in WAL mode that several processes can write to
+      - one RateLimiter, served by a RateLimiterManager process, so that the
+        per-host limits hold for the whole run and not for each process
+      - one log: worker records are sent to this process over a queue and
+        printed here, prefixed with the name of their job
+
+    Workers are forked, so they inherit the configuration (and reddit
+    password) already loaded by this process. They do not inherit its
+    threads, HTTP connection pools or SQLite connections: the async
+    download engine, ffmpeg pool, HTTP client, index and metadata archive
+    are reset after the fork and created again on first use in each
+    worker. Once every job is done, a summary of the jobs and of the
+    submissions recorded in the index during the run is logged.
+    '''
+    START_METHOD = "fork"
+
+    def __init__(self, output_path, processes):
+        self.output_path = output_path
+        self.processes = processes
+
+        self.logger = verboselogs.VerboseLogger(__name__)
+        level_styles = {
+            'critical': {'bold': True, 'color': 'red'},
+            'debug': {'color': 'green'},
+            'error': {'color': 'red'},
+            'info': {'color': 'white'},
+            'notice': {'color': 'magenta'},
+            'spam': {'color': 'white', 'faint': True},
+            'success': {'bold': True, 'color': 'green'},
+            'verbose': {'color': 'blue'},
+            'warning': {'color': 'yellow'}
+        }
+        coloredlogs.install(level='SPAM', logger=self.logger,
+                            fmt='%(job)s%(message)s', level_styles=level_styles)
+        for handler in self.logger.handlers:
+            handler.addFilter(_DefaultJobFilter())
+
+    @staticmethod
+    def is_supported():
+        return JobRunner.START_METHOD in multiprocessing.get_all_start_methods()
+
+    def run(self, jobs):
+        '''
+        Runs `jobs` and returns a list of (name, elapsed seconds, error or
+        None) in the order they finished
+        '''
+        context = multiprocessing.get_context(JobRunner.START_METHOD)
+        started_at = time.time()
+        results = []
+
+        manager = RateLimiterManager(ctx=context)
+        manager.start()
+        log_queue = context.Queue()
+        listener = QueueListener(log_queue, *self.logger.handlers)
+        listener.start()
+        try:
+            with ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                     initializer=_init_worker,
+                                     initargs=(log_queue, manager.rate_limiter())) as executor:
+                futures = [executor.submit(_run_job, name, function, args)
+                           for name, function, args in jobs]
+                for future in as_completed(futures):
+                    name, elapsed, error = future.result()
+                    results.append((name, elapsed, error))
+                    status = "Finished" if error == None else "Failed"
+                    self.logger.notice("[" + str(len(results)) + "/" + str(len(jobs)) + "] " +
+                                       status + " " + name + " in " + str(int(elapsed)) + "s")
+        finally:
+            listener.stop()
+            manager.shutdown()
+
+        self.log_summary(results, started_at)
+        return results
+
+    def log_summary(self, results, started_at):
+        failed = [result for result in results if result[2] != None]
+        self.logger.notice("Ran " + str(len(results)) + " job(s) in " +
+                           str(int(time.time() - started_at)) + "s with " + str(self.processes) +
+                           " processes: " + str(len(results) - len(failed)) + " succeeded, " +
+                           str(len(failed)) + " failed")
+        for name, _, error in failed:
+            self.logger.error("  " + name + " - " + error)
+
+        counts = DownloadIndex.open(self.output_path).status_counts(since=started_at)
+        if counts:
+            self.logger.verbose("Submissions: " + ", ".join(
+                str(count) + " " + status for status, count in sorted(counts.items())))
+
+
+class _DefaultJobFilter(logging.Filter):
+    # Records of this process have no job prefix
+    def filter(self, record):
+        if not hasattr(record, "job"):
+            record.job = ""
+        return True
+
+
+class _JobFilter(logging.Filter):
+    def filter(self, record):
+        record.job = "[" + str(_job_name) + "] "
+        return True
+
+
+_job_log_queue = None
+_job_name = None
+
+
+def _init_worker(log_queue, rate_limiter):
+    global _job_log_queue
+    _job_log_queue = log_queue
+    set_rate_limiter(RemoteRateLimiter(rate_limiter))
+    handler = QueueHandler(log_queue)
+    handler.addFilter(_JobFilter())
+    logging.getLogger().handlers = [handler]
+
+
+def _run_job(name, function, args):
+    global _job_name
+    _job_name = name
+    started_at = time.time()
+    error = None
+    try:
+        function(*args)
+    except (Exception, SystemExit) as e:
+        error = str(e) or type(e).__name__
+    finally:
+        # Reddit video merges of this job
+        shutdown_ffmpeg_pool()
+    return name, time.time() - started_at, error
+
+
+def is_job_worker():
+    '''
+    True in the worker processes of a JobRunner
+    '''
+    return _job_log_queue != None
+
+
+def use_job_log(logger):
+    '''
+    Sends the records of a downloader's `logger` to the JobRunner's merged
+    log when called from one of its workers, instead of this process' stderr
+    '''
+    if is_job_worker():
+        logger.handlers = []
@@ -0,0 +1,104 @@
+from collections import OrderedDict
+import threading
+
+
+class JournaledListing:
+    '''
+    Listing whose progress is journaled in the index, so that a run that
+    died halfway continues where it stopped instead of at the first page
+
+    Yields (position, submission) pairs. Every item has to be reported with
+    `done` once it is processed. The journal of the listing (`source`) keeps:
+
+      - a cursor: the last item that, along with every item before it, has
+        been processed, and its position. A restarted run passes it as
+        `after` to the listing, so pagination picks up at the next item
+        and positions (the `NNN_` of the directories) carry on.
+      - whether the listing was walked to the end, in which case a
+        restarted run does not list it again
+      - the items that were throttled or failed (pending retries), which a
+        restarted run yields first
+
+    `listing_function(limit, **kwargs)` returns the PRAW listing, e.g.,
+    `lambda limit, **kwargs: subreddit.top(limit=limit, **kwargs)`; it is
+    passed `params` only when resuming from a cursor, as several PRAW
+    listings fail on `params=None`. The listing it returned last is kept
+    in `listing`. Call `clear` once the
+    run is complete, so the next run starts from the first page.
+    '''
+    def __init__(self, index, source, listing_function, limit=None, reddit=None):
+        self.index = index
+        self.source = source
+        self.listing_function = listing_function
+        self.limit = limit
+        self.reddit = reddit
+        self.listing = None
+        self.listed = False
+        # fullname => [position, submission, done], in listing order
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        if self.reddit != None:
+            for submission_id, position in self.index.get_retries(self.source):
+                yield position, self.reddit.submission(id=submission_id)
+
+        cursor = self.index.get_cursor(self.source)
+        if cursor != None and cursor["finished"]:
+            self.listed = True
+            return
+        start = 0
+        kwargs = {}
+        if cursor != None and cursor["after"] != None:
+            start = cursor["position"] + 1
+            kwargs["params"] = {"after": cursor["after"]}
+        limit = self.limit
+        if limit != None:
+            limit -= start
+        if limit == None or limit > 0:
+            self.listing = self.listing_function(limit, **kwargs)
+            for position, submission in enumerate(self.listing, start):
+                with self.lock:
+                    self.pending[submission.fullname] = [position, submission, False]
+                yield position, submission
+
+        with self.lock:
+            self.listed = True
+            if not self.pending:
+                self.index.finish_cursor(self.source)
+
+    def done(self, position, submission, retry=False):
+        '''
+        Journals the outcome of an item. Items to `retry` (throttled or
+        failed) are kept as pending retries, they do not hold the cursor
+        back. An item can be reported again, e.g., once its ffmpeg merge
+        failed, which only updates its pending retry.
+        '''
+        with self.lock:
+            if retry:
+                self.index.add_retry(self.source, submission.id, position)
+            else:
+                self.index.remove_retry(self.source, submission.id)
+
+            item = self.pending.get(submission.fullname)
+            if item == None:
+                return
+            item[2] = True
+            newest = None
+            while self.pending:
+                fullname, (item_position, item_submission, finished) = next(iter(self.pending.items()))
+                if not finished:
+                    break
+                del self.pending[fullname]
+                newest = (item_position, item_submission)
+            if newest != None:
+                self.index.set_cursor(self.source, newest[1].fullname, newest[0])
+            if self.listed and not self.pending:
+                self.index.finish_cursor(self.source)
+
+    def clear(self):
+        '''
+        Forgets the cursor of the listing. Pending retries are kept for the
+        next run.
+        '''
+        self.index.clear_cursor(self.source)
@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from saveddit.download_index import DownloadIndex
+from saveddit.submission_downloader import SubmissionDownloader
+
+
+class ListingPlanner:
+    '''
+    Merges the category listings of a subreddit (or multireddit) so that
+    every submission is downloaded once per run
+
+    All the listings are walked up front, `workers` at a time, and each
+    submission is assigned to the first category it shows up in. It is
+    downloaded there only; its entries in the other categories become
+    links to that download once the downloads are done. Submissions the
+    index records as downloaded elsewhere by an earlier run are linked
+    to that download too. A link is a
+    relative symlink named like the submission's own `NNN_title`
+    directory, or a `NNN_title.json` file pointing to it where symlinks
+    are not available.
+    '''
+    DEFAULT_WORKERS = 4
+
+    def __init__(self, index, workers=DEFAULT_WORKERS):
+        self.index = index
+        self.workers = workers
+        # submission id => submission directory of its download
+        self.primary = {}
+        # (category, category_dir, submission index, submission) to link
+        self.links = []
+
+    def plan(self, listings):
+        '''
+        listings: list of (category, category_dir, listing), the listings
+                  yielding (index, submission) pairs, e.g.,
+                  enumerate(subreddit.top())
+
+        Returns a list of (category, category_dir, items), items being the
+        (index, submission) pairs to download in that category, in listing
+        order
+        '''
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(listings)))) as executor:
+            fetched = list(executor.map(lambda listing: list(listing[2]), listings))
+
+        plan = []
+        for (category, category_dir, _), submissions in zip(listings, fetched):
+            items = []
+            for i, submission in submissions:
+                if submission.id in self.primary:
+                    self.links.append((category, category_dir, i, submission))
+                    continue
+                post_dir = None
+                if getattr(submission, "url", None):
+                    post_dir = os.path.join(category_dir,
+                        SubmissionDownloader.post_dir_name(i, submission.title))
+                previous_dir = self.downloaded_elsewhere(submission.id, post_dir)
+                if previous_dir != None:
+                    # Downloaded by an earlier run, under another category
+                    # or position: link it like an in-run duplicate
+                    self.primary[submission.id] = previous_dir
+                    self.links.append((category, category_dir, i, submission))
+                    continue
+                self.primary[submission.id] = post_dir
+                items.append((i, submission))
+            plan.append((category, category_dir, items))
+        return plan
+
+    def downloaded_elsewhere(self, submission_id, post_dir):
+        '''
+        Directory of a complete download of the submission recorded in the
+        index, if it is not `post_dir`
+        '''
+        if self.index == None or post_dir == None:
+            return None
+        record = self.index.get(submission_id)
+        if record == None or record["status"] != DownloadIndex.STATUS_COMPLETE or record["path"] == None:
+            return None
+        if os.path.abspath(record["path"]) == os.path.abspath(post_dir) or not os.path.isdir(record["path"]):
+            return None
+        return record["path"]
+
+    def link(self):
+        '''
+        Links the duplicate listing entries to the download of their
+        submission and returns how many links were made
+        '''
+        count = 0
+        for _, category_dir, i, submission in self.links:
+            target = self.download_dir(submission.id)
+            if target == None:
+                continue
+            path = os.path.join(category_dir, SubmissionDownloader.post_dir_name(i, submission.title))
+            if os.path.lexists(path) or os.path.exists(path + ".json"):
+                continue
+            relative_target = os.path.relpath(target, category_dir)
+            try:
+                os.symlink(relative_target, path, target_is_directory=True)
+            except OSError:
+                with open(path + ".json", 'w') as file:
+                    file.write(json.dumps({"id": submission.id, "path": relative_target}, indent=2))
+            count += 1
+        return count
+
+    def download_dir(self, submission_id):
+        '''
+        Directory holding the download of a submission, which may be one of
+        an earlier run
+        '''
+        record = self.index.get(submission_id) if self.index != None else None
+        if record != None and record["path"] != None and os.path.isdir(record["path"]):
+            return record["path"]
+        post_dir = self.primary.get(submission_id)
+        if post_dir != None and os.path.isdir(post_dir):
+            return post_dir
+        return None
@@ -0,0 +1,203 @@
+import os
+import re
+import threading
+from saveddit.http_client import HttpClient
+
+
+class MediaHandler:
+    '''
+    Base class for the handlers that download the media behind a link
+
+    A handler declares the hosts it serves (parent domains match their
+    subdomains, e.g., `imgur.com` also serves `i.imgur.com`), an optional
+    path regex, and its own scheduling policy:
+
+      concurrency: how many downloads of this kind may run at once across
+                   the whole process
+      timeout:     seconds before a request of this handler times out
+      retries:     resumed attempts of a download after a network error
+
+    Handlers with `hosts = None` are checked for every link before the host
+    table is consulted (e.g., direct links to files). Handlers with an empty
+    `hosts` list are only used explicitly (e.g., the youtube-dl fallback).
+    '''
+    name = None
+    hosts = []
+    path_regex = None
+    is_video = False
+    concurrency = 8
+    timeout = HttpClient.DEFAULT_TIMEOUT
+    retries = HttpClient.DEFAULT_RETRIES
+
+    def __init__(self):
+        self.limit = threading.BoundedSemaphore(self.concurrency)
+
+    def matches(self, url, parsed_url):
+        return self.path_regex == None or self.path_regex.search(parsed_url.path) != None
+
+    def describe(self, url):
+        raise NotImplementedError
+
+    def download(self, downloader, submission, files_dir, skip_videos):
+        raise NotImplementedError
+
+
+_handlers = []
+_handlers_by_name = {}
+
+
+def register_handler(cls):
+    '''
+    Class decorator adding a handler to the registry. Handlers registered
+    first win when several of them match the same link.
+    '''
+    handler = cls()
+    _handlers.append(handler)
+    _handlers_by_name[handler.name] = handler
+    return cls
+
+
+def registered_handlers():
+    return list(_handlers)
+
+
+def get_handler(name):
+    return _handlers_by_name[name]
+
+
+@register_handler
+class DirectImageHandler(MediaHandler):
+    name = "direct_image"
+    hosts = None
+    concurrency = 16
+    LEAF_REGEX = re.compile(r'\.(png|jpe?g|gif)', re.IGNORECASE)
+
+    def matches(self, url, parsed_url):
+        url_leaf = url.split("/")[-1]
+        return ".gifv" not in url_leaf and self.LEAF_REGEX.search(url_leaf) != None
+
+    def describe(self, url):
+        return "This is a direct link to a " + url.split("/")[-1].split(".")[-1] + " file"
+
+    def download(self, downloader, submission, files_dir, skip_videos):
+        save_path = os.path.join(files_dir, submission.url.split("/")[-1])
+        downloader.download_direct_link(submission, save_path)
+
+
+@register_handler
+class DirectVideoHandler(DirectImageHandler):
+    name = "direct_video"
+    is_video = True
+    concurrency = 8
+    LEAF_REGEX = re.compile(r'\.mp4', re.IGNORECASE)
+
+
+@register_handler
+class RedditGalleryHandler(MediaHandler):
+    name = "reddit_gallery"
+    hosts = ["reddit.com"]
+    path_regex = re.compile(r'^/gallery/')
+    concurrency = 8
+    item_concurrency = 8  # items of one gallery fetched at once
+    item_retries = 2      # extra rounds for items that failed
+
+    def describe(self, url):
+        return "This is a reddit gallery"
+
+    def download(self, downloader, submission, files_dir, skip_videos):
+        downloader.download_reddit_gallery(submission, files_dir, skip_videos)
+
+
+@register_handler
+class RedditVideoHandler(MediaHandler):
+    name = "reddit_video"
+    hosts = ["v.redd.it"]
+    is_video = True
+    concurrency = 8
+    timeout = 60
+
+    def describe(self, url):
+        return "This is a reddit video"
+
+    def download(self, downloader, submission, files_dir, skip_videos):
+        downloader.download_reddit_video(submission, files_dir)
+
+
+@register_handler
+class GfycatHandler(MediaHandler):
+    name = "gfycat"
+    hosts = ["gfycat.com"]
+    is_video = True
+    concurrency = 4
+    timeout = 60
+
+    def describe(self, url):
+        return "This is a gfycat link"
+
+    def download(self, downloader, submission, files_dir, skip_videos):
+        downloader.download_gfycat_or_redgif(submission, files_dir)
+
+
+@register_handler
+class RedgifsHandler(GfycatHandler):
+    name = "redgifs"
+    hosts = ["redgifs.com"]
+
+    def describe(self, url):
+        return "This is a redgif link"
+
+
+@register_handler
+class ImgurAlbumHandler(MediaHandler):
+    name = "imgur_album"
+    hosts = ["imgur.com"]
+    path_regex = re.compile(r'^/(a|gallery)/')
+    concurrency = 4
+
+    def describe(self, url):
+        return "This is an imgur album"
+
+    def download(self, downloader, submission, files_dir, skip_videos):
+        downloader.download_imgur_album(submission, files_dir)
+
+
+@register_handler
+class ImgurImageHandler(MediaHandler):
+    name = "imgur_image"
+    hosts = ["imgur.com"]
+    concurrency = 8
+
+    def describe(self, url):
+        return "This is an imgur image or video"
+
+    def download(self, downloader, submission, files_dir, skip_videos):
+        downloader.download_imgur_image(submission, files_dir)
+
+
+@register_handler
+class YoutubeHandler(MediaHandler):
+    name = "youtube"
+    hosts = ["youtube.com", "youtu.be"]
+    is_video = True
+    concurrency = 2
+    timeout = 60
+    retries = 10
+
+    def describe(self, url):
+        return "This is a youtube link"
+
+    def download(self, downloader, submission, files_dir, skip_videos):
+        downloader.download_youtube_video(submission.url, files_dir)
+
+
+@register_handler
+class YoutubeDlHandler(YoutubeHandler):
+    '''
+    Fallback for links that a youtube-dl extractor claims, see
+    UrlClassifier.is_supported_by_youtubedl
+    '''
+    name = "youtube_dl"
+    hosts = []
+
+    def describe(self, url):
+        return "This link is supported by a youtube-dl extractor"
@@ -0,0 +1,78 @@
+import os
+import shutil
+import threading
+
+
+class MediaStore:
+    '''
+    Content-addressed store for downloaded media
+
+    Every downloaded file is moved to <output_path>/.saveddit/blobs/ under
+    the SHA-256 of its bytes (computed while streaming), and a hardlink to
+    the blob is put back at its usual place in the www.reddit.com/... tree.
+    An image posted to several subreddits, or listed under `hot`, `top` and
+    `gilded`, is therefore stored once. Symlinks are used when hardlinks are
+    not possible, and a plain copy as the last resort.
+    '''
+    DIRECTORY_NAME = os.path.join(".saveddit", "blobs")
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+    enabled = False
+
+    @staticmethod
+    def open(output_path):
+        output_path = os.path.abspath(output_path)
+        with MediaStore._instances_lock:
+            store = MediaStore._instances.get(output_path)
+            if store == None:
+                store = MediaStore(output_path)
+                MediaStore._instances[output_path] = store
+            return store
+
+    def __init__(self, output_path):
+        self.root = os.path.join(output_path, MediaStore.DIRECTORY_NAME)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, sha256[0:2], sha256[2:4], sha256)
+
+    def store(self, path, sha256):
+        '''
+        Moves the freshly downloaded file at `path` into the store, or drops
+        it if a blob with the same content already exists, and links the
+        blob back to `path`
+        '''
+        blob = self.blob_path(sha256)
+        blob_dir = os.path.dirname(blob)
+        if not os.path.exists(blob_dir):
+            os.makedirs(blob_dir, exist_ok=True)
+        if os.path.exists(blob):
+            os.remove(path)
+        else:
+            os.replace(path, blob)
+        MediaStore.link(blob, path)
+        return blob
+
+    @staticmethod
+    def link(blob, path):
+        try:
+            os.link(blob, path)
+        except OSError:
+            try:
+                os.symlink(os.path.relpath(blob, os.path.dirname(path)), path)
+            except OSError:
+                shutil.copyfile(blob, path)
+
+
+def configure_media_store(config):
+    '''
+    Enables the content-addressed store when `dedupe_media: true` is set in
+    user_config.yaml
+    '''
+    MediaStore.enabled = bool((config or {}).get("dedupe_media", False))
+
+
+def get_media_store(output_path):
+    if not MediaStore.enabled:
+        return None
+    return MediaStore.open(output_path)
@@ -0,0 +1,175 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class MetadataArchive:
+    '''
+    SQLite archive of submission, comment and user metadata
+
+    An alternative to the submission.json/comments.json/user.json files
+    written next to the media: all metadata of one output root goes into
+    <output_path>/.saveddit/archive.db, indexed by subreddit, author,
+    created_utc and parent_id. Each record keeps its full JSON document
+    next to the indexed columns. Comments are written in batches, one
+    transaction per batch.
+    '''
+    DIRECTORY_NAME = ".saveddit"
+    FILE_NAME = "archive.db"
+
+    JSON = "json"
+    SQLITE = "sqlite"
+
+    backend = JSON
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+    # Instances of the parent in a forked child, kept so that their
+    # connections are neither used nor closed there
+    _inherited = []
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS submissions (
+            id TEXT PRIMARY KEY,
+            subreddit TEXT,
+            author TEXT,
+            created_utc INTEGER,
+            title TEXT,
+            url TEXT,
+            permalink TEXT,
+            num_comments INTEGER,
+            data TEXT NOT NULL,
+            archived_at REAL NOT NULL
+        )''',
+        '''CREATE INDEX IF NOT EXISTS submissions_subreddit ON submissions (subreddit)''',
+        '''CREATE INDEX IF NOT EXISTS submissions_author ON submissions (author)''',
+        '''CREATE INDEX IF NOT EXISTS submissions_created_utc ON submissions (created_utc)''',
+        '''CREATE TABLE IF NOT EXISTS comments (
+            id TEXT PRIMARY KEY,
+            submission_id TEXT,
+            parent_id TEXT,
+            subreddit TEXT,
+            author TEXT,
+            created_utc INTEGER,
+            body TEXT,
+            data TEXT NOT NULL,
+            archived_at REAL NOT NULL
+        )''',
+        '''CREATE INDEX IF NOT EXISTS comments_submission_id ON comments (submission_id)''',
+        '''CREATE INDEX IF NOT EXISTS comments_parent_id ON comments (parent_id)''',
+        '''CREATE INDEX IF NOT EXISTS comments_subreddit ON comments (subreddit)''',
+        '''CREATE INDEX IF NOT EXISTS comments_author ON comments (author)''',
+        '''CREATE INDEX IF NOT EXISTS comments_created_utc ON comments (created_utc)''',
+        '''CREATE TABLE IF NOT EXISTS users (
+            name TEXT PRIMARY KEY,
+            id TEXT,
+            created_utc INTEGER,
+            data TEXT NOT NULL,
+            archived_at REAL NOT NULL
+        )''',
+    ]
+
+    @staticmethod
+    def open(output_path):
+        output_path = os.path.abspath(output_path)
+        with MetadataArchive._instances_lock:
+            archive = MetadataArchive._instances.get(output_path)
+            if archive == None:
+                archive = MetadataArchive(output_path)
+                MetadataArchive._instances[output_path] = archive
+            return archive
+
+    def __init__(self, output_path):
+        archive_dir = os.path.join(output_path, MetadataArchive.DIRECTORY_NAME)
+        if not os.path.exists(archive_dir):
+            os.makedirs(archive_dir, exist_ok=True)
+        self.path = os.path.join(archive_dir, MetadataArchive.FILE_NAME)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            self.path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in MetadataArchive.SCHEMA:
+                self.connection.execute(statement)
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def executemany(self, sql, rows):
+        '''
+        Runs `sql` for every row in a single transaction
+        '''
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(sql, rows)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def add_submission(self, submission_dict):
+        self.executemany('''INSERT OR REPLACE INTO submissions
+                            (id, subreddit, author, created_utc, title, url, permalink, num_comments, data, archived_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         [(submission_dict.get("id"),
+                           submission_dict.get("subreddit_name_prefixed"),
+                           submission_dict.get("author"),
+                           submission_dict.get("created_utc"),
+                           submission_dict.get("title"),
+                           submission_dict.get("url"),
+                           submission_dict.get("permalink"),
+                           submission_dict.get("num_comments"),
+                           json.dumps(submission_dict),
+                           time.time())])
+
+    def add_comments(self, comment_dicts):
+        now = time.time()
+        self.executemany('''INSERT OR REPLACE INTO comments
+                            (id, submission_id, parent_id, subreddit, author, created_utc, body, data, archived_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         [(comment_dict.get("id"),
+                           (comment_dict.get("link_id") or "").split("_")[-1] or None,
+                           comment_dict.get("parent_id"),
+                           comment_dict.get("subreddit_name_prefixed"),
+                           comment_dict.get("author"),
+                           comment_dict.get("created_utc"),
+                           comment_dict.get("body"),
+                           json.dumps(comment_dict),
+                           now) for comment_dict in comment_dicts if comment_dict.get("id")])
+
+    def add_user(self, user_dict):
+        self.executemany('''INSERT OR REPLACE INTO users (name, id, created_utc, data, archived_at)
+                            VALUES (?, ?, ?, ?, ?)''',
+                         [(user_dict.get("name"), user_dict.get("id"), user_dict.get("created_utc"),
+                           json.dumps(user_dict), time.time())])
+
+
+def configure_metadata_archive(config):
+    '''
+    Reads the optional `metadata_backend` key (json or sqlite) in
+    user_config.yaml
+    '''
+    MetadataArchive.backend = (config or {}).get("metadata_backend") or MetadataArchive.JSON
+
+
+def get_metadata_archive(output_path):
+    if MetadataArchive.backend != MetadataArchive.SQLITE:
+        return None
+    return MetadataArchive.open(output_path)
+
+
+def _reset_after_fork():
+    # SQLite connections must not be carried across a fork, a forked child
+    # opens its own
+    MetadataArchive._inherited.extend(MetadataArchive._instances.values())
+    MetadataArchive._instances = {}
+    MetadataArchive._instances_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
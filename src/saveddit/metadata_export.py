@@ -0,0 +1,218 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import gzip
+import io
+import json
+import os
+import sqlite3
+from saveddit.metadata_archive import MetadataArchive
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class MetadataExporter:
+    '''
+    Exports the metadata of an output directory to columnar files
+
+    Reads the SQLite metadata archive when there is one, otherwise scans the
+    submission.json and comments.json(.ndjson[.gz|.zst]) files of the output
+    tree with a pool of `workers` processes. Records are deduplicated by id,
+    as older trees hold a submission once per category it was listed in.
+    Submissions and comments are written
+    as Parquet datasets, partitioned by subreddit and month (of created_utc),
+    with one typed column per field saved by saveddit:
+
+      <destination>/submissions/subreddit=<name>/month=<YYYY-MM>/*.parquet
+      <destination>/comments/subreddit=<name>/month=<YYYY-MM>/*.parquet
+    '''
+    PARQUET = "parquet"
+
+    # (field, type) pairs, see SubmissionDownloader.download_submission_meta
+    SUBMISSION_FIELDS = [
+        ("author", "string"), ("created_utc", "int64"), ("distinguished", "string"),
+        ("downs", "int64"), ("edited", "float64"), ("id", "string"),
+        ("link_flair_text", "string"), ("locked", "bool_"), ("num_comments", "int64"),
+        ("num_crossposts", "int64"), ("permalink", "string"), ("selftext", "string"),
+        ("selftext_html", "string"), ("send_replies", "bool_"), ("spoiler", "bool_"),
+        ("stickied", "bool_"), ("subreddit_name_prefixed", "string"), ("subreddit_id", "string"),
+        ("subreddit_subscribers", "int64"), ("subreddit_type", "string"), ("title", "string"),
+        ("total_awards_received", "int64"), ("ups", "int64"), ("upvote_ratio", "float64"),
+        ("url", "string"),
+    ]
+
+    # See SubmissionDownloader.download_comments
+    COMMENT_FIELDS = [
+        ("author", "string"), ("body", "string"), ("created_utc", "int64"),
+        ("distinguished", "string"), ("downs", "int64"), ("edited", "float64"),
+        ("id", "string"), ("is_submitter", "bool_"), ("link_id", "string"),
+        ("parent_id", "string"), ("permalink", "string"), ("score", "int64"),
+        ("stickied", "bool_"), ("subreddit_name_prefixed", "string"), ("subreddit_id", "string"),
+        ("total_awards_received", "int64"), ("ups", "int64"),
+    ]
+
+    COMMENT_FILE_NAMES = ["comments.json", "comments.ndjson", "comments.ndjson.gz", "comments.ndjson.zst"]
+    FILES_PER_TASK = 256
+
+    def __init__(self, output_path, destination=None, workers=None):
+        self.output_path = output_path
+        if destination == None:
+            destination = os.path.join(output_path, MetadataArchive.DIRECTORY_NAME, "export")
+        self.destination = destination
+        self.workers = workers or os.cpu_count() or 1
+
+    def export(self, export_format=PARQUET):
+        '''
+        Returns the number of (submissions, comments) exported
+        '''
+        if export_format != MetadataExporter.PARQUET:
+            raise ValueError("Unsupported export format `" + str(export_format) + "`")
+        if pyarrow == None:
+            raise RuntimeError("Exporting to parquet needs pyarrow, install it with `pip install saveddit[parquet]`")
+
+        archive_path = os.path.join(self.output_path, MetadataArchive.DIRECTORY_NAME, MetadataArchive.FILE_NAME)
+        if os.path.exists(archive_path):
+            submissions, comments = MetadataExporter.read_archive(archive_path)
+        else:
+            submissions, comments = self.scan_tree()
+        submissions = MetadataExporter.unique(submissions)
+        comments = MetadataExporter.unique(comments)
+
+        self.write("submissions", submissions, MetadataExporter.SUBMISSION_FIELDS)
+        self.write("comments", comments, MetadataExporter.COMMENT_FIELDS)
+        return len(submissions), len(comments)
+
+    @staticmethod
+    def read_archive(archive_path):
+        connection = sqlite3.connect(archive_path)
+        try:
+            submissions = [json.loads(row[0]) for row in connection.execute("SELECT data FROM submissions")]
+            comments = [json.loads(row[0]) for row in connection.execute("SELECT data FROM comments")]
+        finally:
+            connection.close()
+        return submissions, comments
+
+    def scan_tree(self):
+        '''
+        Collects the metadata files of the output tree and parses them in
+        parallel, FILES_PER_TASK files per task
+        '''
+        paths = []
+        for root, dirs, filenames in os.walk(self.output_path):
+            # Skip the index, blob store and earlier exports
+            dirs[:] = [d for d in dirs if d != MetadataArchive.DIRECTORY_NAME]
+            for filename in filenames:
+                if filename == "submission.json" or filename in MetadataExporter.COMMENT_FILE_NAMES \
+                        or ("_Comment_" in filename and filename.endswith(".json")):
+                    paths.append(os.path.join(root, filename))
+        if zstandard == None and any(path.endswith(".zst") for path in paths):
+            raise RuntimeError("The output directory has zstd compressed comments, reading them needs zstandard, " +
+                               "install it with `pip install saveddit[zstd]`")
+
+        tasks = [paths[i:i + MetadataExporter.FILES_PER_TASK]
+                 for i in range(0, len(paths), MetadataExporter.FILES_PER_TASK)]
+        submissions = []
+        comments = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for task_submissions, task_comments in executor.map(MetadataExporter.read_files, tasks):
+                submissions.extend(task_submissions)
+                comments.extend(task_comments)
+        return submissions, comments
+
+    @staticmethod
+    def read_files(paths):
+        # Runs in a worker process
+        submissions = []
+        comments = []
+        for path in paths:
+            try:
+                if os.path.basename(path) == "submission.json":
+                    with open(path, 'r') as f:
+                        submissions.append(json.load(f))
+                elif path.endswith(".ndjson.zst"):
+                    with open(path, 'rb') as compressed:
+                        reader = zstandard.ZstdDecompressor().stream_reader(compressed)
+                        with io.TextIOWrapper(reader, encoding="utf-8") as f:
+                            comments.extend(json.loads(line) for line in f if line.strip())
+                elif path.endswith(".ndjson") or path.endswith(".ndjson.gz"):
+                    opener = gzip.open if path.endswith(".gz") else open
+                    with opener(path, 'rt') as f:
+                        comments.extend(json.loads(line) for line in f if line.strip())
+                else:
+                    with open(path, 'r') as f:
+                        text = f.read()
+                    if text.strip():
+                        records = json.loads(text)
+                        # Saved comments of a user are single objects
+                        comments.extend(records if isinstance(records, list) else [records])
+            except (OSError, ValueError):
+                continue
+        return submissions, comments
+
+    @staticmethod
+    def unique(records):
+        '''
+        Keeps the first record of each id
+        '''
+        seen = set()
+        unique_records = []
+        for record in records:
+            record_id = record.get("id")
+            if record_id != None:
+                if record_id in seen:
+                    continue
+                seen.add(record_id)
+            unique_records.append(record)
+        return unique_records
+
+    def write(self, name, records, fields):
+        if not records:
+            return
+        columns = {}
+        for field, field_type in fields:
+            columns[field] = [MetadataExporter.convert(record.get(field), field_type) for record in records]
+        columns["subreddit"] = [(record.get("subreddit_name_prefixed") or "unknown").split("/")[-1]
+                                for record in records]
+        columns["month"] = [MetadataExporter.month(record.get("created_utc")) for record in records]
+
+        schema = pyarrow.schema(
+            [(field, getattr(pyarrow, field_type)()) for field, field_type in fields] +
+            [("subreddit", pyarrow.string()), ("month", pyarrow.string())])
+        table = pyarrow.Table.from_pydict(columns, schema=schema)
+        pyarrow.parquet.write_to_dataset(
+            table, root_path=os.path.join(self.destination, name),
+            partition_cols=["subreddit", "month"],
+            existing_data_behavior="delete_matching")
+
+    @staticmethod
+    def convert(value, field_type):
+        '''
+        Coerces a JSON value to the column type, e.g., `edited` is `false`
+        or a timestamp
+        '''
+        if value == None:
+            return None
+        try:
+            if field_type == "int64":
+                return int(value)
+            if field_type == "float64":
+                return None if value is False else float(value)
+            if field_type == "bool_":
+                return bool(value)
+        except (TypeError, ValueError):
+            return None
+        return str(value)
+
+    @staticmethod
+    def month(created_utc):
+        if created_utc == None:
+            return "unknown"
+        return datetime.fromtimestamp(int(created_utc), timezone.utc).strftime("%Y-%m")
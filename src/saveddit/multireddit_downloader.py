@@ -9,7 +9,12 @@ import os
 import praw
 from pprint import pprint
 import re
+from saveddit.download_index import DownloadIndex
+from saveddit.listing_planner import ListingPlanner
+from saveddit.media_store import get_media_store
+from saveddit.metadata_archive import get_metadata_archive
 from saveddit.submission_downloader import SubmissionDownloader
+from saveddit.submission_pipeline import SubmissionPipeline
 from saveddit.subreddit_downloader import SubredditDownloader
 from saveddit.multireddit_downloader_config import MultiredditDownloaderConfig
 import sys
@@ -46,12 +51,16 @@ class MultiredditDownloader:
         self.multireddit_name = "+".join(multireddit_names)
         self.multireddit = self.reddit.subreddit(self.multireddit_name)
 
-    def download(self, output_path, categories=MultiredditDownloaderConfig.DEFAULT_CATEGORIES, post_limit=MultiredditDownloaderConfig.DEFAULT_POST_LIMIT, skip_videos=False, skip_meta=False, skip_comments=False, comment_limit=0):
+    def download(self, output_path, categories=MultiredditDownloaderConfig.DEFAULT_CATEGORIES, post_limit=MultiredditDownloaderConfig.DEFAULT_POST_LIMIT, skip_videos=False, skip_meta=False, skip_comments=False, comment_limit=0, workers=MultiredditDownloaderConfig.DEFAULT_WORKERS):
         '''
         categories: List of categories within the multireddit to download (see MultiredditDownloaderConfig.DEFAULT_CATEGORIES)
         post_limit: Number of posts to download (default: None, i.e., all posts)
         comment_limit: Number of comment levels to download from submission (default: `0`, i.e., only top-level comments)
           - to get all comments, set comment_limit to `None`
+        workers: Number of submissions processed concurrently (default: 1, i.e., sequential)
+
+        All the category listings are fetched first and a submission listed in
+        several categories is downloaded once, see ListingPlanner
         '''
 
         multireddit_dir_name = self.multireddit_name
@@ -63,15 +72,39 @@ class MultiredditDownloader:
             output_path, "www.reddit.com"), "m"), multireddit_dir_name)
         categories = categories
 
+        index = DownloadIndex.open(output_path)
+        submission_config = {
+            'imgur_client_id': MultiredditDownloader.IMGUR_CLIENT_ID,
+            'show_progress': workers == 1,
+            'index': index,
+            'media_store': get_media_store(output_path),
+            'metadata_archive': get_metadata_archive(output_path),
+        }
+
+        listings = []
         for c in categories:
-            self.logger.notice("Downloading from /m/" +
-                               self.multireddit_name + "/" + c + "/")
             category_dir = os.path.join(root_dir, c)
             if not os.path.exists(category_dir):
                 os.makedirs(category_dir)
             category_function = getattr(self.multireddit, c)
+            listings.append((c, category_dir, enumerate(category_function(limit=post_limit))))
+
+        self.logger.notice("Fetching listings of /m/" + self.multireddit_name + "/")
+        planner = ListingPlanner(index)
+        plan = planner.plan(listings)
 
-            for i, submission in enumerate(category_function(limit=post_limit)):
-                SubmissionDownloader(submission, i, self.logger, category_dir,
+        for c, category_dir, items in plan:
+            self.logger.notice("Downloading from /m/" +
+                               self.multireddit_name + "/" + c + "/")
+
+            def process(i, submission, logger):
+                return SubmissionDownloader(submission, i, logger, category_dir,
                     skip_videos, skip_meta, skip_comments, comment_limit,
-                    {'imgur_client_id': MultiredditDownloader.IMGUR_CLIENT_ID})
+                    submission_config)
+
+            pipeline = SubmissionPipeline(self.logger, workers)
+            pipeline.run(items, process)
+
+        linked = planner.link()
+        if linked:
+            self.logger.verbose("Linked " + str(linked) + " post(s) listed in more than one category")
@@ -1,4 +1,5 @@
 class MultiredditDownloaderConfig:
     DEFAULT_CATEGORIES = ["hot", "new", "random_rising", "rising",
                           "controversial", "top", "gilded"]
-    DEFAULT_POST_LIMIT = None
\ No newline at end of file
+    DEFAULT_POST_LIMIT = None
+    DEFAULT_WORKERS = 1
@@ -0,0 +1,9 @@
+class QueueConfig:
+    DEFAULT_CATEGORIES = ["hot", "new", "random_rising", "rising",
+                          "controversial", "top", "gilded"]
+    DEFAULT_POST_LIMIT = None
+    DEFAULT_WORKERS = 4
+    DEFAULT_LEASE_SECONDS = 300
+    DEFAULT_MAX_ATTEMPTS = 5
+    DEFAULT_RETRY_DELAY = 30  # seconds before a failed or throttled item is leased again
+    DEFAULT_POLL_INTERVAL = 5  # seconds between lease attempts of an idle worker
@@ -0,0 +1,215 @@
+import coloredlogs
+import verboselogs
+import os
+import praw
+import socket
+import threading
+from saveddit.download_index import DownloadIndex
+from saveddit.listing_planner import ListingPlanner
+from saveddit.media_store import get_media_store
+from saveddit.metadata_archive import get_metadata_archive
+from saveddit.queue_config import QueueConfig
+from saveddit.submission_downloader import SubmissionDownloader
+from saveddit.submission_pipeline import BufferedLogger
+from saveddit.subreddit_downloader import SubredditDownloader
+
+
+class QueueProducer:
+    '''
+    Puts the submissions of subreddit listings on a WorkQueue
+
+    The category listings of each subreddit are fetched concurrently, like
+    `saveddit subreddit` does (see ListingPlanner), and each submission is
+    queued once along with where and how to download it. The directories
+    are relative to the output path of each worker.
+    '''
+    BATCH_SIZE = 100
+
+    def __init__(self, work_queue):
+        self.queue = work_queue
+        self.reddit = praw.Reddit(
+            client_id=SubredditDownloader.REDDIT_CLIENT_ID,
+            client_secret=SubredditDownloader.REDDIT_CLIENT_SECRET,
+            user_agent="saveddit (by /u/p_ranav)",
+        )
+
+        self.logger = verboselogs.VerboseLogger(__name__)
+        level_styles = {
+            'critical': {'bold': True, 'color': 'red'},
+            'debug': {'color': 'green'},
+            'error': {'color': 'red'},
+            'info': {'color': 'white'},
+            'notice': {'color': 'magenta'},
+            'spam': {'color': 'white', 'faint': True},
+            'success': {'bold': True, 'color': 'green'},
+            'verbose': {'color': 'blue'},
+            'warning': {'color': 'yellow'}
+        }
+        coloredlogs.install(level='SPAM', logger=self.logger,
+                            fmt='%(message)s', level_styles=level_styles)
+
+    def produce(self, subreddits, categories=QueueConfig.DEFAULT_CATEGORIES, post_limit=QueueConfig.DEFAULT_POST_LIMIT, download_all_comments=False, skip_videos=False, skip_meta=False, skip_comments=False):
+        '''
+        Returns the number of submissions added to the queue
+        '''
+        options = {
+            "comment_limit": None if download_all_comments else 0,
+            "skip_videos": skip_videos,
+            "skip_meta": skip_meta,
+            "skip_comments": skip_comments,
+        }
+        added = 0
+        for subreddit_name in subreddits:
+            subreddit = self.reddit.subreddit(subreddit_name)
+            self.logger.notice("Fetching listings of /r/" + subreddit_name + "/")
+            listings = []
+            for c in categories:
+                category_dir = os.path.join("www.reddit.com", "r", subreddit_name, c)
+                listings.append((c, category_dir, enumerate(getattr(subreddit, c)(limit=post_limit))))
+
+            planner = ListingPlanner(None)
+            for c, category_dir, items in planner.plan(listings):
+                batch = [{"id": submission.id, "dir": category_dir, "position": i, "options": options}
+                         for i, submission in items]
+                count = 0
+                for start in range(0, len(batch), QueueProducer.BATCH_SIZE):
+                    count += self.queue.put(batch[start:start + QueueProducer.BATCH_SIZE])
+                self.logger.verbose("Queued " + str(count) + " of " + str(len(batch)) +
+                                    " post(s) from /r/" + subreddit_name + "/" + c + "/")
+                added += count
+        return added
+
+
+class QueueWorker:
+    '''
+    Downloads the submissions of a WorkQueue with SubmissionDownloader
+
+    `workers` threads lease one submission at a time. A heartbeat thread
+    renews the leases of the submissions in progress every third of
+    `lease_seconds`, so only the leases of a node that died expire.
+    Throttled and failed submissions go back on the queue with a delay.
+    With `drain`, the worker stops once nothing is queued or leased;
+    otherwise it keeps polling for new work.
+    '''
+    def __init__(self, work_queue, output_path, workers=QueueConfig.DEFAULT_WORKERS, lease_seconds=QueueConfig.DEFAULT_LEASE_SECONDS, drain=False):
+        self.queue = work_queue
+        self.output_path = output_path
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.drain = drain
+        self.name = socket.gethostname() + ":" + str(os.getpid())
+        self.reddit = praw.Reddit(
+            client_id=SubredditDownloader.REDDIT_CLIENT_ID,
+            client_secret=SubredditDownloader.REDDIT_CLIENT_SECRET,
+            user_agent="saveddit (by /u/p_ranav)",
+        )
+
+        self.logger = verboselogs.VerboseLogger(__name__)
+        level_styles = {
+            'critical': {'bold': True, 'color': 'red'},
+            'debug': {'color': 'green'},
+            'error': {'color': 'red'},
+            'info': {'color': 'white'},
+            'notice': {'color': 'magenta'},
+            'spam': {'color': 'white', 'faint': True},
+            'success': {'bold': True, 'color': 'green'},
+            'verbose': {'color': 'blue'},
+            'warning': {'color': 'yellow'}
+        }
+        coloredlogs.install(level='SPAM', logger=self.logger,
+                            fmt='%(message)s', level_styles=level_styles)
+        self.log_lock = threading.Lock()
+        self.in_progress = set()
+        self.in_progress_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.submission_config = {
+            'imgur_client_id': SubredditDownloader.IMGUR_CLIENT_ID,
+            'show_progress': workers == 1,
+            'index': DownloadIndex.open(output_path),
+            'media_store': get_media_store(output_path),
+            'metadata_archive': get_metadata_archive(output_path),
+        }
+
+    def run(self):
+        self.logger.notice("Worker " + self.name + " taking submissions from the queue")
+        heartbeat = threading.Thread(target=self.heartbeat, daemon=True)
+        heartbeat.start()
+        threads = [threading.Thread(target=self.work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.logger.notice("Stopping, waiting for the submissions in progress")
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+        self.stopped.set()
+        self.logger.notice("Queue: " + ", ".join(
+            str(count) + " " + state for state, count in sorted(self.queue.counts().items())))
+
+    def heartbeat(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            with self.in_progress_lock:
+                item_ids = list(self.in_progress)
+            if item_ids:
+                try:
+                    self.queue.heartbeat(self.name, item_ids, self.lease_seconds)
+                except Exception as e:
+                    self.logger.error("Heartbeat failed - " + str(e))
+
+    def work(self):
+        while not self.stopped.is_set():
+            try:
+                item = self.queue.lease(self.name, self.lease_seconds)
+                counts = self.queue.counts() if item == None else None
+            except Exception as e:
+                # e.g., a locked SQLite database or a dropped Redis connection
+                self.logger.error("Unable to lease from the work queue - " + str(e) +
+                                  ", trying again in " + str(QueueConfig.DEFAULT_RETRY_DELAY) + "s")
+                self.stopped.wait(QueueConfig.DEFAULT_RETRY_DELAY)
+                continue
+            if item == None:
+                if self.drain and not counts.get("queued") and not counts.get("leased"):
+                    return
+                self.stopped.wait(QueueConfig.DEFAULT_POLL_INTERVAL)
+                continue
+
+            with self.in_progress_lock:
+                self.in_progress.add(item["id"])
+            logger = BufferedLogger(self.logger, self.log_lock)
+            try:
+                self.process(item, logger)
+            except Exception as e:
+                # The lease expires and another worker picks the post up
+                logger.error("Unable to report post " + item["id"] + " to the work queue - " + str(e))
+            finally:
+                logger.flush()
+                with self.in_progress_lock:
+                    self.in_progress.discard(item["id"])
+
+    def process(self, item, logger):
+        options = item["options"]
+        try:
+            submission = self.reddit.submission(id=item["id"])
+            downloader = SubmissionDownloader(submission, item["position"], logger,
+                os.path.join(self.output_path, item["dir"]),
+                options["skip_videos"], options["skip_meta"], options["skip_comments"],
+                options["comment_limit"], self.submission_config)
+        except Exception as e:
+            logger.error("Unable to download post " + item["id"] + " - " + str(e))
+            self.queue.retry(self.name, item["id"], error=str(e))
+            return
+        # The status is final once its ffmpeg merge, if any, is done
+        downloader.wait()
+        if downloader.throttled != None:
+            delay = downloader.throttled.retry_after
+            if delay == None:
+                delay = QueueConfig.DEFAULT_RETRY_DELAY
+            self.queue.retry(self.name, item["id"], delay, str(downloader.throttled))
+        elif downloader.status == DownloadIndex.STATUS_FAILED:
+            self.queue.retry(self.name, item["id"], error="failed to download its media")
+        else:
+            self.queue.complete(self.name, item["id"])
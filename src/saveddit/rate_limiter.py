@@ -0,0 +1,262 @@
+import asyncio
+from email.utils import parsedate_to_datetime
+from multiprocessing.managers import BaseManager
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class Throttled(IOError):
+    '''
+    Raised when a host keeps answering 429/503 after all retries
+
+    `retry_after` is the number of seconds the host asked us to wait, if it
+    said so
+    '''
+    def __init__(self, url, retry_after=None):
+        message = "Throttled by " + str(urlparse(url).hostname)
+        if retry_after != None:
+            message += " (retry after " + str(int(retry_after)) + "s)"
+        super().__init__(message)
+        self.url = url
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    '''
+    Parses a Retry-After header, given either in seconds or as an HTTP date
+    '''
+    if value == None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    '''
+    Token bucket plus AIMD concurrency window for a single host
+
+    Requests take a token from a bucket refilled at `rate` tokens per second
+    (up to `burst`) and a slot in a concurrency window. The window grows by
+    about one slot per window's worth of successful requests (additive
+    increase) and is halved on every 429 or 5xx answer (multiplicative
+    decrease). A `Retry-After` header blocks the host for that long.
+    '''
+    DEFAULT_BACKOFF = 5  # seconds to block a host on a 429 without Retry-After
+
+    def __init__(self, rate, burst, max_concurrency, min_concurrency=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_concurrency = float(max_concurrency)
+        self.min_concurrency = float(min_concurrency)
+        self.window = float(max_concurrency)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.condition = threading.Condition()
+
+    def try_acquire(self):
+        '''
+        Takes a token and a slot if both are available and returns 0,
+        otherwise returns how many seconds to wait before trying again
+        '''
+        with self.condition:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= int(self.window):
+                return 0.05
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            with self.condition:
+                self.condition.wait(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, status_code=None, retry_after=None):
+        '''
+        Frees the slot and adapts the window to the outcome of the request.
+        `status_code` is None when the request failed without an answer.
+        '''
+        with self.condition:
+            self.in_flight -= 1
+            if status_code != None:
+                if status_code == 429 or status_code >= 500:
+                    self.window = max(self.min_concurrency, self.window / 2)
+                    delay = parse_retry_after(retry_after)
+                    if delay == None and status_code == 429:
+                        delay = HostLimiter.DEFAULT_BACKOFF
+                    if delay != None:
+                        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+                elif status_code < 400:
+                    self.window = min(self.max_concurrency, self.window + 1 / self.window)
+            self.condition.notify_all()
+
+    def retry_delay(self):
+        with self.condition:
+            return max(0.0, self.blocked_until - time.monotonic())
+
+
+class RateLimiter:
+    '''
+    Process-wide registry of HostLimiters, shared by all workers
+
+    Limits are looked up by host, then by parent domain (e.g., i.imgur.com
+    falls back to imgur.com), then DEFAULT_LIMITS. Each entry is
+    (requests per second, burst, maximum concurrency).
+    '''
+    THROTTLE_STATUSES = [429, 503]
+
+    DEFAULT_LIMITS = (20, 40, 16)
+    HOST_LIMITS = {
+        "api.imgur.com": (2, 5, 4),
+        "imgur.com": (10, 20, 8),
+        "redgifs.com": (2, 5, 4),
+        "gfycat.com": (2, 5, 4),
+        "i.redd.it": (30, 60, 16),
+        "v.redd.it": (20, 40, 8),
+        "oauth.reddit.com": (1.5, 30, 4),
+    }
+
+    def __init__(self, host_limits=None):
+        self.host_limits = dict(RateLimiter.HOST_LIMITS)
+        if host_limits:
+            self.host_limits.update(host_limits)
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def for_host(self, hostname):
+        hostname = (hostname or "").lower()
+        with self.lock:
+            limiter = self.limiters.get(hostname)
+            if limiter == None:
+                limits = RateLimiter.DEFAULT_LIMITS
+                parts = hostname.split(".")
+                for i in range(len(parts) - 1):
+                    domain = ".".join(parts[i:])
+                    if domain in self.host_limits:
+                        limits = self.host_limits[domain]
+                        break
+                limiter = HostLimiter(*limits)
+                self.limiters[hostname] = limiter
+            return limiter
+
+    def for_url(self, url):
+        return self.for_host(urlparse(url).hostname)
+
+    # Called by RemoteRateLimiter through RateLimiterManager
+
+    def try_acquire(self, hostname):
+        return self.for_host(hostname).try_acquire()
+
+    def release(self, hostname, status_code=None, retry_after=None):
+        self.for_host(hostname).release(status_code, retry_after)
+
+    def retry_delay(self, hostname):
+        return self.for_host(hostname).retry_delay()
+
+
+class RemoteHostLimiter:
+    '''
+    HostLimiter interface to a host of a RateLimiter living in another
+    process (see RateLimiterManager)
+    '''
+    def __init__(self, rate_limiter, hostname):
+        self.rate_limiter = rate_limiter
+        self.hostname = hostname
+
+    def try_acquire(self):
+        return self.rate_limiter.try_acquire(self.hostname)
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, status_code=None, retry_after=None):
+        self.rate_limiter.release(self.hostname, status_code, retry_after)
+
+    def retry_delay(self):
+        return self.rate_limiter.retry_delay(self.hostname)
+
+
+class RemoteRateLimiter:
+    '''
+    RateLimiter interface to the RateLimiter served by a RateLimiterManager
+    '''
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def for_host(self, hostname):
+        hostname = (hostname or "").lower()
+        with self.lock:
+            limiter = self.limiters.get(hostname)
+            if limiter == None:
+                limiter = RemoteHostLimiter(self.rate_limiter, hostname)
+                self.limiters[hostname] = limiter
+            return limiter
+
+    def for_url(self, url):
+        return self.for_host(urlparse(url).hostname)
+
+
+_rate_limiter = RateLimiter()
+
+
+def get_rate_limiter():
+    return _rate_limiter
+
+
+def set_rate_limiter(rate_limiter):
+    '''
+    Replaces the process-wide rate limiter, e.g., with a RemoteRateLimiter
+    in the worker processes of a JobRunner
+    '''
+    global _rate_limiter
+    _rate_limiter = rate_limiter
+
+
+class RateLimiterManager(BaseManager):
+    '''
+    Serves a single RateLimiter to several processes, so that the per-host
+    limits hold for all of them together rather than for each one
+    '''
+    pass
+
+
+RateLimiterManager.register("rate_limiter", callable=get_rate_limiter,
+                            exposed=["try_acquire", "release", "retry_delay"])
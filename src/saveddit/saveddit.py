@@ -1,9 +1,14 @@
 import argparse
 import sys
+from saveddit.job_runner import JobRunner, use_job_log
+from saveddit.export_config import ExportConfig
+from saveddit.ffmpeg_pool import shutdown_ffmpeg_pool
 from saveddit.multireddit_downloader_config import MultiredditDownloaderConfig
+from saveddit.queue_config import QueueConfig
 from saveddit.search_config import SearchConfig
 from saveddit.subreddit_downloader_config import SubredditDownloaderConfig
 from saveddit.user_downloader_config import UserDownloaderConfig
+from saveddit.watch_config import WatchConfig
 from saveddit._version import __version__
 
 
@@ -37,6 +42,44 @@ class UniqueAppendAction(argparse.Action):
         unique_values = set(values)
         setattr(namespace, self.dest, unique_values)
 
+def download_subreddit(subreddit, args):
+    from saveddit.subreddit_downloader import SubredditDownloader
+    downloader = SubredditDownloader(subreddit)
+    use_job_log(downloader.logger)
+    downloader.download(args.o,
+                        download_all_comments=args.all_comments, categories=args.f, post_limit=args.l, skip_videos=args.skip_videos, skip_meta=args.skip_meta, skip_comments=args.skip_comments, workers=args.workers, incremental=args.incremental)
+
+def download_user(args):
+    from saveddit.user_downloader import UserDownloader
+    downloader = UserDownloader()
+    use_job_log(downloader.logger)
+    downloader.download_user_meta(args)
+    if args.user_subparser_name == "comments":
+        downloader.download_comments(args)
+    elif args.user_subparser_name == "multireddits":
+        downloader.download_multireddits(args)
+    elif args.user_subparser_name == "submitted":
+        downloader.download_submitted(args)
+    elif args.user_subparser_name == "saved":
+        downloader.download_saved(args)
+    elif args.user_subparser_name == "upvoted":
+        downloader.download_upvoted(args)
+    elif args.user_subparser_name == "gilded":
+        downloader.download_gilded(args)
+
+def run_jobs(jobs, output_path, processes):
+    '''
+    Runs the (name, function, args) jobs one after another, or sharded
+    across `processes` processes
+    '''
+    if processes > 1 and len(jobs) > 1:
+        if JobRunner.is_supported():
+            JobRunner(output_path, processes).run(jobs)
+            return
+        print("--jobs needs the `fork` start method, which is not available on this platform, running sequentially")
+    for _, function, args in jobs:
+        function(*args)
+
 def main():
     argv = sys.argv[1:]
 
@@ -78,6 +121,20 @@ def main():
                         default=False,
                         action='store_true',
                         help='When true, saveddit will download all the comments in a post instead of just the top ones.')
+    subreddit_parser.add_argument('--incremental',
+                        default=False,
+                        action='store_true',
+                        help='When true, saveddit will stop paginating the `new` listing at the newest submission seen by the previous run')
+    subreddit_parser.add_argument('--workers',
+                        default=SubredditDownloaderConfig.DEFAULT_WORKERS,
+                        metavar='workers',
+                        type=check_positive,
+                        help='Number of submissions to download concurrently (default: %(default)s)')
+    subreddit_parser.add_argument('--jobs',
+                        default=SubredditDownloaderConfig.DEFAULT_JOBS,
+                        metavar='jobs',
+                        type=check_positive,
+                        help='Number of subreddits to download in parallel processes (default: %(default)s)')
     subreddit_parser.add_argument('-o',
                         required=True,
                         type=str,
@@ -114,6 +171,11 @@ def main():
                         default=False,
                         action='store_true',
                         help='When true, saveddit will not download videos (e.g., gfycat, redgifs, youtube, v.redd.it links)')
+    multireddit_parser.add_argument('--workers',
+                        default=MultiredditDownloaderConfig.DEFAULT_WORKERS,
+                        metavar='workers',
+                        type=check_positive,
+                        help='Number of submissions to download concurrently (default: %(default)s)')
     multireddit_parser.add_argument('-o',
                         required=True,
                         type=str,
@@ -157,6 +219,11 @@ def main():
                         default=False,
                         action='store_true',
                         help='When true, saveddit will not download videos (e.g., gfycat, redgifs, youtube, v.redd.it links)')
+    search_parser.add_argument('--workers',
+                        default=SearchConfig.DEFAULT_WORKERS,
+                        metavar='workers',
+                        type=check_positive,
+                        help='Number of submissions to download concurrently (default: %(default)s)')
     search_parser.add_argument('-o',
                         required=True,
                         type=str,
@@ -169,6 +236,11 @@ def main():
                         metavar='users',
                         nargs='+',
                         help='Names of users to download, e.g., Poem_for_your_sprog')
+    user_parser.add_argument('--jobs',
+                        default=UserDownloaderConfig.DEFAULT_JOBS,
+                        metavar='jobs',
+                        type=check_positive,
+                        help='Number of users to download in parallel processes (default: %(default)s)')
 
 
     user_subparsers = user_parser.add_subparsers(dest="user_subparser_name")
@@ -188,6 +260,10 @@ def main():
                         default=False,
                         action='store_true',
                         help='When true, saveddit will not download videos (e.g., gfycat, redgifs, youtube, v.redd.it links)')
+    saved_parser.add_argument('--incremental',
+                        default=False,
+                        action='store_true',
+                        help='When true, saveddit will stop paginating at the newest saved item seen by the previous run')
     saved_parser.add_argument('-l',
                         default=UserDownloaderConfig.DEFAULT_POST_LIMIT,
                         metavar='post_limit',
@@ -245,6 +321,10 @@ def main():
                         default=False,
                         action='store_true',
                         help='When true, saveddit will not download videos (e.g., gfycat, redgifs, youtube, v.redd.it links)')
+    submitted_parser.add_argument('--incremental',
+                        default=False,
+                        action='store_true',
+                        help='When true, saveddit will stop paginating at the newest submission seen by the previous run (only with `-s new`)')
     submitted_parser.add_argument('-l',
                         default=UserDownloaderConfig.DEFAULT_POST_LIMIT,
                         metavar='post_limit',
@@ -309,6 +389,10 @@ def main():
                         default=False,
                         action='store_true',
                         help='When true, saveddit will not download videos (e.g., gfycat, redgifs, youtube, v.redd.it links)')
+    upvoted_parser.add_argument('--incremental',
+                        default=False,
+                        action='store_true',
+                        help='When true, saveddit will stop paginating at the newest upvoted submission seen by the previous run')
     upvoted_parser.add_argument('-l',
                         default=UserDownloaderConfig.DEFAULT_POST_LIMIT,
                         metavar='post_limit',
@@ -340,42 +424,217 @@ def main():
                         help='Directory where saveddit will save downloaded comments'
                         )
 
+    watch_parser = subparsers.add_parser('watch')
+    watch_parser.add_argument('subreddits',
+                        metavar='subreddits',
+                        nargs='*',
+                        action=UniqueAppendAction,
+                        help='Names of subreddits to watch for new submissions, e.g., pics')
+    watch_parser.add_argument('-u',
+                        metavar='users',
+                        nargs='+',
+                        action=UniqueAppendAction,
+                        help='Names of users to watch for new submissions')
+    watch_parser.add_argument('--skip-comments',
+                        default=False,
+                        action='store_true',
+                        help='When true, saveddit will not save comments to a comments.json file')
+    watch_parser.add_argument('--skip-meta',
+                        default=False,
+                        action='store_true',
+                        help='When true, saveddit will not save meta to a submission.json file on submissions')
+    watch_parser.add_argument('--skip-videos',
+                        default=False,
+                        action='store_true',
+                        help='When true, saveddit will not download videos (e.g., gfycat, redgifs, youtube, v.redd.it links)')
+    watch_parser.add_argument('--all-comments',
+                        default=False,
+                        action='store_true',
+                        help='When true, saveddit will download all the comments in a post instead of just the top ones.')
+    watch_parser.add_argument('--workers',
+                        default=WatchConfig.DEFAULT_WORKERS,
+                        metavar='workers',
+                        type=check_positive,
+                        help='Number of submissions to download concurrently (default: %(default)s)')
+    watch_parser.add_argument('-o',
+                        required=True,
+                        type=str,
+                        metavar='output_path',
+                        help='Directory where saveddit will save downloaded content'
+                        )
+
+    queue_parser = subparsers.add_parser('queue')
+    queue_subparsers = queue_parser.add_subparsers(dest="queue_subparser_name")
+    queue_subparsers.required = True
+
+    # queue.produce subparser
+    produce_parser = queue_subparsers.add_parser('produce')
+    produce_parser.add_argument('subreddits',
+                        metavar='subreddits',
+                        nargs='+',
+                        action=UniqueAppendAction,
+                        help='Names of subreddits whose posts to queue, e.g., AskReddit')
+    produce_parser.add_argument('-f',
+                        metavar='categories',
+                        default=QueueConfig.DEFAULT_CATEGORIES,
+                        nargs='+',
+                        action=UniqueAppendAction,
+                        help='Categories of posts to queue (default: %(default)s)')
+    produce_parser.add_argument('-l',
+                        default=QueueConfig.DEFAULT_POST_LIMIT,
+                        metavar='post_limit',
+                        type=check_positive,
+                        help='Limit the number of submissions queued in each category (default: %(default)s, i.e., all submissions)')
+    produce_parser.add_argument('--skip-comments',
+                        default=False,
+                        action='store_true',
+                        help='When true, the workers will not save comments to a comments.json file')
+    produce_parser.add_argument('--skip-meta',
+                        default=False,
+                        action='store_true',
+                        help='When true, the workers will not save meta to a submission.json file on submissions')
+    produce_parser.add_argument('--skip-videos',
+                        default=False,
+                        action='store_true',
+                        help='When true, the workers will not download videos (e.g., gfycat, redgifs, youtube, v.redd.it links)')
+    produce_parser.add_argument('--all-comments',
+                        default=False,
+                        action='store_true',
+                        help='When true, the workers will download all the comments in a post instead of just the top ones.')
+    produce_parser.add_argument('--queue',
+                        required=True,
+                        type=str,
+                        metavar='queue_url',
+                        help='Work queue shared with the workers, e.g., sqlite:///mnt/shared/queue.db or redis://host:6379/0')
+
+    # queue.work subparser
+    work_parser = queue_subparsers.add_parser('work')
+    work_parser.add_argument('--workers',
+                        default=QueueConfig.DEFAULT_WORKERS,
+                        metavar='workers',
+                        type=check_positive,
+                        help='Number of submissions to download concurrently (default: %(default)s)')
+    work_parser.add_argument('--lease',
+                        default=QueueConfig.DEFAULT_LEASE_SECONDS,
+                        metavar='seconds',
+                        type=check_positive,
+                        help='Seconds before the submissions of a worker that stopped responding are queued again (default: %(default)s)')
+    work_parser.add_argument('--drain',
+                        default=False,
+                        action='store_true',
+                        help='When true, the worker stops once the queue is empty instead of waiting for more posts')
+    work_parser.add_argument('--queue',
+                        required=True,
+                        type=str,
+                        metavar='queue_url',
+                        help='Work queue to take submissions from, e.g., sqlite:///mnt/shared/queue.db or redis://host:6379/0')
+    work_parser.add_argument('-o',
+                        required=True,
+                        type=str,
+                        metavar='output_path',
+                        help='Directory where saveddit will save downloaded content'
+                        )
+
+    # queue.status subparser
+    status_parser = queue_subparsers.add_parser('status')
+    status_parser.add_argument('--queue',
+                        required=True,
+                        type=str,
+                        metavar='queue_url',
+                        help='Work queue to report on, e.g., sqlite:///mnt/shared/queue.db or redis://host:6379/0')
+
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument('--format',
+                        default=ExportConfig.DEFAULT_FORMAT,
+                        choices=ExportConfig.DEFAULT_FORMAT_OPTIONS,
+                        help='Columnar format to export to (default: %(default)s, choices: [%(choices)s])')
+    export_parser.add_argument('--workers',
+                        default=ExportConfig.DEFAULT_WORKERS,
+                        metavar='workers',
+                        type=check_positive,
+                        help='Number of processes scanning the output directory (default: number of CPUs)')
+    export_parser.add_argument('--to',
+                        default=None,
+                        type=str,
+                        metavar='export_path',
+                        help='Directory to write the export to (default: <output_path>/.saveddit/export)')
+    export_parser.add_argument('-o',
+                        required=True,
+                        type=str,
+                        metavar='output_path',
+                        help='Directory where saveddit saved the downloaded content'
+                        )
+
     args = parser.parse_args(argv)
     print(asciiart())
 
     if args.subparser_name == "subreddit":
+        # Loads user_config.yaml before any worker process is started
         from saveddit.subreddit_downloader import SubredditDownloader
-        for subreddit in args.subreddits:
-            downloader = SubredditDownloader(subreddit)
-            downloader.download(args.o,
-                                download_all_comments=args.all_comments, categories=args.f, post_limit=args.l, skip_videos=args.skip_videos, skip_meta=args.skip_meta, skip_comments=args.skip_comments)
+        jobs = [("r/" + subreddit, download_subreddit, (subreddit, args)) for subreddit in args.subreddits]
+        run_jobs(jobs, args.o, args.jobs)
     elif args.subparser_name == "multireddit":
         from saveddit.multireddit_downloader import MultiredditDownloader
         downloader = MultiredditDownloader(args.subreddits)
         downloader.download(args.o,
-                            categories=args.f, post_limit=args.l, skip_videos=args.skip_videos, skip_meta=args.skip_meta, skip_comments=args.skip_comments)
+                            categories=args.f, post_limit=args.l, skip_videos=args.skip_videos, skip_meta=args.skip_meta, skip_comments=args.skip_comments, workers=args.workers)
     elif args.subparser_name == "search":
         from saveddit.search_subreddits import SearchSubreddits
         downloader = SearchSubreddits(args.subreddits)
         downloader.download(args)
     elif args.subparser_name == "user":
+        # Loads user_config.yaml (and asks for the password) before any
+        # worker process is started
         from saveddit.user_downloader import UserDownloader
-        downloader = UserDownloader()
-        downloader.download_user_meta(args)
-        if args.user_subparser_name == "comments":
-            downloader.download_comments(args)
-        elif args.user_subparser_name == "multireddits":
-            downloader.download_multireddits(args)
-        elif args.user_subparser_name == "submitted":
-            downloader.download_submitted(args)
-        elif args.user_subparser_name == "saved":
-            downloader.download_saved(args)
-        elif args.user_subparser_name == "upvoted":
-            downloader.download_upvoted(args)
-        elif args.user_subparser_name == "gilded":
-            downloader.download_gilded(args)
+        if args.jobs > 1:
+            jobs = [("u/" + username, download_user, (argparse.Namespace(**dict(vars(args), users=[username])),))
+                    for username in args.users]
+        else:
+            jobs = [("u/" + "+".join(args.users), download_user, (args,))]
+        run_jobs(jobs, args.o, args.jobs)
+    elif args.subparser_name == "watch":
+        if not args.subreddits and not args.u:
+            watch_parser.error("nothing to watch, give subreddits and/or -u users")
+        from saveddit.stream_watcher import StreamWatcher
+        watcher = StreamWatcher(args.subreddits, args.u)
+        watcher.watch(args.o,
+                      download_all_comments=args.all_comments, skip_videos=args.skip_videos, skip_meta=args.skip_meta, skip_comments=args.skip_comments, workers=args.workers)
+    elif args.subparser_name == "queue":
+        from saveddit.work_queue import WorkQueue, open_work_queue
+        if args.queue.startswith("local://"):
+            queue_parser.error("local:// queues only live as long as one process, use sqlite:// or redis://")
+        try:
+            work_queue = open_work_queue(args.queue)
+        except (ImportError, ValueError) as e:
+            sys.exit(str(e))
+        if args.queue_subparser_name == "produce":
+            from saveddit.queue_coordinator import QueueProducer
+            producer = QueueProducer(work_queue)
+            added = producer.produce(args.subreddits,
+                                     categories=args.f, post_limit=args.l, download_all_comments=args.all_comments, skip_videos=args.skip_videos, skip_meta=args.skip_meta, skip_comments=args.skip_comments)
+            print("Queued " + str(added) + " submissions")
+        elif args.queue_subparser_name == "work":
+            from saveddit.queue_coordinator import QueueWorker
+            worker = QueueWorker(work_queue, args.o, workers=args.workers, lease_seconds=args.lease, drain=args.drain)
+            worker.run()
+        elif args.queue_subparser_name == "status":
+            counts = work_queue.counts()
+            for state in [WorkQueue.QUEUED, WorkQueue.LEASED, WorkQueue.DONE, WorkQueue.FAILED]:
+                print(state + ": " + str(counts.get(state, 0)))
+    elif args.subparser_name == "export":
+        from saveddit.metadata_export import MetadataExporter
+        exporter = MetadataExporter(args.o, args.to, args.workers)
+        try:
+            submissions, comments = exporter.export(args.format)
+        except RuntimeError as e:
+            sys.exit(str(e))
+        print("Exported " + str(submissions) + " submissions and " + str(comments) +
+              " comments to " + exporter.destination)
     else:
         parser.print_help()
 
+    # Let queued ffmpeg jobs (e.g., reddit video merges) finish
+    shutdown_ffmpeg_pool()
+
 if __name__ == "__main__":
     main()
@@ -4,4 +4,5 @@ class SearchConfig:
     DEFAULT_SYNTAX = "lucene"
     DEFAULT_SYNTAX_CATEGORIES = ["cloud search", "lucene", "plain"]
     DEFAULT_TIME_FILTER = "all"
-    DEFAULT_TIME_FILTER_CATEGORIES = ["all", "day", "hour", "month", "week", "year"]
\ No newline at end of file
+    DEFAULT_TIME_FILTER_CATEGORIES = ["all", "day", "hour", "month", "week", "year"]
+    DEFAULT_WORKERS = 1
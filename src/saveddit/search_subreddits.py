@@ -9,7 +9,11 @@ import os
 import praw
 from pprint import pprint
 import re
+from saveddit.download_index import DownloadIndex
+from saveddit.media_store import get_media_store
+from saveddit.metadata_archive import get_metadata_archive
 from saveddit.submission_downloader import SubmissionDownloader
+from saveddit.submission_pipeline import SubmissionPipeline
 from saveddit.subreddit_downloader import SubredditDownloader
 from saveddit.search_config import SearchConfig
 import sys
@@ -88,6 +92,7 @@ class SearchSubreddits:
         skip_videos = args.skip_videos
         skip_meta = args.skip_meta
         comment_limit = 0 # top-level comments ONLY
+        workers = args.workers
 
         self.logger.verbose("Searching '" + query + "' in " + self.multireddit_name + ", sorted by " + sort)
         if include_nsfw:
@@ -106,13 +111,21 @@ class SearchSubreddits:
         else:
             search_results = self.subreddit.search(query, sort, syntax, time_filter)
 
-        results_found = False
-        for i, submission in enumerate(search_results):
-            if not results_found:
-                results_found = True
-            SubmissionDownloader(submission, i, self.logger, search_dir,
+        submission_config = {
+            'imgur_client_id': SubredditDownloader.IMGUR_CLIENT_ID,
+            'show_progress': workers == 1,
+            'index': DownloadIndex.open(output_path),
+            'media_store': get_media_store(output_path),
+            'metadata_archive': get_metadata_archive(output_path),
+        }
+
+        def process(i, submission, logger):
+            return SubmissionDownloader(submission, i, logger, search_dir,
                 skip_videos, skip_meta, skip_comments, comment_limit,
-                {'imgur_client_id': SubredditDownloader.IMGUR_CLIENT_ID})
+                submission_config)
+
+        pipeline = SubmissionPipeline(self.logger, workers)
+        results_found = pipeline.run(enumerate(search_results), process) > 0
 
         if not results_found:
             self.logger.spam("     * No results found")
\ No newline at end of file
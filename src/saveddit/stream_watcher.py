@@ -0,0 +1,247 @@
+import coloredlogs
+from collections import OrderedDict
+import verboselogs
+import os
+import praw
+import queue
+import threading
+import time
+from saveddit.download_index import DownloadIndex
+from saveddit.media_store import get_media_store
+from saveddit.metadata_archive import get_metadata_archive
+from saveddit.submission_downloader import SubmissionDownloader
+from saveddit.submission_pipeline import SubmissionPipeline
+from saveddit.subreddit_downloader import SubredditDownloader
+from saveddit.watch_config import WatchConfig
+
+
+class StreamCheckpoint:
+    '''
+    Resume point of one stream (a subreddit or a user), kept as a listing
+    mark in the index
+
+    Submissions finish out of order when several workers download them, so
+    the mark only moves past a submission once every submission the stream
+    yielded before it has been processed. After a restart, the items the
+    stream replays up to the mark are dropped without being downloaded
+    again. Submissions are numbered in the order they arrive, continuing
+    after the `NNN_title` entries already in `output_dir`.
+    '''
+    def __init__(self, index, source, output_dir):
+        self.index = index
+        self.source = source
+        self.output_dir = output_dir
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        self.mark = index.get_mark(source)
+        self.next_index = len(os.listdir(output_dir))
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def is_new(self, submission):
+        '''
+        False for submissions up to the mark and for those still being
+        processed, e.g., replayed by a reopened stream
+        '''
+        with self.lock:
+            if submission.fullname in self.pending:
+                return False
+            if self.mark == None:
+                return True
+            if submission.fullname == self.mark["fullname"]:
+                return False
+            created_utc = getattr(submission, "created_utc", None)
+            return created_utc == None or self.mark["created_utc"] == None or \
+                created_utc >= self.mark["created_utc"]
+
+    def add(self, submission):
+        '''
+        Returns the number of a new submission of the stream
+        '''
+        with self.lock:
+            i = self.next_index
+            self.next_index += 1
+            self.pending[submission.fullname] = [submission, False]
+            return i
+
+    def done(self, submission):
+        with self.lock:
+            item = self.pending.get(submission.fullname)
+            if item == None:
+                return
+            item[1] = True
+            newest = None
+            while self.pending:
+                fullname, (pending_submission, finished) = next(iter(self.pending.items()))
+                if not finished:
+                    break
+                del self.pending[fullname]
+                newest = pending_submission
+            if newest != None:
+                self.index.set_mark(self.source, newest.fullname,
+                                    getattr(newest, "created_utc", None))
+                self.mark = self.index.get_mark(self.source)
+
+
+class StreamWatcher:
+    '''
+    Archives new submissions of subreddits and users as they are posted
+
+    One thread per PRAW stream (a single one for all the subreddits, one
+    per user) puts new submissions on a bounded queue, and a
+    SubmissionPipeline of `workers` threads downloads them, so a burst of
+    posts is downloaded in parallel and a slow download does not hold up
+    the streams. Progress is checkpointed per subreddit and user (see
+    StreamCheckpoint). Throttled posts are put back on the queue once the
+    host lets us, up to WatchConfig.DEFAULT_MAX_RETRIES times. Runs until
+    interrupted; the downloads in progress are finished first.
+
+    Submissions go to www.reddit.com/r/<subreddit>/stream/ and
+    www.reddit.com/u/<user>/submitted/stream/.
+    '''
+    CATEGORY = "stream"
+
+    def __init__(self, subreddits, users):
+        self.subreddits = list(subreddits or [])
+        self.users = list(users or [])
+        self.reddit = praw.Reddit(
+            client_id=SubredditDownloader.REDDIT_CLIENT_ID,
+            client_secret=SubredditDownloader.REDDIT_CLIENT_SECRET,
+            user_agent="saveddit (by /u/p_ranav)",
+        )
+
+        self.logger = verboselogs.VerboseLogger(__name__)
+        level_styles = {
+            'critical': {'bold': True, 'color': 'red'},
+            'debug': {'color': 'green'},
+            'error': {'color': 'red'},
+            'info': {'color': 'white'},
+            'notice': {'color': 'magenta'},
+            'spam': {'color': 'white', 'faint': True},
+            'success': {'bold': True, 'color': 'green'},
+            'verbose': {'color': 'blue'},
+            'warning': {'color': 'yellow'}
+        }
+        coloredlogs.install(level='SPAM', logger=self.logger,
+                            fmt='%(message)s', level_styles=level_styles)
+
+    def watch(self, output_path, download_all_comments=False, skip_videos=False, skip_meta=False, skip_comments=False, workers=WatchConfig.DEFAULT_WORKERS, queue_size=WatchConfig.DEFAULT_QUEUE_SIZE):
+        '''
+        workers: Number of submissions downloaded concurrently
+        queue_size: Number of new submissions buffered while all workers are busy
+        '''
+        comment_limit = None if download_all_comments else 0
+        index = DownloadIndex.open(output_path)
+        submission_config = {
+            'imgur_client_id': SubredditDownloader.IMGUR_CLIENT_ID,
+            'show_progress': workers == 1,
+            'index': index,
+            'media_store': get_media_store(output_path),
+            'metadata_archive': get_metadata_archive(output_path),
+        }
+        reddit_dir = os.path.join(output_path, "www.reddit.com")
+        checkpoints = {}
+        checkpoints_lock = threading.Lock()
+
+        def checkpoint_for(submission, username):
+            if username != None:
+                source = "u/" + username.lower() + "/submitted/" + StreamWatcher.CATEGORY
+                output_dir = os.path.join(reddit_dir, "u", username, "submitted", StreamWatcher.CATEGORY)
+            else:
+                name = submission.subreddit.display_name
+                source = "r/" + name.lower() + "/" + StreamWatcher.CATEGORY
+                output_dir = os.path.join(reddit_dir, "r", name, StreamWatcher.CATEGORY)
+            with checkpoints_lock:
+                checkpoint = checkpoints.get(source)
+                if checkpoint == None:
+                    checkpoint = StreamCheckpoint(index, source, output_dir)
+                    checkpoints[source] = checkpoint
+                return checkpoint
+
+        new_submissions = queue.Queue(maxsize=queue_size)
+        streams = []
+        if self.subreddits:
+            subreddit = self.reddit.subreddit("+".join(self.subreddits))
+            streams.append(("/r/" + "+".join(self.subreddits), None, subreddit.stream.submissions))
+        for username in self.users:
+            redditor = self.reddit.redditor(name=username)
+            streams.append(("/u/" + username, username, redditor.stream.submissions))
+
+        for name, username, stream in streams:
+            thread = threading.Thread(target=self.follow,
+                                      args=(name, username, stream, checkpoint_for, new_submissions),
+                                      daemon=True)
+            thread.start()
+
+        def items():
+            while True:
+                yield new_submissions.get()
+
+        retries = {}
+        retries_lock = threading.Lock()
+
+        def retry_later(i, checkpoint, submission, throttled, logger):
+            # The pipeline only retries once its items run out, which a
+            # stream never does, so throttled posts are put back on the
+            # queue here
+            with retries_lock:
+                attempts = retries.get(submission.fullname, 0) + 1
+                retries[submission.fullname] = attempts
+            if attempts > WatchConfig.DEFAULT_MAX_RETRIES:
+                logger.error("Giving up on post #" + str(i) + " - still throttled")
+                with retries_lock:
+                    del retries[submission.fullname]
+                checkpoint.done(submission)
+                return
+            delay = throttled.retry_after
+            if delay == None:
+                delay = SubmissionPipeline.DEFAULT_RETRY_DELAY
+            timer = threading.Timer(delay, new_submissions.put, args=((i, (checkpoint, submission)),))
+            timer.daemon = True
+            timer.start()
+
+        def process(i, item, logger):
+            checkpoint, submission = item
+            try:
+                downloader = SubmissionDownloader(submission, i, logger, checkpoint.output_dir,
+                    skip_videos, skip_meta, skip_comments, comment_limit,
+                    submission_config)
+            except Exception:
+                with retries_lock:
+                    retries.pop(submission.fullname, None)
+                checkpoint.done(submission)
+                raise
+            # Throttled submissions stay ahead of the checkpoint until they
+            # are retried, so a restart in the meantime picks them up again
+            if downloader.throttled != None:
+                retry_later(i, checkpoint, submission, downloader.throttled, logger)
+                return None
+            with retries_lock:
+                retries.pop(submission.fullname, None)
+            checkpoint.done(submission)
+            return downloader
+
+        self.logger.notice("Watching " + ", ".join(name for name, _, _ in streams) + " for new submissions")
+        pipeline = SubmissionPipeline(self.logger, workers, queue_size=workers)
+        try:
+            pipeline.run(items(), process)
+        except KeyboardInterrupt:
+            self.logger.notice("Stopped watching")
+
+    def follow(self, name, username, stream, checkpoint_for, new_submissions):
+        '''
+        Puts the new submissions of a stream on `new_submissions`, reopening
+        the stream after errors
+        '''
+        while True:
+            try:
+                for submission in stream():
+                    checkpoint = checkpoint_for(submission, username)
+                    if not checkpoint.is_new(submission):
+                        continue
+                    i = checkpoint.add(submission)
+                    new_submissions.put((i, (checkpoint, submission)))
+            except Exception as e:
+                self.logger.error("Stream of " + name + " failed - " + str(e) +
+                                  ", reopening it in " + str(WatchConfig.DEFAULT_RETRY_DELAY) + "s")
+                time.sleep(WatchConfig.DEFAULT_RETRY_DELAY)
@@ -1,12 +1,11 @@
 from bs4 import BeautifulSoup
 import coloredlogs
 from colorama import Fore
-import contextlib
+import itertools
 import logging
 import verboselogs
 from datetime import datetime
 import os
-from io import StringIO
 import json
 import mimetypes
 import ffmpeg
@@ -14,15 +13,75 @@ import praw
 from pprint import pprint
 import re
 import requests
+import shutil
+import threading
+from saveddit.async_downloader import get_download_engine
+from saveddit.comment_expander import CommentExpander
+from saveddit.comment_writer import CommentWriter
+from saveddit.dash_manifest import DashManifest
+from saveddit.download_index import DownloadIndex
+from saveddit.ffmpeg_pool import get_ffmpeg_pool
+from saveddit.gallery_manifest import GalleryManifest
+from saveddit.http_client import DownloadResult, PartialDownload, get_http_client
+from saveddit.imgur_api import ImgurApi
+from saveddit.job_runner import is_job_worker
+from saveddit.media_handlers import MediaHandler, get_handler
+from saveddit.rate_limiter import Throttled
+from saveddit.url_classifier import get_url_classifier
+from saveddit.video_merger import VideoMerger
 from tqdm import tqdm
-import urllib.request
 import youtube_dl
-import os
+
+
+class YoutubeDlLog:
+    '''
+    Collects the messages youtube-dl reports for one download, see its
+    `logger` option
+    '''
+    def __init__(self):
+        self.warnings = []
+        self.errors = []
+
+    def debug(self, msg):
+        pass
+
+    def warning(self, msg):
+        self.warnings.append(msg)
+
+    def error(self, msg):
+        self.errors.append(msg)
 
 
 class SubmissionDownloader:
     def __init__(self, submission, submission_index, logger, output_dir, skip_videos, skip_meta, skip_comments, comment_limit, config):
         self.IMGUR_CLIENT_ID = config["imgur_client_id"]
+        # Progress bars are hidden when several workers or processes share
+        # the terminal
+        self.show_progress = config.get("show_progress", True) and not is_job_worker()
+        self.http = get_http_client()
+        self.engine = get_download_engine()
+        self.index = config.get("index")
+        self.media_store = config.get("media_store")
+        self.archive = config.get("metadata_archive")
+        self.classifier = get_url_classifier()
+        self.imgur = ImgurApi(self.IMGUR_CLIENT_ID, self.index)
+        # Handler of the link being downloaded, decides timeouts and retries
+        self.handler = MediaHandler
+        self.results = []
+        # Set when a host kept throttling us, see SubmissionPipeline retries
+        self.throttled = None
+        # Set when some media of the submission could not be downloaded
+        self.download_failed = False
+        # The index record is written once the submission itself and all
+        # the ffmpeg jobs it queued are done, whichever finishes last
+        self.pending = 1
+        self.pending_lock = threading.Lock()
+        self.merge_queued = False
+        self.merge_failed = False
+        self.status = None
+        self.submission_id = getattr(submission, "id", None)
+        # Set once the index record is written, see wait()
+        self.recorded = threading.Event()
 
         self.logger = logger
         i = submission_index
@@ -34,24 +93,32 @@ class SubmissionDownloader:
         if has_url:
             title = submission.title
             self.logger.verbose(prefix_str + '"' + title + '"')
-            title = re.sub(r'\W+', '_', title)
 
-            # Truncate title
-            if len(title) > 32:
-                title = title[0:32]
-                if os.name == "nt":
-                    pass
-                else:
-                    title += "..."
+            # Check the local index before doing any network work
+            record = None
+            if self.index != None:
+                record = self.index.get(submission.id)
+                if record != None and record["status"] == DownloadIndex.STATUS_COMPLETE:
+                    self.logger.spam(
+                        self.indent_1 + "Already downloaded to " + str(record["path"]) + ", skipping it\n")
+                    return
 
             # Prepare directory for the submission
-            post_dir = str(i).zfill(3) + "_" + title.replace(" ", "_")
+            post_dir = SubmissionDownloader.post_dir_name(i, title)
             submission_dir = os.path.join(output_dir, post_dir)
+            stages = set()
             if not os.path.exists(submission_dir):
                 os.makedirs(submission_dir)
-            elif os.path.exists(submission_dir):
-                print("File exists, Skipping it.")
+            elif record == None or record["path"] != submission_dir:
+                self.logger.spam(self.indent_1 + "File exists, Skipping it.")
                 return
+            else:
+                # Unfinished downloads recorded in the index are resumed,
+                # skipping the stages they completed
+                stages = self.index.get_stages(submission.id)
+
+            if self.index != None:
+                self.index.start(submission.id, submission.url, submission_dir)
 
             self.logger.spam(
                 self.indent_1 + "Processing `" + submission.url + "`")
@@ -71,204 +138,240 @@ class SubmissionDownloader:
                 else:
                     return submission_dir
 
-            if self.is_direct_link_to_content(submission.url, [".png", ".jpg", ".jpeg", ".gif"]):
-                files_dir = create_files_dir(submission_dir)
-
-                filename = submission.url.split("/")[-1]
-                self.logger.spam(
-                    self.indent_1 + "This is a direct link to a " + filename.split(".")[-1] + " file")
-                save_path = os.path.join(files_dir, filename)
-                self.download_direct_link(submission, save_path)
-                success = True
-            elif self.is_direct_link_to_content(submission.url, [".mp4"]):
-                filename = submission.url.split("/")[-1]
-                self.logger.spam(
-                    self.indent_1 + "This is a direct link to a " + filename.split(".")[-1] + " file")
-                if not skip_videos:
-                    files_dir = create_files_dir(submission_dir)
-                    save_path = os.path.join(files_dir, filename)
-                    self.download_direct_link(submission, save_path)
-                    success = True
-                else:
-                    self.logger.spam(self.indent_1 + "Skipping download of video content")
-                    success = True
-            elif self.is_reddit_gallery(submission.url):
-                files_dir = create_files_dir(submission_dir)
+            handler = self.classifier.classify(submission.url)
+            if handler == None and self.is_self_post(submission):
+                self.logger.spam(self.indent_1 + "This is a self-post")
+            elif handler == None and not skip_videos and self.is_supported_by_youtubedl(submission.url):
+                handler = get_handler("youtube_dl")
 
+            if handler != None and DownloadIndex.STAGE_MEDIA in stages:
+                self.logger.spam(self.indent_1 + "Media already downloaded")
+            elif handler != None:
                 self.logger.spam(
-                    self.indent_1 + "This is a reddit gallery")
-                self.download_reddit_gallery(submission, files_dir, skip_videos)
-                success = True
-            elif self.is_reddit_video(submission.url):
-                self.logger.spam(
-                    self.indent_1 + "This is a reddit video")
-
-                if not skip_videos:
-                    files_dir = create_files_dir(submission_dir)
-                    self.download_reddit_video(submission, files_dir)
-                    success = True
-                else:
+                    self.indent_1 + handler.describe(submission.url))
+                if handler.is_video and skip_videos:
                     self.logger.spam(self.indent_1 + "Skipping download of video content")
-                    success = True
-            elif self.is_gfycat_link(submission.url) or self.is_redgifs_link(submission.url):
-                if self.is_gfycat_link(submission.url):
-                    self.logger.spam(
-                        self.indent_1 + "This is a gfycat link")
                 else:
-                    self.logger.spam(
-                        self.indent_1 + "This is a redgif link")
-
-                if not skip_videos:
                     files_dir = create_files_dir(submission_dir)
-                    self.download_gfycat_or_redgif(submission, files_dir)
-                    success = True
-                else:
-                    self.logger.spam(self.indent_1 + "Skipping download of video content")
-                    success = True
-            elif self.is_imgur_album(submission.url):
-                files_dir = create_files_dir(submission_dir)
-
-                self.logger.spam(
-                    self.indent_1 + "This is an imgur album")
-                self.download_imgur_album(submission, files_dir)
-                success = True
-            elif self.is_imgur_image(submission.url):
-                files_dir = create_files_dir(submission_dir)
-
-                self.logger.spam(
-                    self.indent_1 + "This is an imgur image or video")
-                self.download_imgur_image(submission, files_dir)
-                success = True
-            elif self.is_self_post(submission):
-                self.logger.spam(self.indent_1 + "This is a self-post")
-                success = True
-            elif (not skip_videos) and (self.is_youtube_link(submission.url) or self.is_supported_by_youtubedl(submission.url)):
-                if self.is_youtube_link(submission.url):
-                    self.logger.spam(
-                        self.indent_1 + "This is a youtube link")
-                else:
-                    self.logger.spam(
-                        self.indent_1 + "This link is supported by a youtube-dl extractor")
-
-                if not skip_videos:
-                    files_dir = create_files_dir(submission_dir)
-                    self.download_youtube_video(submission.url, files_dir)
-                    success = True
-                else:
-                    self.logger.spam(self.indent_1 + "Skipping download of video content")
-                    success = True
-            else:
-                success = True
+                    self.handler = handler
+                    # Each handler caps how many of its downloads run at once
+                    with handler.limit:
+                        try:
+                            handler.download(self, submission, files_dir, skip_videos)
+                        except Exception as e:
+                            self.print_download_error(e)
+            success = self.throttled == None and not self.download_failed
+            # With a merge queued, on_video_merged records it once the merge
+            # worked
+            if success and not self.merge_queued:
+                self.add_stage(submission.id, DownloadIndex.STAGE_MEDIA)
 
             # Download submission meta
-            if not skip_meta:
-                self.logger.spam(self.indent_1 + "Saving submission.json")
+            if not skip_meta and DownloadIndex.STAGE_META in stages:
+                self.logger.spam(self.indent_1 + "Submission meta already saved")
+            elif not skip_meta:
+                self.logger.spam(self.indent_1 + "Saving submission meta to " + self.metadata_target("submission.json"))
                 self.download_submission_meta(submission, submission_dir)
+                self.add_stage(submission.id, DownloadIndex.STAGE_META)
             else:
                 self.logger.spam(
                     self.indent_1 + "Skipping submissions meta")
 
             # Downlaod comments if requested
-            if not skip_comments:
+            if not skip_comments and DownloadIndex.STAGE_COMMENTS in stages:
+                self.logger.spam(self.indent_1 + "Comments already saved")
+            elif not skip_comments:
                 if comment_limit == None:
                     self.logger.spam(
-                        self.indent_1 + "Saving all comments to comments.json")
+                        self.indent_1 + "Saving all comments to " + self.metadata_target(CommentWriter.file_name()))
                 else:
                     self.logger.spam(
-                        self.indent_1 + "Saving top-level comments to comments.json")
+                        self.indent_1 + "Saving top-level comments to " + self.metadata_target(CommentWriter.file_name()))
                 self.download_comments(
                     submission, submission_dir, comment_limit)
+                self.add_stage(submission.id, DownloadIndex.STAGE_COMMENTS)
             else:
                 self.logger.spam(
                     self.indent_1 + "Skipping comments")
 
+            self.status = DownloadIndex.STATUS_COMPLETE
+            if self.throttled != None:
+                self.status = DownloadIndex.STATUS_THROTTLED
+            elif not success:
+                self.status = DownloadIndex.STATUS_FAILED
+            self.submission_dir = submission_dir
+            self.release_record()
+
             if success:
                 self.logger.spam(
                     self.indent_1 + "Saved to " + submission_dir + "\n")
+            elif self.throttled != None:
+                self.logger.warning(
+                    self.indent_1 + "Throttled while downloading " + submission.url + ", will retry it later\n"
+                )
             else:
                 self.logger.warning(
                     self.indent_1 + "Failed to download from link " + submission.url + "\n"
                 )
 
+    def metadata_target(self, file_name):
+        if self.archive != None:
+            return self.archive.path
+        return file_name
+
+    @staticmethod
+    def post_dir_name(submission_index, title):
+        '''
+        Name of the `NNN_title` directory of a submission in its listing
+        '''
+        title = re.sub(r'\W+', '_', title)
+
+        # Truncate title
+        if len(title) > 32:
+            title = title[0:32]
+            if os.name == "nt":
+                pass
+            else:
+                title += "..."
+        return str(submission_index).zfill(3) + "_" + title.replace(" ", "_")
+
+    def add_stage(self, submission_id, stage):
+        '''
+        Journals a completed stage, so that a resumed download skips it
+        '''
+        if self.index != None:
+            self.index.add_stage(submission_id, stage)
+
+    def release_record(self):
+        '''
+        Drops one hold on the index record, the last one writes it
+        '''
+        with self.pending_lock:
+            self.pending -= 1
+            if self.pending > 0:
+                return
+        try:
+            if self.status == DownloadIndex.STATUS_COMPLETE and self.merge_failed:
+                self.status = DownloadIndex.STATUS_FAILED
+            if self.index != None:
+                self.index.finish(self.submission_id, self.status, self.submission_dir, self.results)
+        finally:
+            self.recorded.set()
+
+    def needs_retry(self):
+        '''
+        True if the submission was throttled or failed. This is final once
+        `wait` returns, an ffmpeg merge can still fail until then.
+        '''
+        return self.status in [DownloadIndex.STATUS_FAILED, DownloadIndex.STATUS_THROTTLED]
+
+    def wait(self):
+        '''
+        Blocks until the ffmpeg jobs queued for the submission are done and
+        `status` is final
+        '''
+        if self.status != None:
+            self.recorded.wait()
+
     def print_formatted_error(self, e):
+        if isinstance(e, Throttled):
+            self.throttled = e
         for line in str(e).split("\n"):
             self.logger.error(self.indent_2 + line)
 
-    def is_direct_link_to_content(self, url, supported_file_formats):
-        url_leaf = url.split("/")[-1]
-        return any([i in url_leaf for i in supported_file_formats]) and ".gifv" not in url_leaf
+    def print_download_error(self, e):
+        '''
+        Reports an error that left media of the submission undownloaded, so
+        that the submission is recorded as failed (or throttled) and tried
+        again by the next run
+        '''
+        if not isinstance(e, Throttled):
+            self.download_failed = True
+        self.print_formatted_error(e)
+
+    def fetch_all(self, jobs, show_progress=False, record=True, max_concurrency=None):
+        '''
+        Downloads every (url, save_path) pair in `jobs` as one batch through
+        the configured download engine and returns the list of results (a
+        DownloadResult, or the exception raised for that item)
+
+        Intermediate files that are removed later should pass `record=False`
+        so they are neither recorded nor put in the media store
+        '''
+        with tqdm(total=len(jobs), bar_format='%s%s{l_bar}{bar:20}{r_bar}%s' % (self.indent_2, Fore.WHITE + Fore.LIGHTBLACK_EX, Fore.RESET), disable=not (show_progress and self.show_progress)) as progress:
+            results = self.engine.fetch_many(jobs, on_done=lambda: progress.update(1),
+                max_concurrency=max_concurrency,
+                timeout=self.handler.timeout, retries=self.handler.retries)
+        if record:
+            for result in results:
+                if not isinstance(result, Exception):
+                    self.add_result(result)
+        return results
+
+    def download_file(self, url, save_path):
+        result = self.http.download(url, save_path,
+            timeout=self.handler.timeout, retries=self.handler.retries)
+        self.add_result(result)
+        return result
+
+    def http_get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.handler.timeout)
+        return self.http.get(url, **kwargs)
+
+    def add_file(self, path):
+        self.add_result(DownloadResult(path, os.path.getsize(path), DownloadIndex.hash_file(path)))
+
+    def add_result(self, result):
+        if self.media_store != None:
+            try:
+                self.media_store.store(result.path, result.sha256)
+            except Exception as e:
+                self.print_formatted_error(e)
+        self.results.append(result)
 
     def download_direct_link(self, submission, output_path):
-        try:
-            urllib.request.urlretrieve(submission.url, output_path)
-        except Exception as e:
-            self.print_formatted_error(e)
-
-    def is_youtube_link(self, url):
-        return "youtube.com" in url or "youtu.be" in url
+        result = self.fetch_all([(submission.url, output_path)])[0]
+        if isinstance(result, Exception):
+            self.print_download_error(result)
 
     def is_supported_by_youtubedl(self, url):
-        try:
-            # Since youtube-dl's quiet mode is amything BUT quiet
-            # using contextlib to redirect stdout to a local StringIO variable
-            local_stderr = StringIO()
-            with contextlib.redirect_stderr(local_stderr):
-                if "flickr.com/photos" in url:
-                    return False
-
-                # Try to extract info from URL
-                try:
-                    download_options = {
-                        'quiet': True,
-                        'warnings': True,
-                        'ignoreerrors': True,
-                    }
-                    ydl = youtube_dl.YoutubeDL(download_options)
-                    r = ydl.extract_info(url, download=False)
-                except Exception as e:
-                    # No media found through youtube-dl
-                    self.logger.spam(self.indent_2 + "No media found in '" + url + "' that could be downloaded with youtube-dl")
-                    return False
-
-                extractors = youtube_dl.extractor.gen_extractors()
-                for e in extractors:
-                    if e.suitable(url) and e.IE_NAME != 'generic':
-                        return True
-                        self.logger.spam(self.indent_2 + "This link could potentially be downloaded with youtube-dl")
-                self.logger.spam(self.indent_2 + "No media found in '" + url + "' that could be downloaded with youtube-dl")
-                return False
-        except Exception as e:
-            return False
+        if self.classifier.is_supported_by_youtubedl(url, self.index):
+            return True
+        self.logger.spam(self.indent_2 + "No media found in '" + url + "' that could be downloaded with youtube-dl")
+        return False
 
     def download_youtube_video(self, url, output_path):
         try:
-            local_stderr = StringIO()
-            with contextlib.redirect_stderr(local_stderr):
-                download_options = {
-                    'format': "299+bestaudio/298+bestaudio/137+bestaudio/136+bestaudio/best",
-                    'quiet': True,
-                    'warnings': True,
-                    'ignoreerrors': True,
-                    'nooverwrites': True,
-                    'continuedl': True,
-                    'outtmpl': output_path + '/%(id)s.%(ext)s'
-                }
-                self.logger.spam(self.indent_2 + "Downloading " +
-                                url + " with youtube-dl")
-                with youtube_dl.YoutubeDL(download_options) as ydl:
-                    ydl.download([url])
-                    errors = local_stderr.getvalue()
-                    if not len(errors):
-                        self.logger.spam(self.indent_2 + "Finished downloading video from " +
-                                    url)
-                    else:
-                        self.logger.error(self.indent_2 + errors.strip())
+            # youtube-dl reports to this download's own log rather than the
+            # process-wide stderr, which other workers' downloads share
+            log = YoutubeDlLog()
+            download_options = {
+                'format': "299+bestaudio/298+bestaudio/137+bestaudio/136+bestaudio/best",
+                'quiet': True,
+                'warnings': True,
+                'ignoreerrors': True,
+                'nooverwrites': True,
+                'continuedl': True,
+                'socket_timeout': self.handler.timeout,
+                'retries': self.handler.retries,
+                'logger': log,
+                'outtmpl': output_path + '/%(id)s.%(ext)s'
+            }
+            self.logger.spam(self.indent_2 + "Downloading " +
+                            url + " with youtube-dl")
+            with youtube_dl.YoutubeDL(download_options) as ydl:
+                ydl.download([url])
+            for warning in log.warnings:
+                self.logger.warning(self.indent_2 + warning.strip())
+            if not len(log.errors):
+                self.logger.spam(self.indent_2 + "Finished downloading video from " +
+                            url)
+            else:
+                self.download_failed = True
+                self.logger.error(self.indent_2 + "\n".join(log.errors).strip())
         except Exception as e:
             self.logger.error(self.indent_2 + "Failed to download with youtube-dl")
-            self.print_formatted_error(e)
-
-    def is_reddit_gallery(self, url):
-        return "reddit.com/gallery" in url
+            self.print_download_error(e)
 
     def download_reddit_gallery(self, submission, output_path, skip_videos):
         gallery_data = getattr(submission, "gallery_data", None)
@@ -292,7 +395,8 @@ class SubmissionDownloader:
             image_count = len(gallery_data["items"])
             self.logger.spam(self.indent_2 + "This reddit gallery has " +
                              str(image_count) + " images")
-            for j, item in tqdm(enumerate(gallery_data["items"]), total=image_count, bar_format='%s%s{l_bar}{bar:20}{r_bar}%s' % (self.indent_2, Fore.WHITE + Fore.LIGHTBLACK_EX, Fore.RESET)):
+            jobs = []
+            for j, item in enumerate(gallery_data["items"]):
                 try:
                     media_id = item["media_id"]
                     item_metadata = media_metadata[media_id]
@@ -310,15 +414,65 @@ class SubmissionDownloader:
                         item_filename = media_id + "." + item_format
                         item_url = item_metadata["s"]["u"]
                         save_path = os.path.join(output_path, item_filename)
-                        try:
-                            urllib.request.urlretrieve(item_url, save_path)
-                        except Exception as e:
-                            self.print_formatted_error(e)
+                        jobs.append((item_url, save_path))
                 except Exception as e:
                     self.print_formatted_error(e)
-
-    def is_reddit_video(self, url):
-        return "v.redd.it" in url
+            self.download_gallery_items(jobs, output_path)
+
+    def download_gallery_items(self, jobs, output_path):
+        '''
+        Fetches the items of a gallery concurrently (up to the gallery
+        handler's item_concurrency), retries the items that failed, and
+        resumes from the gallery's manifest, see GalleryManifest
+        '''
+        gallery_handler = get_handler("reddit_gallery")
+        manifest = GalleryManifest.load(output_path)
+        pending = []
+        for url, save_path in jobs:
+            completed = manifest.completed(save_path)
+            if completed != None:
+                self.results.append(DownloadResult(save_path, *completed))
+            else:
+                pending.append((url, save_path))
+        if len(pending) < len(jobs):
+            self.logger.spam(self.indent_2 + "Resuming gallery, " +
+                             str(len(jobs) - len(pending)) + " items were already downloaded")
+
+        # save_path => last error of the items that have not been downloaded
+        failures = {}
+        for attempt in range(gallery_handler.item_retries + 1):
+            if not pending:
+                break
+            if attempt > 0:
+                self.logger.spam(self.indent_2 + "Retrying " + str(len(pending)) + " failed gallery items")
+            results = self.fetch_all(pending, show_progress=True,
+                                     max_concurrency=gallery_handler.item_concurrency)
+            retry = []
+            for (url, save_path), result in zip(pending, results):
+                if isinstance(result, Exception):
+                    manifest.set_failed(url, save_path, result)
+                    failures[save_path] = result
+                    if SubmissionDownloader.is_retryable(result):
+                        retry.append((url, save_path))
+                else:
+                    manifest.set_complete(url, result)
+                    failures.pop(save_path, None)
+            manifest.save()
+            pending = retry
+
+        for error in failures.values():
+            self.print_download_error(error)
+
+    @staticmethod
+    def is_retryable(error):
+        # Missing items will stay missing, and throttled ones are retried
+        # later by the pipeline
+        if isinstance(error, Throttled):
+            return False
+        status = getattr(error, "status", None)  # aiohttp
+        if isinstance(error, requests.HTTPError) and error.response != None:
+            status = error.response.status_code
+        return status == None or status >= 500
 
     def download_reddit_video(self, submission, output_path):
         media = getattr(submission, "media", None)
@@ -337,56 +491,138 @@ class SubmissionDownloader:
                 media = first_parent["media"]
 
         if media != None:
-            self.logger.spam(self.indent_2 + "Downloading video component")
-            url = media["reddit_video"]["fallback_url"]
+            video_urls, audio_urls = self.get_reddit_video_streams(submission, media["reddit_video"])
+
+            # Fetch the video and audio components (and their segments) together
+            self.logger.spam(self.indent_2 + "Downloading video & audio components")
             video_save_path = os.path.join(
                 output_path, media_id + "_video.mp4")
-            try:
-                urllib.request.urlretrieve(url, video_save_path)
-            except Exception as e:
-                self.print_formatted_error(e)
-
-            # Download the audio
-            self.logger.spam(self.indent_2 + "Downloading audio component")
-            audio_downloaded = False
             audio_save_path = os.path.join(
                 output_path, media_id + "_audio.mp4")
-            try:
-                urllib.request.urlretrieve(
-                    submission.url + "/DASH_audio.mp4", audio_save_path)
-                audio_downloaded = True
-            except Exception as e:
-                pass
+            video_jobs = SubmissionDownloader.stream_jobs(video_urls, video_save_path)
+            audio_jobs = SubmissionDownloader.stream_jobs(audio_urls, audio_save_path)
+            results = self.fetch_all(video_jobs + audio_jobs,
+                show_progress=len(video_jobs) > 1, record=False)
+            video_results = results[:len(video_jobs)]
+            audio_results = results[len(video_jobs):]
+
+            errors = [r for r in video_results if isinstance(r, Exception)]
+            if errors:
+                self.print_download_error(errors[0])
+                SubmissionDownloader.remove_downloads(video_jobs + audio_jobs)
+                return
+            SubmissionDownloader.join_segments(video_results, video_save_path)
+            audio_downloaded = len(audio_results) > 0 and not any(
+                isinstance(r, Exception) for r in audio_results)
+            if audio_downloaded:
+                SubmissionDownloader.join_segments(audio_results, audio_save_path)
+            else:
+                SubmissionDownloader.remove_downloads(audio_jobs)
+            output_save_path = os.path.join(output_path, media_id + ".mp4")
 
             if audio_downloaded == True:
-                # Merge mp4 files
+                # Merge mp4 files in the background, see merge_video
                 self.logger.spam(
-                    self.indent_2 + "Merging video & audio components with ffmpeg")
-                output_save_path = os.path.join(output_path, media_id + ".mp4")
-                input_video = ffmpeg.input(video_save_path)
-                input_audio = ffmpeg.input(audio_save_path)
-                ffmpeg.concat(input_video, input_audio, v=1, a=1)\
-                    .output(output_save_path)\
-                    .global_args('-loglevel', 'error')\
-                      .global_args('-y')\
-                    .run()
-                self.logger.spam(self.indent_2 + "Done merging with ffmpeg")
-            else:
-                self.logger.spam(
-                    self.indent_2 + "This video does not have an audio component")
+                    self.indent_2 + "Queued video & audio components for merging with ffmpeg")
+                with self.pending_lock:
+                    self.pending += 1
+                self.merge_queued = True
+                get_ffmpeg_pool().submit(self.merge_video,
+                    video_save_path, audio_save_path, output_save_path, on_done=self.on_video_merged)
+                return
+            self.logger.spam(
+                self.indent_2 + "This video does not have an audio component")
+            os.replace(video_save_path, output_save_path)
+            self.add_file(output_save_path)
 
             self.logger.spam(
                     self.indent_2 + "Sucessfully saved video")
 
-    def is_gfycat_link(self, url):
-        return "gfycat.com/" in url
-
-    def is_redgifs_link(self, url):
-        return "redgifs.com/" in url
+    def get_reddit_video_streams(self, submission, reddit_video):
+        '''
+        Returns the URLs making up the video and the audio stream, picked
+        from the DASH manifest by quality policy (see DashManifest). Falls
+        back to `fallback_url` and a guessed audio URL without a manifest.
+        '''
+        dash_url = reddit_video.get("dash_url")
+        if dash_url:
+            try:
+                response = self.http_get(dash_url)
+                response.raise_for_status()
+                manifest = DashManifest.parse(response.content, response.url)
+                video = manifest.select("video")
+                if video != None:
+                    audio = manifest.select("audio")
+                    self.logger.spam(self.indent_2 + "Picked the " + str(video.height) + "p video stream from the DASH manifest")
+                    return video.urls, audio.urls if audio != None else []
+            except Exception as e:
+                self.logger.spam(self.indent_2 + "Unable to use the DASH manifest - " + str(e))
+        return [reddit_video["fallback_url"]], [submission.url + "/DASH_audio.mp4"]
+
+    @staticmethod
+    def stream_jobs(urls, save_path):
+        if len(urls) == 1:
+            return [(urls[0], save_path)]
+        return [(url, save_path + ".seg" + str(i).zfill(5)) for i, url in enumerate(urls)]
+
+    @staticmethod
+    def join_segments(results, save_path):
+        '''
+        Concatenates the downloaded segments of a stream into `save_path`
+        '''
+        if len(results) == 1 and results[0].path == save_path:
+            return
+        with open(save_path, 'wb') as output:
+            for result in results:
+                with open(result.path, 'rb') as segment:
+                    shutil.copyfileobj(segment, output)
+                os.remove(result.path)
+
+    @staticmethod
+    def remove_downloads(jobs):
+        '''
+        Removes the files, complete or partial, of (url, save_path) jobs
+        whose stream could not be put together, so that they are not
+        recorded as files of the submission
+        '''
+        for _, save_path in jobs:
+            for path in [save_path, save_path + PartialDownload.SUFFIX]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def merge_video(self, video_save_path, audio_save_path, output_save_path):
+        # Runs on the ffmpeg pool
+        try:
+            mode = VideoMerger.merge(video_save_path, audio_save_path, output_save_path)
+        except Exception:
+            # Neither the components nor a partial output may be recorded as
+            # files of the submission, a retry downloads them again
+            for path in [video_save_path, audio_save_path, output_save_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        os.remove(video_save_path)
+        os.remove(audio_save_path)
+        self.add_file(output_save_path)
+        return mode
+
+    def on_video_merged(self, future):
+        try:
+            mode = future.result()
+            self.logger.spam(self.indent_2 + "Done merging with ffmpeg (" + mode + ")")
+            self.add_stage(self.submission_id, DownloadIndex.STAGE_MEDIA)
+        except ffmpeg.Error as e:
+            self.merge_failed = True
+            self.print_formatted_error((e.stderr or b"").decode("utf-8", "replace") or e)
+        except Exception as e:
+            self.merge_failed = True
+            self.print_formatted_error(e)
+        finally:
+            self.release_record()
 
     def get_gfycat_embedded_video_url(self, url):
         try:
-            response  = requests.get(url)
+            response  = self.http_get(url)
             data = response.text
             soup = BeautifulSoup(data, features="html.parser")
 
@@ -417,16 +653,26 @@ class SubmissionDownloader:
         else:
             return ""
 
+    def probe(self, url):
+        return self.http.probe(url, timeout=self.handler.timeout)
+
     def guess_extension(self, url):
-        response = requests.get(url)
-        content_type = response.headers['content-type']
+        content_type = self.probe(url).content_type
         return mimetypes.guess_extension(content_type)
 
     def get_redirect_url(self, url):
-        r = requests.get(url)
-        return r.url
+        return self.probe(url).url
 
     def download_gfycat_or_redgif(self, submission, output_dir):
+        # The lookups below fall back on each other, it failed if none of
+        # them downloaded anything
+        downloaded = len(self.results)
+        self.find_gfycat_or_redgif(submission, output_dir)
+        if len(self.results) == downloaded and self.throttled == None:
+            self.download_failed = True
+            self.logger.error(self.indent_2 + "Found no media to download")
+
+    def find_gfycat_or_redgif(self, submission, output_dir):
         # Check if gfycat redirects to gifdeliverynetwork
         redirect_url = self.get_redirect_url(submission.url)
         if "gfycat.com" in submission.url and "gifdeliverynetwork.com" in redirect_url:
@@ -435,7 +681,7 @@ class SubmissionDownloader:
             try:
                 # Gfycat link that redirects to gifdeliverynetwork
                 # True source in this case is hiding in redgifs.com
-                response = requests.get(redirect_url)
+                response = self.http_get(redirect_url)
                 html = BeautifulSoup(response.content, features="html.parser")
                 links = html.find_all()
                 for i in links:
@@ -449,9 +695,7 @@ class SubmissionDownloader:
                                 filename = src.split("/")[-1]
                                 save_path = os.path.join(output_dir, filename)
                                 try:
-                                    r = requests.get(src)
-                                    with open(save_path, 'wb') as outfile:
-                                        outfile.write(r.content)
+                                    self.download_file(src, save_path)
                                 except Exception as e:
                                     self.print_formatted_error(e)
             except Exception as e:
@@ -475,7 +719,7 @@ class SubmissionDownloader:
                             filename = submission.url.split("/")[-1] + ".mp4"
                         save_path = os.path.join(output_dir, filename)
                         try:
-                            urllib.request.urlretrieve(fallback_url, save_path)
+                            self.download_file(fallback_url, save_path)
                             return
                         except Exception as e:
                             self.print_formatted_error(e)
@@ -488,7 +732,7 @@ class SubmissionDownloader:
                             filename = submission.url.split("/")[-1] + extension
                             save_path = os.path.join(output_dir, filename)
                             try:
-                                urllib.request.urlretrieve(source_url, save_path)
+                                self.download_file(source_url, save_path)
                             except Exception as e:
                                 self.print_formatted_error(e)
                         except Exception as e:
@@ -518,32 +762,14 @@ class SubmissionDownloader:
                             self.logger.spam(
                                 self.indent_2 + "Embedded video URL: " + video_url)
                             try:
-                                r = requests.get(video_url)
-                                with open(save_path, 'wb') as outfile:
-                                    outfile.write(r.content)
+                                self.download_file(video_url, save_path)
                             except Exception as e:
                                 self.print_formatted_error(e)
         except Exception as e:
             self.print_formatted_error(e)
 
-    def is_imgur_album(self, url):
-        return "imgur.com/a/" in url or "imgur.com/gallery/" in url
-
-    def get_imgur_album_images_count(self, album_id):
-        request = "https://api.imgur.com/3/album/" + album_id
-        res = requests.get(request, headers={
-                           "Authorization": "Client-ID " + self.IMGUR_CLIENT_ID})
-        if res.status_code == 200:
-            return res.json()["data"]["images_count"]
-        else:
-            self.logger.spam(self.indent_2 + "This imgur album is empty")
-            return 0
-
     def get_imgur_image_meta(self, image_id):
-        request = "https://api.imgur.com/3/image/" + image_id
-        res = requests.get(request, headers={
-                           "Authorization": "Client-ID " + self.IMGUR_CLIENT_ID})
-        return res.json()["data"]
+        return self.imgur.image(image_id, timeout=self.handler.timeout)
 
     def download_imgur_album(self, submission, output_dir):
         # Imgur album
@@ -555,26 +781,26 @@ class SubmissionDownloader:
 
         self.logger.spam(self.indent_2 + "Album ID " + album_id)
 
-        images_count = self.get_imgur_album_images_count(album_id)
-        if images_count > 0:
-            request = "https://api.imgur.com/3/album/" + album_id
-            res = requests.get(request, headers={
-                               "Authorization": "Client-ID " + self.IMGUR_CLIENT_ID})
-            self.logger.spam(self.indent_2 + "This imgur album has " +
-                             str(images_count) + " images")
-            for i, image in tqdm(enumerate(res.json()["data"]["images"]), total=images_count, bar_format='%s%s{l_bar}{bar:20}{r_bar}%s' % (self.indent_2, Fore.WHITE + Fore.LIGHTBLACK_EX, Fore.RESET)):
-                url = image["link"]
-                filename = str(i).zfill(3) + "_" + url.split("/")[-1]
-                save_path = os.path.join(output_dir, filename)
-                try:
-                    if not os.path.exists(output_dir):
-                        os.makedirs(output_dir)
-                    urllib.request.urlretrieve(url, save_path)
-                except Exception as e:
-                    self.print_formatted_error(e)
-
-    def is_imgur_image(self, url):
-        return "imgur.com" in url
+        # One (cached) API request resolves the album and all its images
+        album = self.imgur.album(album_id, timeout=self.handler.timeout)
+        images = (album or {}).get("images") or []
+        if not images:
+            self.logger.spam(self.indent_2 + "This imgur album is empty")
+            return
+
+        self.logger.spam(self.indent_2 + "This imgur album has " +
+                         str(len(images)) + " images")
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        jobs = []
+        for i, image in enumerate(images):
+            url = image["link"]
+            filename = str(i).zfill(3) + "_" + url.split("/")[-1]
+            jobs.append((url, os.path.join(output_dir, filename)))
+
+        for result in self.fetch_all(jobs, show_progress=True):
+            if isinstance(result, Exception):
+                self.print_download_error(result)
 
     def download_imgur_image(self, submission, output_dir):
         # Other imgur content, e.g., .gifv, '.mp4', '.jpg', etc.
@@ -586,6 +812,9 @@ class SubmissionDownloader:
 
         try:
             data = self.get_imgur_image_meta(image_id)
+            if data == None:
+                self.logger.spam(self.indent_2 + "This imgur image could not be found")
+                return
             url = data["link"]
             image_type = data["type"]
             if "video/" in image_type:
@@ -600,22 +829,24 @@ class SubmissionDownloader:
             filename = image_id + "." + image_type
             save_path = os.path.join(output_dir, filename)
 
-            urllib.request.urlretrieve(url, save_path)
+            self.download_file(url, save_path)
         except Exception as e:
-            self.print_formatted_error(e)
+            self.print_download_error(e)
 
     def download_comments(self, submission, output_dir, comment_limit):
-        # Save comments - Breath first unwrap of comment forest
-        comments_list = []
-        with open(os.path.join(output_dir, 'comments.json'), 'w') as file:
-            submission.comments.replace_more(limit=comment_limit)
-            limited_comments = submission.comments.list()
-            if not len(limited_comments):
+        # Save comments - Breath first unwrap of comment forest, each
+        # comment is handed to the writer as soon as it is visited
+        with CommentWriter(output_dir, self.archive) as writer:
+            expander = CommentExpander(submission)
+            expander.expand(limit=comment_limit)
+            comments = expander.comments()
+            first = next(comments, None)
+            if first == None:
                 # No comments
                 self.logger.spam(self.indent_2 + "No comments found")
                 return
 
-            for comment in tqdm(limited_comments, total=len(limited_comments), bar_format='%s%s{l_bar}{bar:20}{r_bar}%s' % (self.indent_2, Fore.WHITE + Fore.LIGHTBLACK_EX, Fore.RESET)):
+            for comment in tqdm(itertools.chain([first], comments), bar_format='%s%s{l_bar}{bar:20}{r_bar}%s' % (self.indent_2, Fore.WHITE + Fore.LIGHTBLACK_EX, Fore.RESET), disable=not self.show_progress):
                 comment_dict = {}
                 try:
                     if comment.author:
@@ -640,8 +871,7 @@ class SubmissionDownloader:
                     comment_dict["ups"] = comment.ups
                 except Exception as e:
                     self.print_formatted_error(e)
-                comments_list.append(comment_dict)
-            file.write(json.dumps(comments_list, indent=2))
+                writer.write(comment_dict)
 
     def is_self_post(self, submission):
         return submission.is_self
@@ -678,5 +908,8 @@ class SubmissionDownloader:
         submission_dict["upvote_ratio"] = submission.upvote_ratio
         submission_dict["url"] = submission.url
 
+        if self.archive != None:
+            self.archive.add_submission(submission_dict)
+            return
         with open(os.path.join(submission_dir, "submission.json"), 'w') as file:
             file.write(json.dumps(submission_dict, indent=2))
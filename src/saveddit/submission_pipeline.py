@@ -0,0 +1,158 @@
+import queue
+import threading
+import time
+
+
+class BufferedLogger:
+    '''
+    Collects the log records emitted while a single submission is processed
+    and flushes them to the shared logger in one go, so that the output of
+    concurrent workers does not interleave line by line
+
+    Records emitted after the flush (e.g., by ffmpeg pool callbacks) are
+    passed straight through to the shared logger.
+    '''
+    LEVELS = ["spam", "debug", "verbose", "info", "notice",
+              "warning", "success", "error", "critical"]
+
+    def __init__(self, logger, lock):
+        self.logger = logger
+        self.lock = lock
+        self.records = []
+        self.flushed = False
+
+    def __getattr__(self, name):
+        if name in BufferedLogger.LEVELS:
+            def record(msg, *args, **kwargs):
+                with self.lock:
+                    if self.flushed:
+                        getattr(self.logger, name)(msg, *args, **kwargs)
+                    else:
+                        self.records.append((name, msg, args, kwargs))
+            return record
+        return getattr(self.logger, name)
+
+    def flush(self):
+        with self.lock:
+            for level, msg, args, kwargs in self.records:
+                getattr(self.logger, level)(msg, *args, **kwargs)
+            self.records = []
+            self.flushed = True
+
+
+class SubmissionPipeline:
+    '''
+    Bounded producer/consumer pipeline for submissions
+
+    The caller's thread walks the listing (and therefore drives PRAW's
+    pagination) and puts `(index, submission)` pairs on a bounded queue.
+    `workers` threads take items off the queue and run `process` on them.
+    With a single worker everything runs inline on the caller's thread,
+    exactly like the old sequential loop.
+
+    Submissions whose downloader reports being `throttled` by a host (see
+    rate_limiter) are put on a retry queue and processed again once the
+    listing is done and the host's Retry-After (or DEFAULT_RETRY_DELAY) has
+    passed, up to DEFAULT_MAX_RETRIES times.
+    '''
+    _SENTINEL = None
+
+    DEFAULT_MAX_RETRIES = 3
+    DEFAULT_RETRY_DELAY = 30  # seconds
+
+    def __init__(self, logger, workers=1, queue_size=None, max_retries=DEFAULT_MAX_RETRIES):
+        self.logger = logger
+        self.workers = max(1, workers)
+        if queue_size == None:
+            queue_size = self.workers * 2
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.log_lock = threading.Lock()
+        self.retry_lock = threading.Lock()
+        self.retries = []
+
+    def run(self, items, process):
+        '''
+        items: iterable of (index, submission) pairs, e.g., enumerate(listing)
+        process: callable taking (index, submission, logger). It may return
+                 an object with a `throttled` attribute (the Throttled error
+                 that stopped it, or None) to have the item retried later.
+
+        Returns the number of items handed to `process`
+        '''
+        count = self._run_items(items, process)
+        for attempt in range(self.max_retries):
+            with self.retry_lock:
+                retries, self.retries = self.retries, []
+            if not retries:
+                break
+            retries.sort(key=lambda retry: retry[0])
+            self.logger.notice("Retrying " + str(len(retries)) + " throttled post(s)")
+            self._run_items(SubmissionPipeline._when_due(retries), process)
+        with self.retry_lock:
+            for _, i, submission in self.retries:
+                self.logger.error("Giving up on post #" + str(i) + " - still throttled")
+            self.retries = []
+        return count
+
+    @staticmethod
+    def _when_due(retries):
+        for due, i, submission in retries:
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            yield i, submission
+
+    def _run_items(self, items, process):
+        if self.workers == 1:
+            count = 0
+            for i, submission in items:
+                self._process_one(process, i, submission, self.logger)
+                count += 1
+            return count
+
+        work_queue = queue.Queue(maxsize=self.queue_size)
+        threads = []
+        for _ in range(self.workers):
+            t = threading.Thread(target=self._worker,
+                                 args=(work_queue, process), daemon=True)
+            t.start()
+            threads.append(t)
+
+        count = 0
+        try:
+            for i, submission in items:
+                work_queue.put((i, submission))
+                count += 1
+        finally:
+            for _ in threads:
+                work_queue.put(SubmissionPipeline._SENTINEL)
+            for t in threads:
+                t.join()
+        return count
+
+    def _worker(self, work_queue, process):
+        while True:
+            item = work_queue.get()
+            if item is SubmissionPipeline._SENTINEL:
+                break
+            i, submission = item
+            logger = BufferedLogger(self.logger, self.log_lock)
+            try:
+                self._process_one(process, i, submission, logger)
+            finally:
+                logger.flush()
+
+    def _process_one(self, process, i, submission, logger):
+        try:
+            result = process(i, submission, logger)
+        except Exception as e:
+            logger.error("Unable to download post #" + str(i) + " - " + str(e))
+            return
+        throttled = getattr(result, "throttled", None)
+        if throttled != None:
+            delay = throttled.retry_after
+            if delay == None:
+                delay = SubmissionPipeline.DEFAULT_RETRY_DELAY
+            with self.retry_lock:
+                self.retries.append((time.monotonic() + delay, i, submission))
@@ -4,9 +4,23 @@ import logging
 import verboselogs
 import os
 import praw
+from saveddit.async_downloader import configure_download_engine
+from saveddit.comment_writer import configure_comment_writer
 from saveddit.configuration import ConfigurationLoader
+from saveddit.dash_manifest import configure_video_quality
+from saveddit.ffmpeg_pool import configure_ffmpeg_pool
+from saveddit.http_client import configure_http_client
+from saveddit.imgur_api import configure_imgur_api
+from saveddit.media_store import configure_media_store, get_media_store
+from saveddit.metadata_archive import configure_metadata_archive, get_metadata_archive
+from saveddit.download_index import DownloadIndex
+from saveddit.incremental_listing import IncrementalListing
+from saveddit.journaled_listing import JournaledListing
+from saveddit.listing_planner import ListingPlanner
 from saveddit.submission_downloader import SubmissionDownloader
+from saveddit.submission_pipeline import SubmissionPipeline
 from saveddit.subreddit_downloader_config import SubredditDownloaderConfig
+from saveddit.video_merger import configure_video_merger
 
 class SubredditDownloader:
     app_config_dir = os.path.expanduser("~/.saveddit")
@@ -20,6 +34,17 @@ class SubredditDownloader:
     REDDIT_CLIENT_SECRET = config['reddit_client_secret']
     IMGUR_CLIENT_ID = config['imgur_client_id']
 
+    # One pooled HTTP client is shared by every downloader in this process
+    configure_http_client(config)
+    configure_download_engine(config)
+    configure_media_store(config)
+    configure_imgur_api(config)
+    configure_video_merger(config)
+    configure_ffmpeg_pool(config)
+    configure_video_quality(config)
+    configure_comment_writer(config)
+    configure_metadata_archive(config)
+
     def __init__(self, subreddit_name):
         self.subreddit_name = subreddit_name
         reddit = praw.Reddit(
@@ -44,12 +69,19 @@ class SubredditDownloader:
         coloredlogs.install(level='SPAM', logger=self.logger,
                             fmt='%(message)s', level_styles=level_styles)
 
-    def download(self, output_path, download_all_comments, categories=SubredditDownloaderConfig.DEFAULT_CATEGORIES, post_limit=SubredditDownloaderConfig.DEFAULT_POST_LIMIT, skip_videos=False, skip_meta=False, skip_comments=False):
+    def download(self, output_path, download_all_comments, categories=SubredditDownloaderConfig.DEFAULT_CATEGORIES, post_limit=SubredditDownloaderConfig.DEFAULT_POST_LIMIT, skip_videos=False, skip_meta=False, skip_comments=False, workers=SubredditDownloaderConfig.DEFAULT_WORKERS, incremental=False):
         '''
         categories: List of categories within the subreddit to download (see SubredditDownloaderConfig.DEFAULT_CATEGORIES)
         post_limit: Number of posts to download (default: None, i.e., all posts)
         comment_limit: Number of comment levels to download from submission (default: `0`, i.e., only top-level comments)
           - to get all comments, set comment_limit to `None`
+        workers: Number of submissions processed concurrently (default: 1, i.e., sequential)
+        incremental: Stop paginating the `new` listing at the newest submission seen by the previous run
+
+        All the category listings are fetched first and a submission listed in
+        several categories is downloaded once, see ListingPlanner. Progress is
+        journaled in the index, so an interrupted run resumes where it stopped,
+        see JournaledListing.
         '''
         root_dir = os.path.join(os.path.join(os.path.join(
             output_path, "www.reddit.com"), "r"), self.subreddit_name)
@@ -60,15 +92,73 @@ class SubredditDownloader:
         elif download_all_comments == True:
             comment_limit = None
 
+        index = DownloadIndex.open(output_path)
+        submission_config = {
+            'imgur_client_id': SubredditDownloader.IMGUR_CLIENT_ID,
+            'show_progress': workers == 1,
+            'index': index,
+            'media_store': get_media_store(output_path),
+            'metadata_archive': get_metadata_archive(output_path),
+        }
+
+        listings = []
+        journals = {}
         for c in categories:
-            self.logger.notice("Downloading from /r/" +
-                               self.subreddit_name + "/" + c + "/")
             category_dir = os.path.join(root_dir, c)
             if not os.path.exists(category_dir):
                 os.makedirs(category_dir)
-            category_function = getattr(self.subreddit, c)
 
-            for i, submission in enumerate(category_function(limit=post_limit)):
-                SubmissionDownloader(submission, i, self.logger, category_dir,
-                    skip_videos, skip_meta, skip_comments, comment_limit,
-                    {'imgur_client_id': SubredditDownloader.IMGUR_CLIENT_ID})
+            def listing_function(limit, c=c, **kwargs):
+                listing = getattr(self.subreddit, c)(limit=limit, **kwargs)
+                if incremental and c == "new":
+                    listing = IncrementalListing(index,
+                        "r/" + self.subreddit_name.lower() + "/new", listing)
+                return listing
+
+            journals[c] = JournaledListing(index, "r/" + self.subreddit_name.lower() + "/" + c,
+                listing_function, post_limit, self.subreddit._reddit)
+            listings.append((c, category_dir, journals[c]))
+
+        self.logger.notice("Fetching listings of /r/" + self.subreddit_name + "/")
+        planner = ListingPlanner(index)
+        plan = planner.plan(listings)
+        for c, _, i, submission in planner.links:
+            journals[c].done(i, submission)
+
+        # Downloaders whose ffmpeg merge was still running when their post
+        # was journaled
+        merging = []
+        for c, category_dir, items in plan:
+            self.logger.notice("Downloading from /r/" +
+                               self.subreddit_name + "/" + c + "/")
+            journal = journals[c]
+
+            def process(i, submission, logger):
+                try:
+                    downloader = SubmissionDownloader(submission, i, logger, category_dir,
+                        skip_videos, skip_meta, skip_comments, comment_limit,
+                        submission_config)
+                except Exception:
+                    journal.done(i, submission, retry=True)
+                    raise
+                journal.done(i, submission, retry=downloader.needs_retry())
+                if downloader.merge_queued:
+                    merging.append((journal, i, submission, downloader))
+                return downloader
+
+            pipeline = SubmissionPipeline(self.logger, workers)
+            pipeline.run(items, process)
+
+        linked = planner.link()
+        if linked:
+            self.logger.verbose("Linked " + str(linked) + " post(s) listed in more than one category")
+
+        for journal, i, submission, downloader in merging:
+            downloader.wait()
+            if downloader.needs_retry():
+                journal.done(i, submission, retry=True)
+
+        for journal in journals.values():
+            if isinstance(journal.listing, IncrementalListing):
+                journal.listing.commit()
+            journal.clear()
@@ -1,4 +1,6 @@
 class SubredditDownloaderConfig:
     DEFAULT_CATEGORIES = ["hot", "new", "random_rising", "rising",
                           "controversial", "top", "gilded"]
-    DEFAULT_POST_LIMIT = None
\ No newline at end of file
+    DEFAULT_POST_LIMIT = None
+    DEFAULT_WORKERS = 1
+    DEFAULT_JOBS = 1
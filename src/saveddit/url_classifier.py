@@ -0,0 +1,192 @@
+from collections import OrderedDict
+import re
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+from saveddit.media_handlers import registered_handlers
+import youtube_dl
+from youtube_dl.compat import compat_HTTPError, compat_urllib_error
+
+
+class UrlClassifier:
+    '''
+    Picks the media handler for the link of a submission, using precompiled
+    regexes and a host -> handler dispatch table
+
+    The dispatch table is built once per process from the handler registry
+    (see media_handlers). The youtube-dl extractor classes are also collected
+    once and their `_VALID_URL` regexes are consulted first. Many of them
+    match pages that may have no video at all (reddit posts, tweets, news
+    articles), so unless the link is on one of the YOUTUBE_DL_HOSTS, a
+    regex match is confirmed by letting youtube-dl extract the info of the
+    link without downloading it. Those verdicts are the most expensive ones
+    to compute, so they are cached per URL for `verdict_ttl` seconds, in
+    memory (for the MEMORY_CACHE_SIZE most recently used URLs) and in the
+    local download index.
+    '''
+    YOUTUBE_DL = "youtube_dl"
+    UNSUPPORTED = "unsupported"
+
+    DEFAULT_VERDICT_TTL = 7 * 24 * 60 * 60  # seconds
+    MEMORY_CACHE_SIZE = 4096                # verdicts remembered per process
+    CONFIRM_TIMEOUT = 30                    # seconds
+
+    # Video hosts whose links youtube-dl claims are trusted without a request
+    YOUTUBE_DL_HOSTS = [
+        "youtube.com", "youtu.be", "vimeo.com", "dailymotion.com", "twitch.tv",
+        "streamable.com", "soundcloud.com", "bandcamp.com", "tiktok.com",
+    ]
+
+    # Links youtube-dl claims but should not be handed to it
+    YOUTUBE_DL_EXCLUDED = [re.compile(r'flickr\.com/photos')]
+
+    def __init__(self, verdict_ttl=DEFAULT_VERDICT_TTL):
+        self.verdict_ttl = verdict_ttl
+        self.lock = threading.Lock()
+        self.extractors = None
+        # url => (verdict, checked_at), least recently used first
+        self.verdicts = OrderedDict()
+        self.any_host_handlers = []
+        self.handlers_by_host = {}
+        for handler in registered_handlers():
+            if handler.hosts == None:
+                self.any_host_handlers.append(handler)
+            else:
+                for host in handler.hosts:
+                    self.handlers_by_host.setdefault(host, []).append(handler)
+
+    def classify(self, url):
+        '''
+        Returns the handler for `url`, or None when no dedicated handler
+        applies (see `is_supported_by_youtubedl` for the fallback)
+        '''
+        parsed_url = urlparse(url)
+        for handler in self.any_host_handlers:
+            if handler.matches(url, parsed_url):
+                return handler
+        for domain in UrlClassifier.domains(parsed_url.hostname or ""):
+            for handler in self.handlers_by_host.get(domain, []):
+                if handler.matches(url, parsed_url):
+                    return handler
+        return None
+
+    @staticmethod
+    def domains(hostname):
+        '''
+        i.imgur.com -> i.imgur.com, imgur.com
+        '''
+        parts = hostname.lower().split(".")
+        return [".".join(parts[i:]) for i in range(len(parts) - 1)]
+
+    def get_extractors(self):
+        with self.lock:
+            if self.extractors == None:
+                self.extractors = [e for e in youtube_dl.extractor.gen_extractor_classes()
+                                   if e.ie_key() != "Generic"]
+            return self.extractors
+
+    def is_supported_by_youtubedl(self, url, index=None):
+        '''
+        True if a (non-generic) youtube-dl extractor claims `url` and, unless
+        it is on one of the YOUTUBE_DL_HOSTS, finds media in it
+        '''
+        verdict = self.remembered(url)
+        if verdict == None and index != None:
+            cached = index.get_url_verdict(url, self.verdict_ttl)
+            if cached != None:
+                verdict, checked_at = cached
+                self.remember(url, verdict, checked_at)
+        if verdict != None:
+            return verdict == UrlClassifier.YOUTUBE_DL
+
+        verdict = UrlClassifier.UNSUPPORTED
+        if not any(regex.search(url) for regex in UrlClassifier.YOUTUBE_DL_EXCLUDED):
+            for extractor in self.get_extractors():
+                if extractor.suitable(url):
+                    verdict = UrlClassifier.YOUTUBE_DL
+                    break
+        hostname = urlparse(url).hostname or ""
+        if verdict == UrlClassifier.YOUTUBE_DL and not any(
+                domain in UrlClassifier.YOUTUBE_DL_HOSTS for domain in UrlClassifier.domains(hostname)):
+            verdict = UrlClassifier.confirm_with_youtubedl(url)
+            if verdict == None:
+                # Unable to tell for now, youtube-dl gets to try the download
+                # and the link is checked again next time
+                return True
+        self.remember(url, verdict, time.time())
+        if index != None:
+            index.set_url_verdict(url, verdict)
+        return verdict == UrlClassifier.YOUTUBE_DL
+
+    @staticmethod
+    def confirm_with_youtubedl(url):
+        '''
+        Lets youtube-dl extract the info of `url` without downloading it and
+        returns YOUTUBE_DL if it found media, UNSUPPORTED if it did not, or
+        None if the extraction failed for a transient reason (a network
+        error, a 429 or 5xx response)
+        '''
+        options = {
+            "quiet": True,
+            "no_warnings": True,
+            "skip_download": True,
+            "socket_timeout": UrlClassifier.CONFIRM_TIMEOUT,
+            "logger": _SilentLog(),
+        }
+        try:
+            with youtube_dl.YoutubeDL(options) as ydl:
+                ydl.extract_info(url, download=False)
+            return UrlClassifier.YOUTUBE_DL
+        except youtube_dl.utils.DownloadError as e:
+            error = e.exc_info[1] if e.exc_info else None
+            cause = getattr(error, "cause", None)
+            if isinstance(cause, compat_HTTPError):
+                transient = cause.code == 429 or cause.code >= 500
+            else:
+                transient = isinstance(cause, (compat_urllib_error.URLError, socket.timeout))
+            return None if transient else UrlClassifier.UNSUPPORTED
+        except Exception:
+            return None
+
+    def remembered(self, url):
+        '''
+        Returns the verdict kept in memory for `url`, if it is younger than
+        `verdict_ttl`
+        '''
+        with self.lock:
+            entry = self.verdicts.get(url)
+            if entry == None:
+                return None
+            verdict, checked_at = entry
+            if checked_at < time.time() - self.verdict_ttl:
+                del self.verdicts[url]
+                return None
+            self.verdicts.move_to_end(url)
+            return verdict
+
+    def remember(self, url, verdict, checked_at):
+        with self.lock:
+            self.verdicts[url] = (verdict, checked_at)
+            self.verdicts.move_to_end(url)
+            while len(self.verdicts) > UrlClassifier.MEMORY_CACHE_SIZE:
+                self.verdicts.popitem(last=False)
+
+
+class _SilentLog:
+    # youtube-dl reports the outcome of a confirmation through its exceptions
+    def debug(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+
+_url_classifier = UrlClassifier()
+
+
+def get_url_classifier():
+    return _url_classifier
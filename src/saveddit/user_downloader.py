@@ -9,6 +9,12 @@ import os
 import praw
 from pprint import pprint
 import re
+from saveddit.comment_writer import CommentWriter
+from saveddit.download_index import DownloadIndex
+from saveddit.incremental_listing import IncrementalListing
+from saveddit.journaled_listing import JournaledListing
+from saveddit.media_store import get_media_store
+from saveddit.metadata_archive import get_metadata_archive
 from saveddit.submission_downloader import SubmissionDownloader
 from saveddit.subreddit_downloader import SubredditDownloader
 import sys
@@ -88,25 +94,29 @@ class UserDownloader:
             if not os.path.exists(root_dir):
                 os.makedirs(root_dir)
 
-            with open(os.path.join(root_dir, 'user.json'), 'w') as file:
-                user_dict = {}
-                user_dict["comment_karma"] = user.comment_karma
-                user_dict["created_utc"] = int(user.created_utc)
-                user_dict["has_verified_email"] = user.has_verified_email
-                user_dict["icon_img"] = user.icon_img
-                user_dict["id"] = user.id
-                user_dict["is_employee"] = user.is_employee
-                user_dict["is_friend"] = user.is_friend
-                user_dict["is_mod"] = user.is_mod
-                user_dict["is_gold"] = user.is_gold
-                try:
-                    user_dict["is_suspended"] = user.is_suspended
-                except Exception as e:
-                    user_dict["is_suspended"] = None
-                user_dict["link_karma"] = user.link_karma
-                user_dict["name"] = user.name
-
-                file.write(json.dumps(user_dict, indent=2))
+            user_dict = {}
+            user_dict["comment_karma"] = user.comment_karma
+            user_dict["created_utc"] = int(user.created_utc)
+            user_dict["has_verified_email"] = user.has_verified_email
+            user_dict["icon_img"] = user.icon_img
+            user_dict["id"] = user.id
+            user_dict["is_employee"] = user.is_employee
+            user_dict["is_friend"] = user.is_friend
+            user_dict["is_mod"] = user.is_mod
+            user_dict["is_gold"] = user.is_gold
+            try:
+                user_dict["is_suspended"] = user.is_suspended
+            except Exception as e:
+                user_dict["is_suspended"] = None
+            user_dict["link_karma"] = user.link_karma
+            user_dict["name"] = user.name
+
+            archive = get_metadata_archive(output_path)
+            if archive != None:
+                archive.add_user(user_dict)
+            else:
+                with open(os.path.join(root_dir, 'user.json'), 'w') as file:
+                    file.write(json.dumps(user_dict, indent=2))
 
     def download_comments(self, args):
         output_path = args.o
@@ -132,6 +142,8 @@ class UserDownloader:
 
                 category_dir = os.path.join(comments_dir, sort)
 
+                archive = get_metadata_archive(output_path)
+                archived = []
                 if category_function:
                     if not os.path.exists(category_dir):
                         os.makedirs(category_dir)
@@ -147,32 +159,24 @@ class UserDownloader:
                             comment_body + "..." + ".json"
                         self.logger.spam(self.indent_1 + comment.id + ' - "' + comment.body[0:64].replace("\n", "").replace("\r", "")  + '..."')
 
-                        with open(os.path.join(category_dir, comment_filename), 'w') as file:
-                            comment_dict = {}
-                            try:
-                                if comment.author:
-                                    comment_dict["author"] = comment.author.name
-                                else:
-                                    comment_dict["author"] = None
-                                comment_dict["body"] = comment.body
-                                comment_dict["created_utc"] = int(comment.created_utc)
-                                comment_dict["distinguished"] = comment.distinguished
-                                comment_dict["downs"] = comment.downs
-                                comment_dict["edited"] = comment.edited
-                                comment_dict["id"] = comment.id
-                                comment_dict["is_submitter"] = comment.is_submitter
-                                comment_dict["link_id"] = comment.link_id
-                                comment_dict["parent_id"] = comment.parent_id
-                                comment_dict["permalink"] = comment.permalink
-                                comment_dict["score"] = comment.score
-                                comment_dict["stickied"] = comment.stickied
-                                comment_dict["subreddit_name_prefixed"] = comment.subreddit_name_prefixed
-                                comment_dict["subreddit_id"] = comment.subreddit_id
-                                comment_dict["total_awards_received"] = comment.total_awards_received
-                                comment_dict["ups"] = comment.ups
+                        comment_dict = {}
+                        try:
+                            comment_dict = UserDownloader.comment_to_dict(comment)
+                        except Exception as e:
+                            self.print_formatted_error(e)
+                            continue
+
+                        if archive != None:
+                            # Archived in batches, one transaction each
+                            archived.append(comment_dict)
+                            if len(archived) >= CommentWriter.BATCH_SIZE:
+                                archive.add_comments(archived)
+                                archived = []
+                        else:
+                            with open(os.path.join(category_dir, comment_filename), 'w') as file:
                                 file.write(json.dumps(comment_dict, indent=2))
-                            except Exception as e:
-                                self.print_formatted_error(e)
+                    if archived:
+                        archive.add_comments(archived)
             except Exception as e:
                 self.logger.error("Unable to download comments for user `" + username + "` - " + str(e))
 
@@ -222,7 +226,7 @@ class UserDownloader:
                                         self.indent_1 = ' ' * len(prefix_str) + "* "
                                         self.indent_2 = ' ' * len(self.indent_1) + "- "
                                         SubmissionDownloader(s, i, self.logger, category_dir, skip_videos, skip_meta, skip_comments, comment_limit,
-                                                                {'imgur_client_id': UserDownloader.IMGUR_CLIENT_ID})
+                                                                self.submission_config(output_path))
                                     except Exception as e:
                                         self.logger.error(self.indent_2 + "Unable to download post #" + str(i) + " for user `" + username + "` from multireddit " + name + " - " + str(e))
             except Exception as e:
@@ -257,15 +261,41 @@ class UserDownloader:
                 category_dir = os.path.join(submitted_dir, sort)
 
                 if category_function:
-                    for i, s in enumerate(category_function(limit=post_limit)):
+                    def listing_function(limit, **kwargs):
+                        listing = category_function(limit=limit, **kwargs)
+                        if args.incremental and sort == "new":
+                            listing = IncrementalListing(DownloadIndex.open(output_path),
+                                "u/" + username.lower() + "/submitted/new", listing)
+                        return listing
+
+                    journal = JournaledListing(DownloadIndex.open(output_path),
+                        "u/" + username.lower() + "/submitted/" + sort, listing_function, post_limit, self.reddit)
+
+                    merging = []
+                    for i, s in journal:
+                        retry = True
                         try:
                             prefix_str = '#' + str(i).zfill(3) + ' '
                             self.indent_1 = ' ' * len(prefix_str) + "* "
                             self.indent_2 = ' ' * len(self.indent_1) + "- "
-                            SubmissionDownloader(s, i, self.logger, category_dir, skip_videos, skip_meta, skip_comments, comment_limit,
-                                                    {'imgur_client_id': UserDownloader.IMGUR_CLIENT_ID})
+                            downloader = SubmissionDownloader(s, i, self.logger, category_dir, skip_videos, skip_meta, skip_comments, comment_limit,
+                                                    self.submission_config(output_path))
+                            retry = downloader.needs_retry()
+                            if downloader.merge_queued:
+                                merging.append((i, s, downloader))
                         except Exception as e:
                             self.logger.error(self.indent_2 + "Unable to download post #" + str(i) + " for user `" + username + "` - " + str(e))
+                        journal.done(i, s, retry)
+
+                    # A post whose ffmpeg merge failed is tried again as well
+                    for i, s, downloader in merging:
+                        downloader.wait()
+                        if downloader.needs_retry():
+                            journal.done(i, s, retry=True)
+
+                    if isinstance(journal.listing, IncrementalListing):
+                        journal.listing.commit()
+                    journal.clear()
             except Exception as e:
                 self.logger.error(self.indent_1 + "Unable to download submitted posts for user `" + username + "` - " + str(e))
 
@@ -291,15 +321,41 @@ class UserDownloader:
                 if not os.path.exists(upvoted_dir):
                     os.makedirs(upvoted_dir)
 
-                for i, s in enumerate(user.upvoted(limit=post_limit)):
+                def listing_function(limit, **kwargs):
+                    listing = user.upvoted(limit=limit, **kwargs)
+                    if args.incremental:
+                        listing = IncrementalListing(DownloadIndex.open(output_path),
+                            "u/" + username.lower() + "/upvoted", listing, chronological=False)
+                    return listing
+
+                journal = JournaledListing(DownloadIndex.open(output_path),
+                    "u/" + username.lower() + "/upvoted", listing_function, post_limit, self.reddit)
+
+                merging = []
+                for i, s in journal:
+                    retry = True
                     try:
                         prefix_str = '#' + str(i).zfill(3) + ' '
                         self.indent_1 = ' ' * len(prefix_str) + "* "
                         self.indent_2 = ' ' * len(self.indent_1) + "- "
-                        SubmissionDownloader(s, i, self.logger, upvoted_dir, skip_videos, skip_meta, skip_comments, comment_limit,
-                                                {'imgur_client_id': UserDownloader.IMGUR_CLIENT_ID})
+                        downloader = SubmissionDownloader(s, i, self.logger, upvoted_dir, skip_videos, skip_meta, skip_comments, comment_limit,
+                                                self.submission_config(output_path))
+                        retry = downloader.needs_retry()
+                        if downloader.merge_queued:
+                            merging.append((i, s, downloader))
                     except Exception as e:
                         self.logger.error(self.indent_2 + "Unable to download post #" + str(i) + " for user `" + username + "` - " + str(e))
+                    journal.done(i, s, retry)
+
+                # A post whose ffmpeg merge failed is tried again as well
+                for i, s, downloader in merging:
+                    downloader.wait()
+                    if downloader.needs_retry():
+                        journal.done(i, s, retry=True)
+
+                if isinstance(journal.listing, IncrementalListing):
+                    journal.listing.commit()
+                journal.clear()
             except Exception as e:
                 self.logger.error("Unable to download upvoted posts for user `" + username + "` - " + str(e))
 
@@ -325,7 +381,20 @@ class UserDownloader:
                 if not os.path.exists(saved_dir):
                     os.makedirs(saved_dir)
 
-                for i, s in enumerate(user.saved(limit=post_limit)):
+                def listing_function(limit, **kwargs):
+                    listing = user.saved(limit=limit, **kwargs)
+                    if args.incremental:
+                        listing = IncrementalListing(DownloadIndex.open(output_path),
+                            "u/" + username.lower() + "/saved", listing, chronological=False)
+                    return listing
+
+                journal = JournaledListing(DownloadIndex.open(output_path),
+                    "u/" + username.lower() + "/saved", listing_function, post_limit, self.reddit)
+
+                merging = []
+                for i, s in journal:
+                    # Only submissions are retried, see JournaledListing
+                    retry = isinstance(s, praw.models.Submission)
                     try:
                         prefix_str = '#' + str(i).zfill(3) + ' '
                         self.indent_1 = ' ' * len(prefix_str) + "* "
@@ -340,18 +409,31 @@ class UserDownloader:
                             post_dir = str(i).zfill(3) + "_Comment_" + \
                                 comment_body + "..."
                             submission_dir = os.path.join(saved_dir, post_dir)
-                            self.download_saved_comment(s, submission_dir)
+                            self.download_saved_comment(s, submission_dir, get_metadata_archive(output_path))
                         elif isinstance(s, praw.models.Comment):
                             self.logger.verbose(
                                 prefix_str + "Comment `" + str(s.id) + "` by " + str(s.author))
                             self.logger.spam(self.indent_2 + "Skipping comment")
                         elif isinstance(s, praw.models.Submission):
-                            SubmissionDownloader(s, i, self.logger, saved_dir, skip_videos, skip_meta, skip_comments, comment_limit,
-                                                {'imgur_client_id': UserDownloader.IMGUR_CLIENT_ID})
+                            downloader = SubmissionDownloader(s, i, self.logger, saved_dir, skip_videos, skip_meta, skip_comments, comment_limit,
+                                                self.submission_config(output_path))
+                            retry = downloader.needs_retry()
+                            if downloader.merge_queued:
+                                merging.append((i, s, downloader))
                         else:
                             pass
                     except Exception as e:
                         self.logger.error(self.indent_2 + "Unable to download #" + str(i) + " for user `" + username + "` - " + str(e))
+                    journal.done(i, s, retry)
+
+                for i, s, downloader in merging:
+                    downloader.wait()
+                    if downloader.needs_retry():
+                        journal.done(i, s, retry=True)
+
+                if isinstance(journal.listing, IncrementalListing):
+                    journal.listing.commit()
+                journal.clear()
             except Exception as e:
                 self.logger.error("Unable to download saved for user `" + username + "` - " + str(e))
 
@@ -392,14 +474,14 @@ class UserDownloader:
                             post_dir = str(i).zfill(3) + "_Comment_" + \
                                 comment_body + "..."
                             submission_dir = os.path.join(saved_dir, post_dir)
-                            self.download_saved_comment(s, submission_dir)
+                            self.download_saved_comment(s, submission_dir, get_metadata_archive(output_path))
                         elif isinstance(s, praw.models.Comment):
                             self.logger.verbose(
                                 prefix_str + "Comment `" + str(s.id) + "` by " + str(s.author))
                             self.logger.spam(self.indent_2 + "Skipping comment")
                         elif isinstance(s, praw.models.Submission):
                             SubmissionDownloader(s, i, self.logger, saved_dir, skip_videos, skip_meta, skip_comments, comment_limit,
-                                                {'imgur_client_id': UserDownloader.IMGUR_CLIENT_ID})
+                                                self.submission_config(output_path))
                         else:
                             pass
                     except Exception as e:
@@ -407,40 +489,60 @@ class UserDownloader:
             except Exception as e:
                 self.logger.error("Unable to download gilded for user `" + username + "` - " + str(e))
 
+    def submission_config(self, output_path):
+        return {
+            'imgur_client_id': UserDownloader.IMGUR_CLIENT_ID,
+            'index': DownloadIndex.open(output_path),
+            'media_store': get_media_store(output_path),
+            'metadata_archive': get_metadata_archive(output_path),
+        }
+
     def print_formatted_error(self, e):
         for line in str(e).split("\n"):
             self.logger.error(self.indent_2 + line)
 
-    def download_saved_comment(self, comment, output_dir):
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        self.logger.spam(
-            self.indent_2 + "Saving comment.json to " + output_dir)
-        with open(os.path.join(output_dir, 'comments.json'), 'w') as file:
-            comment_dict = {}
-            try:
-                if comment.author:
-                    comment_dict["author"] = comment.author.name
-                else:
-                    comment_dict["author"] = None
-                comment_dict["body"] = comment.body
-                comment_dict["created_utc"] = int(comment.created_utc)
-                comment_dict["distinguished"] = comment.distinguished
-                comment_dict["downs"] = comment.downs
-                comment_dict["edited"] = comment.edited
-                comment_dict["id"] = comment.id
-                comment_dict["is_submitter"] = comment.is_submitter
-                comment_dict["link_id"] = comment.link_id
-                comment_dict["parent_id"] = comment.parent_id
-                comment_dict["permalink"] = comment.permalink
-                comment_dict["score"] = comment.score
-                comment_dict["stickied"] = comment.stickied
-                comment_dict["subreddit_name_prefixed"] = comment.subreddit_name_prefixed
-                comment_dict["subreddit_id"] = comment.subreddit_id
-                comment_dict["total_awards_received"] = comment.total_awards_received
-                comment_dict["ups"] = comment.ups
-                file.write(json.dumps(comment_dict, indent=2))
-                self.logger.spam(
-                    self.indent_2 + "Successfully saved comment.json")
-            except Exception as e:
-                self.print_formatted_error(e)
\ No newline at end of file
+    def download_saved_comment(self, comment, output_dir, archive=None):
+        if archive != None:
+            self.logger.spam(
+                self.indent_2 + "Saving comment to " + archive.path)
+        else:
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            self.logger.spam(
+                self.indent_2 + "Saving comment.json to " + output_dir)
+        try:
+            comment_dict = UserDownloader.comment_to_dict(comment)
+            if archive != None:
+                archive.add_comments([comment_dict])
+            else:
+                with open(os.path.join(output_dir, 'comments.json'), 'w') as file:
+                    file.write(json.dumps(comment_dict, indent=2))
+            self.logger.spam(
+                self.indent_2 + "Successfully saved comment")
+        except Exception as e:
+            self.print_formatted_error(e)
+
+    @staticmethod
+    def comment_to_dict(comment):
+        comment_dict = {}
+        if comment.author:
+            comment_dict["author"] = comment.author.name
+        else:
+            comment_dict["author"] = None
+        comment_dict["body"] = comment.body
+        comment_dict["created_utc"] = int(comment.created_utc)
+        comment_dict["distinguished"] = comment.distinguished
+        comment_dict["downs"] = comment.downs
+        comment_dict["edited"] = comment.edited
+        comment_dict["id"] = comment.id
+        comment_dict["is_submitter"] = comment.is_submitter
+        comment_dict["link_id"] = comment.link_id
+        comment_dict["parent_id"] = comment.parent_id
+        comment_dict["permalink"] = comment.permalink
+        comment_dict["score"] = comment.score
+        comment_dict["stickied"] = comment.stickied
+        comment_dict["subreddit_name_prefixed"] = comment.subreddit_name_prefixed
+        comment_dict["subreddit_id"] = comment.subreddit_id
+        comment_dict["total_awards_received"] = comment.total_awards_received
+        comment_dict["ups"] = comment.ups
+        return comment_dict
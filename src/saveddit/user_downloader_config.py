@@ -4,4 +4,5 @@ class UserDownloaderConfig:
     DEFAULT_SORT = "hot"
     DEFAULT_SORT_OPTIONS = ["hot", "new", "top", "controversial"]
     DEFAULT_POST_LIMIT = None
-    DEFAULT_COMMENT_LIMIT = None
\ No newline at end of file
+    DEFAULT_COMMENT_LIMIT = None
+    DEFAULT_JOBS = 1
\ No newline at end of file
@@ -0,0 +1,51 @@
+import ffmpeg
+import os
+
+
+class VideoMerger:
+    '''
+    Muxes the separate DASH video and audio streams of a reddit video into
+    a single file
+
+    In `remux` mode both streams are mapped into the output with codec copy,
+    which takes milliseconds and keeps the original quality. Only when the
+    container cannot hold the streams as they are (ffmpeg fails) are they
+    re-encoded. `reencode` mode always re-encodes, like older versions did.
+    '''
+    REMUX = "remux"
+    REENCODE = "reencode"
+
+    mode = REMUX
+
+    @staticmethod
+    def merge(video_path, audio_path, output_path):
+        '''
+        Writes `output_path` and returns the mode that produced it. Raises
+        ffmpeg.Error if even re-encoding fails.
+        '''
+        if VideoMerger.mode == VideoMerger.REMUX:
+            try:
+                VideoMerger.run(video_path, audio_path, output_path, c="copy")
+                return VideoMerger.REMUX
+            except ffmpeg.Error:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+        VideoMerger.run(video_path, audio_path, output_path)
+        return VideoMerger.REENCODE
+
+    @staticmethod
+    def run(video_path, audio_path, output_path, **output_options):
+        input_video = ffmpeg.input(video_path)
+        input_audio = ffmpeg.input(audio_path)
+        ffmpeg.output(input_video.video, input_audio.audio, output_path, **output_options)\
+            .global_args('-loglevel', 'error')\
+            .overwrite_output()\
+            .run(capture_stdout=True, capture_stderr=True)
+
+
+def configure_video_merger(config):
+    '''
+    Reads the optional `ffmpeg_merge_mode` key (remux or reencode) in
+    user_config.yaml
+    '''
+    VideoMerger.mode = (config or {}).get("ffmpeg_merge_mode") or VideoMerger.REMUX
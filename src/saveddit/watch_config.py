@@ -0,0 +1,5 @@
+class WatchConfig:
+    DEFAULT_WORKERS = 4
+    DEFAULT_QUEUE_SIZE = 100
+    DEFAULT_RETRY_DELAY = 30  # seconds before a failed stream is reopened
+    DEFAULT_MAX_RETRIES = 3  # times a throttled post is downloaded again before giving up on it
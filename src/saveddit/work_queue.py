@@ -0,0 +1,363 @@
+import json
+import sqlite3
+import threading
+import time
+from saveddit.queue_config import QueueConfig
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class WorkQueue:
+    '''
+    Queue of submissions to download, shared by several saveddit nodes
+
+    Items are dicts with an `id` (the reddit id of the submission, so a
+    submission is queued once) and whatever the workers need to process it.
+    A worker leases an item for `lease_seconds` and keeps the lease alive
+    with `heartbeat` while it works on it. Leases that expire, e.g.,
+    because the worker died, are put back on the queue by the next
+    `lease`. Every item ends up `done` or, after `max_attempts` leases,
+    `failed`.
+    '''
+    QUEUED = "queued"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, max_attempts=QueueConfig.DEFAULT_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+
+    def put(self, items):
+        '''
+        Queues the items not queued before, returns how many were added
+        '''
+        raise NotImplementedError
+
+    def lease(self, worker, lease_seconds=QueueConfig.DEFAULT_LEASE_SECONDS):
+        '''
+        Returns the next item due, leased to `worker`, or None
+        '''
+        raise NotImplementedError
+
+    def heartbeat(self, worker, item_ids, lease_seconds=QueueConfig.DEFAULT_LEASE_SECONDS):
+        '''
+        Extends the leases `worker` holds on `item_ids`
+        '''
+        raise NotImplementedError
+
+    def complete(self, worker, item_id):
+        '''
+        Marks an item done. Like `heartbeat` and `retry`, it does nothing
+        unless `worker` still holds the lease, e.g., once it expired and
+        the item was leased to another worker.
+        '''
+        raise NotImplementedError
+
+    def retry(self, worker, item_id, delay=QueueConfig.DEFAULT_RETRY_DELAY, error=None):
+        '''
+        Puts an item back on the queue, due in `delay` seconds, or marks it
+        failed once it was leased `max_attempts` times
+        '''
+        raise NotImplementedError
+
+    def counts(self):
+        '''
+        Returns the number of items per state
+        '''
+        raise NotImplementedError
+
+
+class SqliteWorkQueue(WorkQueue):
+    '''
+    WorkQueue in a SQLite database, e.g., on a volume shared by the nodes
+
+    The database uses a rollback journal rather than WAL, which does not
+    work across hosts, and every lease runs in a write transaction. Opened
+    on ":memory:", it is a stand-in for a shared queue within one process.
+    '''
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS work_items (
+            id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL,
+            worker TEXT,
+            lease_expires REAL,
+            available_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )''',
+        '''CREATE INDEX IF NOT EXISTS work_items_state ON work_items (state, available_at)''',
+    ]
+
+    def __init__(self, path, max_attempts=QueueConfig.DEFAULT_MAX_ATTEMPTS):
+        super().__init__(max_attempts)
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            for statement in SqliteWorkQueue.SCHEMA:
+                self.connection.execute(statement)
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def transaction(self, function):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = function()
+                self.connection.execute("COMMIT")
+                return result
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def put(self, items):
+        now = time.time()
+
+        def insert():
+            added = 0
+            for i, item in enumerate(items):
+                # created_at keeps the items of a batch in order
+                added += self.connection.execute(
+                    '''INSERT OR IGNORE INTO work_items (id, payload, state, available_at, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?)''',
+                    (item["id"], json.dumps(item), WorkQueue.QUEUED, now, now + i * 1e-6, now)).rowcount
+            return added
+        return self.transaction(insert)
+
+    def lease(self, worker, lease_seconds=QueueConfig.DEFAULT_LEASE_SECONDS):
+        now = time.time()
+
+        def lease_one():
+            # Expired leases count as an attempt
+            self.connection.execute(
+                '''UPDATE work_items SET attempts = attempts + 1, worker = NULL, updated_at = ?,
+                       state = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END,
+                       error = CASE WHEN attempts + 1 >= ? THEN 'lease expired' ELSE error END
+                   WHERE state = ? AND lease_expires < ?''',
+                (now, self.max_attempts, WorkQueue.FAILED, WorkQueue.QUEUED,
+                 self.max_attempts, WorkQueue.LEASED, now))
+            row = self.connection.execute(
+                '''SELECT id, payload FROM work_items WHERE state = ? AND available_at <= ?
+                   ORDER BY available_at, created_at LIMIT 1''',
+                (WorkQueue.QUEUED, now)).fetchone()
+            if row == None:
+                return None
+            self.connection.execute(
+                '''UPDATE work_items SET state = ?, worker = ?, lease_expires = ?, updated_at = ?
+                   WHERE id = ?''',
+                (WorkQueue.LEASED, worker, now + lease_seconds, now, row["id"]))
+            return json.loads(row["payload"])
+        return self.transaction(lease_one)
+
+    def heartbeat(self, worker, item_ids, lease_seconds=QueueConfig.DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        for item_id in item_ids:
+            self.execute(
+                '''UPDATE work_items SET lease_expires = ?, updated_at = ?
+                   WHERE id = ? AND worker = ? AND state = ?''',
+                (now + lease_seconds, now, item_id, worker, WorkQueue.LEASED))
+
+    def complete(self, worker, item_id):
+        self.execute(
+            '''UPDATE work_items SET state = ?, error = NULL, updated_at = ?
+               WHERE id = ? AND worker = ? AND state = ?''',
+            (WorkQueue.DONE, time.time(), item_id, worker, WorkQueue.LEASED))
+
+    def retry(self, worker, item_id, delay=QueueConfig.DEFAULT_RETRY_DELAY, error=None):
+        now = time.time()
+        self.execute(
+            '''UPDATE work_items SET attempts = attempts + 1, worker = NULL, error = ?,
+                   available_at = ?, updated_at = ?,
+                   state = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END
+               WHERE id = ? AND worker = ? AND state = ?''',
+            (error, now + delay, now, self.max_attempts, WorkQueue.FAILED, WorkQueue.QUEUED,
+             item_id, worker, WorkQueue.LEASED))
+
+    def counts(self):
+        return {row["state"]: row["count"] for row in self.execute(
+            "SELECT state, COUNT(*) AS count FROM work_items GROUP BY state")}
+
+
+class RedisWorkQueue(WorkQueue):
+    '''
+    WorkQueue in Redis (or any server speaking its protocol)
+
+    Due and delayed items are kept in one sorted set scored by the time
+    they are due, leases in another one scored by their expiry. Every
+    operation that reads and then updates an item runs as a Lua script, so
+    it is atomic across nodes. The scripts share the same KEYS: due,
+    leases, workers, attempts, states, items, errors (the last error of
+    each item) and counts (the number of items per state, kept up to date
+    by the scripts so that `counts` does not read every item).
+    '''
+    PREFIX = "saveddit:queue:"
+
+    # Moves an item to another state and updates the counts
+    SET_STATE = '''
+        local function set_state(id, state)
+            local previous = redis.call('HGET', KEYS[5], id)
+            if previous then
+                redis.call('HINCRBY', KEYS[8], previous, -1)
+            end
+            redis.call('HSET', KEYS[5], id, state)
+            redis.call('HINCRBY', KEYS[8], state, 1)
+        end
+    '''
+
+    # KEYS: due, leases, workers, attempts, states, items, errors, counts
+    # ARGV: now, lease expiry, worker, max attempts
+    LEASE_SCRIPT = SET_STATE + '''
+        local now = tonumber(ARGV[1])
+        for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+            redis.call('ZREM', KEYS[2], id)
+            redis.call('HDEL', KEYS[3], id)
+            if redis.call('HINCRBY', KEYS[4], id, 1) >= tonumber(ARGV[4]) then
+                set_state(id, 'failed')
+                redis.call('HSET', KEYS[7], id, 'lease expired')
+            else
+                redis.call('ZADD', KEYS[1], now, id)
+                set_state(id, 'queued')
+            end
+        end
+        local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 1)
+        if #due == 0 then
+            return false
+        end
+        local id = due[1]
+        redis.call('ZREM', KEYS[1], id)
+        redis.call('ZADD', KEYS[2], ARGV[2], id)
+        redis.call('HSET', KEYS[3], id, ARGV[3])
+        set_state(id, 'leased')
+        return redis.call('HGET', KEYS[6], id)
+    '''
+
+    # ARGV: (id, payload, due) triples
+    PUT_SCRIPT = SET_STATE + '''
+        local added = 0
+        for i = 1, #ARGV, 3 do
+            if redis.call('HSETNX', KEYS[6], ARGV[i], ARGV[i + 1]) == 1 then
+                redis.call('ZADD', KEYS[1], ARGV[i + 2], ARGV[i])
+                set_state(ARGV[i], 'queued')
+                added = added + 1
+            end
+        end
+        return added
+    '''
+
+    # ARGV: worker, lease expiry, ids...
+    HEARTBEAT_SCRIPT = '''
+        for i = 3, #ARGV do
+            if redis.call('HGET', KEYS[3], ARGV[i]) == ARGV[1] then
+                redis.call('ZADD', KEYS[2], 'XX', ARGV[2], ARGV[i])
+            end
+        end
+    '''
+
+    # ARGV: id, worker
+    COMPLETE_SCRIPT = SET_STATE + '''
+        if redis.call('HGET', KEYS[3], ARGV[1]) ~= ARGV[2] then
+            return 0
+        end
+        redis.call('ZREM', KEYS[2], ARGV[1])
+        redis.call('HDEL', KEYS[3], ARGV[1])
+        redis.call('HDEL', KEYS[7], ARGV[1])
+        set_state(ARGV[1], 'done')
+        return 1
+    '''
+
+    # ARGV: id, worker, due, max attempts, error ('' for none)
+    RETRY_SCRIPT = SET_STATE + '''
+        if redis.call('HGET', KEYS[3], ARGV[1]) ~= ARGV[2] then
+            return 0
+        end
+        redis.call('ZREM', KEYS[2], ARGV[1])
+        redis.call('HDEL', KEYS[3], ARGV[1])
+        if ARGV[5] == '' then
+            redis.call('HDEL', KEYS[7], ARGV[1])
+        else
+            redis.call('HSET', KEYS[7], ARGV[1], ARGV[5])
+        end
+        if redis.call('HINCRBY', KEYS[4], ARGV[1], 1) >= tonumber(ARGV[4]) then
+            set_state(ARGV[1], 'failed')
+        else
+            redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+            set_state(ARGV[1], 'queued')
+        end
+        return 1
+    '''
+
+    def __init__(self, url, max_attempts=QueueConfig.DEFAULT_MAX_ATTEMPTS):
+        if redis == None:
+            raise ImportError("The redis work queue requires redis (pip install saveddit[redis])")
+        super().__init__(max_attempts)
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.keys = [RedisWorkQueue.PREFIX + name for name in
+                     ["due", "leases", "workers", "attempts", "states", "items", "errors", "counts"]]
+        self.counts_key = self.keys[7]
+        self.lease_script = self.redis.register_script(RedisWorkQueue.LEASE_SCRIPT)
+        self.put_script = self.redis.register_script(RedisWorkQueue.PUT_SCRIPT)
+        self.heartbeat_script = self.redis.register_script(RedisWorkQueue.HEARTBEAT_SCRIPT)
+        self.complete_script = self.redis.register_script(RedisWorkQueue.COMPLETE_SCRIPT)
+        self.retry_script = self.redis.register_script(RedisWorkQueue.RETRY_SCRIPT)
+
+    def put(self, items):
+        if not items:
+            return 0
+        now = time.time()
+        args = []
+        for i, item in enumerate(items):
+            # Due a little in the past, so that the items of a batch are due
+            # right away and in order
+            args.extend([item["id"], json.dumps(item), now - (len(items) - i) * 1e-6])
+        return self.put_script(keys=self.keys, args=args)
+
+    def lease(self, worker, lease_seconds=QueueConfig.DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        payload = self.lease_script(keys=self.keys,
+                                    args=[now, now + lease_seconds, worker, self.max_attempts])
+        if payload == None:
+            return None
+        return json.loads(payload)
+
+    def heartbeat(self, worker, item_ids, lease_seconds=QueueConfig.DEFAULT_LEASE_SECONDS):
+        if item_ids:
+            self.heartbeat_script(keys=self.keys,
+                                  args=[worker, time.time() + lease_seconds] + list(item_ids))
+
+    def complete(self, worker, item_id):
+        self.complete_script(keys=self.keys, args=[item_id, worker])
+
+    def retry(self, worker, item_id, delay=QueueConfig.DEFAULT_RETRY_DELAY, error=None):
+        self.retry_script(keys=self.keys,
+                          args=[item_id, worker, time.time() + delay, self.max_attempts, error or ""])
+
+    def counts(self):
+        return {state: int(count) for state, count in self.redis.hgetall(self.counts_key).items()
+                if int(count) > 0}
+
+
+def open_work_queue(url, max_attempts=QueueConfig.DEFAULT_MAX_ATTEMPTS):
+    '''
+    Opens the queue at `url`:
+
+      sqlite:///path/to/queue.db      SQLite database, e.g., on a shared volume
+      redis://host:6379/0             Redis server
+      local://                        in-memory queue, for a single process
+    '''
+    if url.startswith("sqlite://"):
+        return SqliteWorkQueue(url[len("sqlite://"):], max_attempts)
+    if url.startswith("redis://") or url.startswith("rediss://") or url.startswith("unix://"):
+        return RedisWorkQueue(url, max_attempts)
+    if url.startswith("local://"):
+        return SqliteWorkQueue(":memory:", max_attempts)
+    raise ValueError("Unsupported work queue `" + url + "`, expected sqlite://, redis:// or local://")
@@ -0,0 +1,147 @@
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+import pytest
+import verboselogs
+from saveddit.download_index import DownloadIndex
+from saveddit.ffmpeg_pool import shutdown_ffmpeg_pool
+from saveddit.http_client import PartialDownload
+from saveddit.rate_limiter import RateLimiter, get_rate_limiter, set_rate_limiter
+from saveddit.submission_downloader import SubmissionDownloader
+
+BODY = bytes(range(256)) * 1024
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    Serves `server.files[path]`, or BODY at any other path, honouring
+    Range requests, except:
+
+      /missing          404
+      /throttled        429, always
+      /throttled-once   429 the first time
+      /drop             the first time, half of the body and a closed connection
+      /no-range         ignores Range
+    '''
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            count = server.counts.get(self.path, 0)
+            server.counts[self.path] = count + 1
+            server.requests.append((self.path, self.headers.get("Range"), self.client_address[1]))
+
+        body = server.files.get(self.path, server.body)
+        if self.path == "/missing":
+            return self.reply(404, b"")
+        if self.path == "/throttled" or (self.path == "/throttled-once" and count == 0):
+            return self.reply(429, b"", {"Retry-After": "0"})
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.path != "/no-range":
+            start = int(range_header.split("=")[1].rstrip("-"))
+            if start >= len(body):
+                return self.reply(416, b"", {"Content-Range": "bytes */" + str(len(body))})
+        if self.path == "/drop" and count == 0:
+            # Promises the whole body, sends half of it and hangs up
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        if start:
+            return self.reply(206, body[start:], {
+                "Content-Range": "bytes " + str(start) + "-" + str(len(body) - 1) + "/" + str(len(body))})
+        return self.reply(200, body)
+
+    def reply(self, status, body, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(rate_limiter):
+    '''
+    Local HTTP/1.1 server of BODY with Range support, see Handler for its
+    paths
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.lock = threading.Lock()
+    server.counts = {}
+    server.requests = []
+    server.body = BODY
+    server.files = {}
+    server.url = "http://127.0.0.1:" + str(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def rate_limiter():
+    # Hosts blocked by a 429 in one test must not slow down the next one
+    previous = get_rate_limiter()
+    set_rate_limiter(RateLimiter())
+    yield
+    set_rate_limiter(previous)
+
+
+
+
+@pytest.fixture
+def check_result(server):
+    '''
+    Asserts that a DownloadResult is the complete body of `server`
+    '''
+    def check(result, save_path):
+        assert result.path == save_path
+        assert result.size == len(server.body)
+        assert result.sha256 == hashlib.sha256(server.body).hexdigest()
+        with open(save_path, "rb") as f:
+            assert f.read() == server.body
+        assert not os.path.exists(save_path + PartialDownload.SUFFIX)
+    return check
+
+
+class FakeVideoSubmission:
+    def __init__(self, id, dash_url):
+        self.id = id
+        self.url = "https://v.redd.it/" + id
+        self.title = "video " + id
+        self.is_self = False
+        self.media = {"reddit_video": {"dash_url": dash_url, "fallback_url": dash_url}}
+
+
+@pytest.fixture
+def download_reddit_video(server, tmp_path):
+    '''
+    Starts downloading a v.redd.it post whose DASH manifest `server` serves
+    (see server.files) into tmp_path and returns its SubmissionDownloader,
+    whose ffmpeg merge may still be running
+    '''
+    def download(manifest, id="abc"):
+        server.files["/" + id + "/DASHPlaylist.mpd"] = manifest.encode("utf-8")
+        submission = FakeVideoSubmission(id, server.url + "/" + id + "/DASHPlaylist.mpd")
+        config = {
+            "imgur_client_id": "id",
+            "show_progress": False,
+            "index": DownloadIndex.open(str(tmp_path)),
+        }
+        return SubmissionDownloader(submission, 0, verboselogs.VerboseLogger("test"), str(tmp_path / "r"),
+                                    False, True, True, 0, config)
+
+    yield download
+    shutdown_ffmpeg_pool()
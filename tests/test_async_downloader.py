@@ -0,0 +1,70 @@
+import pytest
+from saveddit import async_downloader
+from saveddit.async_downloader import AsyncDownloadEngine, configure_download_engine, get_download_engine
+from saveddit.http_client import HttpClient, get_http_client
+from saveddit.rate_limiter import Throttled
+
+requires_aiohttp = pytest.mark.skipif(async_downloader.aiohttp == None, reason="aiohttp is not installed")
+
+
+@pytest.fixture(autouse=True)
+def sync_engine_afterwards():
+    yield
+    configure_download_engine({})
+
+
+@pytest.fixture
+def engine():
+    engine = AsyncDownloadEngine(max_concurrency=4)
+    yield engine
+    engine.close()
+
+
+def test_sync_engine_by_default():
+    configure_download_engine({})
+    assert get_download_engine() is get_http_client()
+
+
+def test_async_engine_falls_back_without_aiohttp(monkeypatch, capsys):
+    monkeypatch.setattr(async_downloader, "aiohttp", None)
+    configure_download_engine({"download_engine": "async"})
+
+    assert get_download_engine() is get_http_client()
+    assert "aiohttp is not installed" in capsys.readouterr().out
+    with pytest.raises(ImportError):
+        AsyncDownloadEngine()
+
+
+@requires_aiohttp
+def test_async_engine_is_started_on_first_use():
+    configure_download_engine({"download_engine": "async", "async_max_concurrency": 8})
+    assert async_downloader._download_engine == None
+
+    engine = get_download_engine()
+    assert isinstance(engine, AsyncDownloadEngine)
+    assert engine.max_concurrency == 8
+    assert get_download_engine() is engine
+
+
+@requires_aiohttp
+def test_fetch_many(server, tmp_path, engine, check_result):
+    paths = ["/file", "/missing", "/drop", "/file", "/no-range"]
+    jobs = [(server.url + path, str(tmp_path / (str(i) + ".jpg"))) for i, path in enumerate(paths)]
+    done = []
+    results = engine.fetch_many(jobs, on_done=lambda: done.append(1), max_concurrency=2)
+
+    assert len(done) == len(jobs)
+    assert isinstance(results[1], Exception)
+    for i in [0, 2, 3, 4]:
+        check_result(results[i], jobs[i][1])
+    # The dropped transfer was resumed where it stopped
+    assert ("/drop", "bytes=" + str(len(server.body) // 2) + "-") in \
+        [(path, range_header) for path, range_header, _ in server.requests]
+
+
+@requires_aiohttp
+def test_throttled(server, tmp_path, engine):
+    results = engine.fetch_many([(server.url + "/throttled", str(tmp_path / "image.jpg"))])
+
+    assert isinstance(results[0], Throttled)
+    assert server.counts["/throttled"] == HttpClient.DEFAULT_RETRIES + 1
@@ -0,0 +1,107 @@
+import praw
+from saveddit.comment_expander import CommentExpander
+
+
+def comment(id, parent_id, replies=()):
+    return {"kind": "t1", "data": {
+        "id": id, "name": "t1_" + id, "parent_id": parent_id, "link_id": "t3_s",
+        "body": "comment " + id,
+        "replies": {"kind": "Listing", "data": {"children": list(replies)}} if replies else "",
+    }}
+
+
+def more(parent_id, children):
+    return {"kind": "more", "data": {
+        "id": children[0] if children else "_", "name": "t1_" + (children[0] if children else "_"),
+        "parent_id": parent_id, "count": len(children), "children": children,
+    }}
+
+
+def listing(children):
+    return {"kind": "Listing", "data": {"children": children}}
+
+
+SUBMISSION = listing([{"kind": "t3", "data": {"id": "s", "name": "t3_s", "title": "post"}}])
+
+# c1
+#   c2
+#   [more: c4 (c5 (continue this thread: c7))]
+# c3
+# [more: c6]
+RESPONSES = {
+    ("GET", "comments/s/"): [SUBMISSION, listing([
+        comment("c1", "t3_s", [comment("c2", "t1_c1"), more("t1_c1", ["c4", "c5"])]),
+        comment("c3", "t3_s"),
+        more("t3_s", ["c6"]),
+    ])],
+    ("POST", "api/morechildren/"): {"json": {"errors": [], "data": {"things": [
+        comment("c4", "t1_c1"),
+        comment("c5", "t1_c4"),
+        comment("c6", "t3_s"),
+        more("t1_c5", []),
+    ]}}},
+    ("GET", "comments/s/_/c5"): [SUBMISSION, listing([
+        comment("c5", "t1_c4", [comment("c7", "t1_c5")]),
+    ])],
+}
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.released = []
+
+    def acquire(self):
+        pass
+
+    def release(self, status_code=None, retry_after=None):
+        self.released.append(status_code)
+
+
+def submission_with_requests():
+    reddit = praw.Reddit(client_id="id", client_secret="secret", user_agent="saveddit tests")
+    requests = []
+
+    def request(method, path, params=None, data=None, files=None, json=None):
+        requests.append((method, path, data))
+        return RESPONSES[(method, path)]
+
+    reddit.request = request
+    submission = reddit.submission("s")
+    submission.comments  # fetches the first page of comments
+    return submission, requests
+
+
+def expander_of(submission):
+    expander = CommentExpander(submission)
+    expander.limiter = FakeLimiter()
+    return expander
+
+
+def test_expand_all():
+    submission, requests = submission_with_requests()
+    expander = expander_of(submission)
+
+    assert expander.expand(limit=None) == []
+    # Breadth first, fetched comments after the replies of their parent
+    assert [c.id for c in expander.comments()] == ["c1", "c3", "c6", "c2", "c4", "c5", "c7"]
+    # Both MoreComments of the first round share one request
+    assert [(method, path) for method, path, _ in requests] == [
+        ("GET", "comments/s/"), ("POST", "api/morechildren/"), ("GET", "comments/s/_/c5")]
+    assert requests[1][2]["children"] == "c4,c5,c6"
+    assert expander.limiter.released == [200, 200]
+
+
+def test_expand_none():
+    submission, requests = submission_with_requests()
+    expander = expander_of(submission)
+
+    assert len(expander.expand(limit=0)) == 2
+    assert [c.id for c in expander.comments()] == ["c1", "c3", "c2"]
+    assert len(requests) == 1
+
+
+def test_forest_is_left_as_fetched():
+    submission, _ = submission_with_requests()
+    expander_of(submission).expand(limit=None)
+
+    assert [type(c).__name__ for c in submission.comments] == ["Comment", "Comment", "MoreComments"]
@@ -0,0 +1,165 @@
+import os
+import pytest
+from saveddit.dash_manifest import DashManifest, configure_video_quality
+from saveddit.download_index import DownloadIndex
+from saveddit.video_merger import VideoMerger
+
+MANIFEST_URL = "https://v.redd.it/abc/DASHPlaylist.mpd"
+
+
+def mpd(*adaptation_sets, duration="PT10S"):
+    return '''<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" mediaPresentationDuration="''' + duration + '''">
+  <Period>''' + "".join(adaptation_sets) + '''</Period>
+</MPD>'''
+
+
+def video(height, bandwidth, inner):
+    return '''
+    <AdaptationSet contentType="video">
+      <Representation id="''' + str(height) + '''" bandwidth="''' + str(bandwidth) + \
+        '''" height="''' + str(height) + '''">''' + inner + '''</Representation>
+    </AdaptationSet>'''
+
+
+AUDIO = '''
+    <AdaptationSet mimeType="audio/mp4">
+      <Representation id="audio" bandwidth="128000"><BaseURL>DASH_audio.mp4</BaseURL></Representation>
+    </AdaptationSet>'''
+
+QUALITIES = mpd(
+    video(240, 400000, "<BaseURL>DASH_240.mp4</BaseURL>"),
+    video(720, 2000000, "<BaseURL>DASH_720.mp4</BaseURL>"),
+    video(480, 1000000, "<BaseURL>DASH_480.mp4</BaseURL>"),
+    AUDIO)
+
+
+@pytest.fixture(autouse=True)
+def default_quality():
+    yield
+    configure_video_quality({})
+
+
+def test_base_urls():
+    manifest = DashManifest.parse(QUALITIES, MANIFEST_URL)
+
+    assert [(r.kind, r.height, r.urls) for r in manifest.representations] == [
+        ("video", 240, ["https://v.redd.it/abc/DASH_240.mp4"]),
+        ("video", 720, ["https://v.redd.it/abc/DASH_720.mp4"]),
+        ("video", 480, ["https://v.redd.it/abc/DASH_480.mp4"]),
+        ("audio", 0, ["https://v.redd.it/abc/DASH_audio.mp4"])]
+
+
+def test_segment_list():
+    manifest = DashManifest.parse(mpd(video(720, 2000000, '''
+        <SegmentList>
+          <Initialization sourceURL="init.mp4"/>
+          <SegmentURL media="seg-1.m4s"/>
+          <SegmentURL media="seg-2.m4s"/>
+        </SegmentList>''')), MANIFEST_URL)
+
+    assert manifest.select("video").urls == [
+        "https://v.redd.it/abc/init.mp4",
+        "https://v.redd.it/abc/seg-1.m4s",
+        "https://v.redd.it/abc/seg-2.m4s"]
+
+
+def test_segment_template_with_timeline():
+    manifest = DashManifest.parse(mpd(video(720, 2000000, '''
+        <SegmentTemplate initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Time$-$Number%03d$.m4s" startNumber="5">
+          <SegmentTimeline><S t="0" d="100" r="1"/><S d="50"/></SegmentTimeline>
+        </SegmentTemplate>''')), MANIFEST_URL)
+
+    assert manifest.select("video").urls == [
+        "https://v.redd.it/abc/720/init.mp4",
+        "https://v.redd.it/abc/720/0-005.m4s",
+        "https://v.redd.it/abc/720/100-006.m4s",
+        "https://v.redd.it/abc/720/200-007.m4s"]
+
+
+def test_segment_template_with_duration():
+    manifest = DashManifest.parse(mpd(video(720, 2000000, '''
+        <SegmentTemplate media="seg-$Number$.m4s" duration="4000" timescale="1000"/>'''),
+        duration="PT1M0.5S"), MANIFEST_URL)
+
+    # 60.5 seconds in segments of 4 seconds
+    urls = manifest.select("video").urls
+    assert len(urls) == 16
+    assert urls[0] == "https://v.redd.it/abc/seg-1.m4s"
+    assert urls[-1] == "https://v.redd.it/abc/seg-16.m4s"
+
+
+def test_select_by_quality():
+    manifest = DashManifest.parse(QUALITIES, MANIFEST_URL)
+
+    assert manifest.select("video").height == 720
+    assert manifest.select("video", max_height=480).height == 480
+    assert manifest.select("video", max_bandwidth=500000).height == 240
+    # Nothing fits, the smallest is the closest
+    assert manifest.select("video", max_height=144).height == 240
+    # The height limit does not apply to audio
+    assert manifest.select("audio", max_height=144).urls == ["https://v.redd.it/abc/DASH_audio.mp4"]
+
+
+def test_configured_quality():
+    configure_video_quality({"video_max_height": 480})
+    manifest = DashManifest.parse(QUALITIES, MANIFEST_URL)
+
+    assert manifest.select("video").height == 480
+    assert DashManifest.parse(mpd(AUDIO), MANIFEST_URL).select("video") == None
+
+
+SEGMENTED = mpd(
+    video(720, 2000000, '''
+        <SegmentList>
+          <Initialization sourceURL="init.mp4"/>
+          <SegmentURL media="seg-1.m4s"/>
+          <SegmentURL media="seg-2.m4s"/>
+        </SegmentList>'''),
+    AUDIO)
+
+
+@pytest.fixture
+def merges(monkeypatch):
+    merges = []
+
+    def merge(video_path, audio_path, output_path):
+        with open(video_path, "rb") as f:
+            merges.append(f.read())
+        with open(output_path, "wb") as f:
+            f.write(b"merged")
+        return VideoMerger.REMUX
+
+    monkeypatch.setattr(VideoMerger, "merge", merge)
+    return merges
+
+
+def files_in(path):
+    return sorted(name for _, _, names in os.walk(str(path)) for name in names)
+
+
+def test_segments_are_joined_in_order(server, tmp_path, download_reddit_video, merges):
+    server.files["/abc/init.mp4"] = b"init|"
+    server.files["/abc/seg-1.m4s"] = b"one|"
+    server.files["/abc/seg-2.m4s"] = b"two"
+    downloader = download_reddit_video(SEGMENTED)
+    downloader.wait()
+
+    assert merges == [b"init|one|two"]
+    assert downloader.status == DownloadIndex.STATUS_COMPLETE
+    assert files_in(tmp_path / "r") == ["abc.mp4"]
+
+
+def test_failed_segment_fails_the_post(server, tmp_path, download_reddit_video, merges):
+    server.files["/abc/init.mp4"] = b"init|"
+    server.files["/abc/seg-1.m4s"] = b"one|"
+    # The last segment is not found
+    downloader = download_reddit_video(SEGMENTED.replace("seg-2.m4s", "/missing"))
+    downloader.wait()
+
+    assert merges == []
+    assert downloader.status == DownloadIndex.STATUS_FAILED
+    assert downloader.needs_retry()
+    assert downloader.index.get("abc")["status"] == DownloadIndex.STATUS_FAILED
+    # No segments, joined streams or partial downloads are left behind
+    assert files_in(tmp_path / "r") == []
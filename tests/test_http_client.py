@@ -0,0 +1,85 @@
+import os
+import pytest
+import requests
+from saveddit.http_client import HttpClient, PartialDownload
+from saveddit.rate_limiter import Throttled
+
+
+def test_download(server, tmp_path, check_result):
+    save_path = str(tmp_path / "image.jpg")
+    check_result(HttpClient().download(server.url + "/file", save_path), save_path)
+
+
+def test_downloads_reuse_the_connection(server, tmp_path):
+    client = HttpClient()
+    for i in range(3):
+        client.download(server.url + "/file", str(tmp_path / (str(i) + ".jpg")))
+
+    assert len(set(port for _, _, port in server.requests)) == 1
+
+
+def test_resume_after_dropped_connection(server, tmp_path, check_result):
+    save_path = str(tmp_path / "video.mp4")
+    check_result(HttpClient().download(server.url + "/drop", save_path), save_path)
+
+    assert [(path, range_header) for path, range_header, _ in server.requests] == [
+        ("/drop", None), ("/drop", "bytes=" + str(len(server.body) // 2) + "-")]
+
+
+def test_resume_part_file_of_earlier_run(server, tmp_path, check_result):
+    save_path = str(tmp_path / "video.mp4")
+    with open(save_path + PartialDownload.SUFFIX, "wb") as f:
+        f.write(server.body[:1000])
+
+    check_result(HttpClient().download(server.url + "/file", save_path), save_path)
+    assert server.requests[0][1] == "bytes=1000-"
+
+
+def test_part_file_already_complete(server, tmp_path, check_result):
+    save_path = str(tmp_path / "video.mp4")
+    with open(save_path + PartialDownload.SUFFIX, "wb") as f:
+        f.write(server.body)
+
+    check_result(HttpClient().download(server.url + "/file", save_path), save_path)
+
+
+def test_server_ignoring_range_restarts(server, tmp_path, check_result):
+    save_path = str(tmp_path / "video.mp4")
+    with open(save_path + PartialDownload.SUFFIX, "wb") as f:
+        f.write(b"stale bytes")
+
+    check_result(HttpClient().download(server.url + "/no-range", save_path), save_path)
+
+
+def test_http_error(server, tmp_path):
+    save_path = str(tmp_path / "image.jpg")
+    with pytest.raises(requests.HTTPError):
+        HttpClient().download(server.url + "/missing", save_path)
+    assert not os.path.exists(save_path)
+
+
+def test_throttled_request_is_retried(server):
+    response = HttpClient().get(server.url + "/throttled-once")
+
+    assert response.status_code == 200
+    assert server.counts["/throttled-once"] == 2
+
+
+def test_throttled_after_retries(server, tmp_path):
+    with pytest.raises(Throttled) as e:
+        HttpClient().download(server.url + "/throttled", str(tmp_path / "image.jpg"))
+
+    assert e.value.retry_after == 0
+    assert server.counts["/throttled"] == HttpClient.DEFAULT_RETRIES + 1
+
+
+def test_fetch_many(server, tmp_path, check_result):
+    jobs = [(server.url + path, str(tmp_path / (str(i) + ".jpg")))
+            for i, path in enumerate(["/file", "/missing", "/drop", "/file"])]
+    done = []
+    results = HttpClient().fetch_many(jobs, on_done=lambda: done.append(1))
+
+    assert len(done) == 4
+    assert isinstance(results[1], requests.HTTPError)
+    for i in [0, 2, 3]:
+        check_result(results[i], jobs[i][1])
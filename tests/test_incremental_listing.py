@@ -0,0 +1,118 @@
+from saveddit.download_index import DownloadIndex
+from saveddit.incremental_listing import IncrementalListing
+from saveddit.journaled_listing import JournaledListing
+
+
+class FakeSubmission:
+    def __init__(self, id, created_utc=None):
+        self.id = id
+        self.fullname = "t3_" + id
+        self.created_utc = created_utc
+
+
+class FakeReddit:
+    def submission(self, id):
+        return FakeSubmission(id)
+
+
+class Listing:
+    '''
+    Newest first, like the `new` listing. Counts the items PRAW would have
+    had to fetch.
+    '''
+    def __init__(self, submissions):
+        self.submissions = submissions
+        self.fetched = 0
+
+    def __iter__(self):
+        for submission in self.submissions:
+            self.fetched += 1
+            yield submission
+
+
+def posts(*ids):
+    # Newer posts have a larger id, and are listed first
+    return [FakeSubmission(id, created_utc=1000 + int(id)) for id in ids]
+
+
+def run(index, listing, chronological=True, commit=True):
+    incremental = IncrementalListing(index, "r/pics/new", listing, chronological)
+    ids = [submission.id for submission in incremental]
+    if commit:
+        incremental.commit()
+    return ids
+
+
+def test_first_run_lists_everything(tmp_path):
+    index = DownloadIndex.open(str(tmp_path))
+
+    assert run(index, Listing(posts("3", "2", "1"))) == ["3", "2", "1"]
+    assert index.get_mark("r/pics/new")["fullname"] == "t3_3"
+
+
+def test_next_run_stops_at_the_mark(tmp_path):
+    index = DownloadIndex.open(str(tmp_path))
+    run(index, Listing(posts("3", "2", "1")))
+
+    listing = Listing(posts("5", "4", "3", "2", "1"))
+    assert run(index, listing) == ["5", "4"]
+    # Pagination stopped at the marked item
+    assert listing.fetched == 3
+    assert index.get_mark("r/pics/new")["fullname"] == "t3_5"
+
+
+def test_nothing_new(tmp_path):
+    index = DownloadIndex.open(str(tmp_path))
+    run(index, Listing(posts("3", "2", "1")))
+
+    listing = Listing(posts("3", "2", "1"))
+    assert run(index, listing) == []
+    assert listing.fetched == 1
+    assert index.get_mark("r/pics/new")["fullname"] == "t3_3"
+
+
+def test_deleted_mark_stops_at_older_post(tmp_path):
+    index = DownloadIndex.open(str(tmp_path))
+    run(index, Listing(posts("3", "2", "1")))
+
+    # t3_3 was deleted in the meantime
+    assert run(index, Listing(posts("5", "4", "2", "1"))) == ["5", "4"]
+
+
+def test_listing_in_other_order_only_stops_at_the_mark(tmp_path):
+    index = DownloadIndex.open(str(tmp_path))
+    run(index, Listing(posts("3", "2", "1")), chronological=False)
+
+    # e.g., `saved`: an old post saved since the last run comes first
+    assert run(index, Listing(posts("1", "4", "3", "2")), chronological=False) == ["1", "4"]
+
+
+def test_interrupted_run_keeps_the_mark(tmp_path):
+    index = DownloadIndex.open(str(tmp_path))
+    run(index, Listing(posts("3", "2", "1")))
+    run(index, Listing(posts("5", "4", "3")), commit=False)
+
+    assert index.get_mark("r/pics/new")["fullname"] == "t3_3"
+    assert run(index, Listing(posts("5", "4", "3"))) == ["5", "4"]
+
+
+def test_failed_posts_are_retried_by_the_next_run(tmp_path):
+    index = DownloadIndex.open(str(tmp_path))
+
+    def journal_run(submissions, failed):
+        def listing_function(limit, **kwargs):
+            return IncrementalListing(index, "r/pics/new", Listing(submissions))
+
+        journal = JournaledListing(index, "r/pics/new", listing_function, reddit=FakeReddit())
+        ids = []
+        for position, submission in journal:
+            ids.append(submission.id)
+            journal.done(position, submission, retry=submission.id in failed)
+        journal.listing.commit()
+        journal.clear()
+        return ids
+
+    assert journal_run(posts("3", "2", "1"), failed={"2"}) == ["3", "2", "1"]
+    # The mark moved past t3_2, the pending retry brings it back
+    assert journal_run(posts("4", "3", "2", "1"), failed=set()) == ["2", "4"]
+    assert journal_run(posts("4", "3", "2", "1"), failed=set()) == []
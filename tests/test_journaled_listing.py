@@ -0,0 +1,71 @@
+import praw
+import pytest
+from saveddit.journaled_listing import JournaledListing
+
+
+class FakeIndex:
+    def __init__(self, cursor=None):
+        self.cursor = cursor
+        self.finished = False
+
+    def get_cursor(self, source):
+        return self.cursor
+
+    def finish_cursor(self, source):
+        self.finished = True
+
+
+class FakeSubmission:
+    def __init__(self, id):
+        self.id = id
+        self.fullname = "t3_" + id
+
+
+reddit = praw.Reddit(client_id="id", client_secret="secret", user_agent="saveddit tests")
+subreddit = reddit.subreddit("pics")
+redditor = reddit.redditor("spez")
+
+# The listings the subreddit and user downloaders journal. Building them
+# does not send any request.
+LISTINGS = {
+    "r/hot": subreddit.hot,
+    "r/new": subreddit.new,
+    "r/rising": subreddit.rising,
+    "r/controversial": subreddit.controversial,
+    "r/top": subreddit.top,
+    "u/submitted/hot": redditor.submissions.hot,
+    "u/submitted/new": redditor.submissions.new,
+    "u/submitted/controversial": redditor.submissions.controversial,
+    "u/submitted/top": redditor.submissions.top,
+    "u/upvoted": redditor.upvoted,
+    "u/saved": redditor.saved,
+}
+
+
+def journal_of(index, function, submissions):
+    calls = []
+
+    def listing_function(limit, **kwargs):
+        calls.append(kwargs)
+        function(limit=limit, **kwargs)
+        return submissions
+
+    return JournaledListing(index, "source", listing_function, limit=10), calls
+
+
+@pytest.mark.parametrize("name", sorted(LISTINGS))
+def test_listing_without_cursor(name):
+    index = FakeIndex()
+    submissions = [FakeSubmission("a"), FakeSubmission("b")]
+    journal, calls = journal_of(index, LISTINGS[name], submissions)
+    assert list(journal) == list(enumerate(submissions))
+    assert calls == [{}]
+
+
+@pytest.mark.parametrize("name", sorted(LISTINGS))
+def test_listing_from_cursor(name):
+    index = FakeIndex({"after": "t3_x", "position": 4, "finished": False})
+    submissions = [FakeSubmission("c")]
+    journal, calls = journal_of(index, LISTINGS[name], submissions)
+    assert list(journal) == [(5, submissions[0])]
+    assert calls == [{"params": {"after": "t3_x"}}]
@@ -0,0 +1,124 @@
+import os
+import threading
+import ffmpeg
+import pytest
+from saveddit.download_index import DownloadIndex
+from saveddit.ffmpeg_pool import FfmpegPool
+from saveddit.video_merger import VideoMerger
+
+MANIFEST = \
+'''<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" mediaPresentationDuration="PT10S">
+  <Period>
+    <AdaptationSet contentType="video">
+      <Representation id="720" bandwidth="2000000" height="720"><BaseURL>DASH_720.mp4</BaseURL></Representation>
+    </AdaptationSet>
+    <AdaptationSet contentType="audio">
+      <Representation id="audio" bandwidth="128000"><BaseURL>DASH_audio.mp4</BaseURL></Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>'''
+
+VIDEO = b"video" * 1000
+AUDIO = b"audio" * 1000
+
+
+class FakeMerger:
+    '''
+    Stands in for ffmpeg: concatenates the components, once `release` is
+    set, or writes half of the output and fails with `fail`
+    '''
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+        self.fail = False
+
+    def merge(self, video_path, audio_path, output_path):
+        self.release.wait()
+        with open(output_path, "wb") as output:
+            with open(video_path, "rb") as f:
+                output.write(f.read())
+            if self.fail:
+                raise ffmpeg.Error("ffmpeg", b"", b"Invalid data found when processing input")
+            with open(audio_path, "rb") as f:
+                output.write(f.read())
+        return VideoMerger.REMUX
+
+
+@pytest.fixture
+def merger(server, monkeypatch):
+    server.files["/abc/DASH_720.mp4"] = VIDEO
+    server.files["/abc/DASH_audio.mp4"] = AUDIO
+    merger = FakeMerger()
+    monkeypatch.setattr(VideoMerger, "merge", merger.merge)
+    return merger
+
+
+def files_in(path):
+    return sorted(name for _, _, names in os.walk(str(path)) for name in names)
+
+
+def test_merge_runs_in_background(tmp_path, download_reddit_video, merger):
+    merger.release.clear()
+    downloader = download_reddit_video(MANIFEST)
+    index = downloader.index
+
+    # The downloader returned with the merge still queued, and the post is
+    # not recorded as complete yet
+    assert index.get("abc")["status"] != DownloadIndex.STATUS_COMPLETE
+    assert DownloadIndex.STAGE_MEDIA not in index.get_stages("abc")
+
+    merger.release.set()
+    downloader.wait()
+    assert downloader.status == DownloadIndex.STATUS_COMPLETE
+    assert not downloader.needs_retry()
+    assert index.get("abc")["status"] == DownloadIndex.STATUS_COMPLETE
+    assert files_in(tmp_path / "r") == ["abc.mp4"]
+    assert [os.path.basename(f["path"]) for f in index.files("abc")] == ["abc.mp4"]
+    with open(index.files("abc")[0]["path"], "rb") as f:
+        assert f.read() == VIDEO + AUDIO
+
+
+def test_failed_merge(tmp_path, download_reddit_video, merger):
+    merger.fail = True
+    downloader = download_reddit_video(MANIFEST)
+    downloader.wait()
+    index = downloader.index
+
+    assert downloader.status == DownloadIndex.STATUS_FAILED
+    assert downloader.needs_retry()
+    assert index.get("abc")["status"] == DownloadIndex.STATUS_FAILED
+    assert DownloadIndex.STAGE_MEDIA not in index.get_stages("abc")
+    # Neither the components nor the partial output are left behind
+    assert files_in(tmp_path / "r") == []
+    assert index.files("abc") == []
+
+
+def test_merge_falls_back_to_reencoding(tmp_path, monkeypatch):
+    calls = []
+
+    def run(video_path, audio_path, output_path, **output_options):
+        calls.append(output_options)
+        with open(output_path, "wb") as f:
+            f.write(b"output")
+        if output_options.get("c") == "copy":
+            raise ffmpeg.Error("ffmpeg", b"", b"Could not find tag for codec")
+
+    monkeypatch.setattr(VideoMerger, "run", run)
+    output_path = str(tmp_path / "abc.mp4")
+
+    assert VideoMerger.merge("video.mp4", "audio.mp4", output_path) == VideoMerger.REENCODE
+    assert calls == [{"c": "copy"}, {}]
+
+
+def test_pool_shutdown_waits_for_callbacks():
+    pool = FfmpegPool(max_workers=2)
+    release = threading.Event()
+    done = []
+    for i in range(4):
+        pool.submit(release.wait, on_done=lambda future, i=i: done.append(i))
+    assert done == []
+
+    release.set()
+    pool.shutdown(wait=True)
+    assert sorted(done) == [0, 1, 2, 3]
@@ -0,0 +1,137 @@
+import pytest
+from saveddit import work_queue
+from saveddit.work_queue import RedisWorkQueue, WorkQueue, open_work_queue
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(work_queue.time, "time", clock.time)
+    return clock
+
+
+@pytest.fixture(params=["local", "sqlite", "redis"])
+def queue(request, tmp_path, monkeypatch):
+    if request.param == "local":
+        return open_work_queue("local://", max_attempts=3)
+    if request.param == "sqlite":
+        return open_work_queue("sqlite://" + str(tmp_path / "queue.db"), max_attempts=3)
+    if fakeredis == None or work_queue.redis == None:
+        pytest.skip("fakeredis (with Lua support) is not installed")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(work_queue.redis.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    return open_work_queue("redis://localhost:6379/0", max_attempts=3)
+
+
+def items(*ids):
+    return [{"id": id, "dir": "r/pics/new", "position": i} for i, id in enumerate(ids)]
+
+
+def error_of(queue, item_id):
+    if isinstance(queue, RedisWorkQueue):
+        return queue.redis.hget(RedisWorkQueue.PREFIX + "errors", item_id)
+    return queue.execute("SELECT error FROM work_items WHERE id = ?", (item_id,))[0]["error"]
+
+
+def test_put_and_lease_in_order(queue, clock):
+    assert queue.put(items("a", "b")) == 2
+    assert queue.put(items("b", "c")) == 1
+
+    assert [queue.lease("w1", 60)["id"] for _ in range(3)] == ["a", "b", "c"]
+    assert queue.lease("w1", 60) == None
+    assert queue.counts() == {WorkQueue.LEASED: 3}
+
+
+def test_complete(queue, clock):
+    queue.put(items("a"))
+    queue.lease("w1", 60)
+    queue.complete("w1", "a")
+
+    assert queue.lease("w2", 60) == None
+    assert queue.counts() == {WorkQueue.DONE: 1}
+
+
+def test_expired_lease_goes_to_another_worker(queue, clock):
+    queue.put(items("a"))
+    queue.lease("w1", 60)
+    clock.advance(59)
+    assert queue.lease("w2", 60) == None
+
+    clock.advance(2)
+    assert queue.lease("w2", 60)["id"] == "a"
+    # w1 lost its lease, it can no longer report the item
+    queue.complete("w1", "a")
+    queue.retry("w1", "a", 0)
+    assert queue.counts() == {WorkQueue.LEASED: 1}
+    queue.complete("w2", "a")
+    assert queue.counts() == {WorkQueue.DONE: 1}
+
+
+def test_heartbeat_extends_lease(queue, clock):
+    queue.put(items("a"))
+    queue.lease("w1", 60)
+    clock.advance(40)
+    queue.heartbeat("w1", ["a"], 60)
+    # Only the holder of a lease can extend it
+    queue.heartbeat("w2", ["a"], 600)
+
+    clock.advance(40)
+    assert queue.lease("w2", 60) == None
+    clock.advance(21)
+    assert queue.lease("w2", 60)["id"] == "a"
+
+
+def test_retry_after_delay(queue, clock):
+    queue.put(items("a"))
+    queue.lease("w1", 60)
+    queue.retry("w1", "a", 30, "Throttled by i.redd.it")
+
+    assert queue.counts() == {WorkQueue.QUEUED: 1}
+    assert error_of(queue, "a") == "Throttled by i.redd.it"
+    assert queue.lease("w1", 60) == None
+    clock.advance(30)
+    assert queue.lease("w1", 60)["id"] == "a"
+
+    queue.complete("w1", "a")
+    assert error_of(queue, "a") == None
+
+
+def test_max_attempts(queue, clock):
+    queue.put(items("a"))
+    for _ in range(2):
+        queue.lease("w1", 60)
+        queue.retry("w1", "a", 0, "failed to download its media")
+        assert queue.counts() == {WorkQueue.QUEUED: 1}
+
+    queue.lease("w1", 60)
+    queue.retry("w1", "a", 0, "failed to download its media")
+    assert queue.counts() == {WorkQueue.FAILED: 1}
+    assert queue.lease("w1", 60) == None
+
+
+def test_expired_leases_count_as_attempts(queue, clock):
+    queue.put(items("a"))
+    for _ in range(3):
+        assert queue.lease("w1", 60)["id"] == "a"
+        clock.advance(61)
+
+    assert queue.lease("w1", 60) == None
+    assert queue.counts() == {WorkQueue.FAILED: 1}
+    assert error_of(queue, "a") == "lease expired"